@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import json
+import os
+from typing import Tuple, Union
+
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python < 3.11
+    import tomli as tomllib
+
+from catalog import DEFAULT_CATALOG_PATH
+from llm_agent import LLMAgent, WORKFLOW_MODES, get_agent
+
+# The Streamlit secrets, shared with ui.py as defaults for the API key and the agent configuration
+SECRETS_PATH = ".streamlit/secrets.toml"
+
+# Maximum size of a request body, e.g. a very long conversation history
+MAX_BODY_BYTES = 2**20
+
+# Maximum length of the request line and of every header line, and maximum number of headers of a request
+MAX_LINE_BYTES = 2**16
+MAX_HEADERS = 100
+
+# Seconds an idle keep-alive connection is kept open
+IDLE_TIMEOUT = 60.0
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           431: "Request Header Fields Too Large", 500: "Internal Server Error", 501: "Not Implemented"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def validate_messages(body: bytes) -> list:
+    """Parse the messages of a chat request, a list of user and assistant messages ending with a user message."""
+    try:
+        request = json.loads(body)
+    except (UnicodeDecodeError, json.JSONDecodeError) as error:
+        raise HTTPError(400, f"Invalid JSON: {error}")
+
+    messages = request.get("messages") if isinstance(request, dict) else None
+    if not isinstance(messages, list) or not messages:
+        raise HTTPError(400, "'messages' must be a non-empty list.")
+    for message in messages:
+        if (not isinstance(message, dict) or message.get("role") not in ("user", "assistant")
+                or not isinstance(message.get("content"), str)):
+            raise HTTPError(400, "Every message needs a 'role' ('user' or 'assistant') and a string 'content'.")
+    if messages[-1]["role"] != "user":
+        raise HTTPError(400, "The last message must be a user message.")
+    return [{"role": message["role"], "content": message["content"]} for message in messages]
+
+
+async def read_line(reader: asyncio.StreamReader, too_long: HTTPError) -> bytes:
+    """Read a line of a request, raising too_long if it exceeds the limit of the reader."""
+    try:
+        return await reader.readline()
+    except ValueError:
+        # the reader discards the line, so the connection is closed after the error response
+        raise too_long
+
+
+class ChatServer:
+    """
+    A headless HTTP/JSON endpoint next to the Streamlit UI. All sessions are served by one agent and its async
+    workflow on a single event loop, so many concurrent sessions only cost open connections, not threads.
+
+    The server keeps no conversation state, every request carries the conversation history of its session.
+
+    Endpoints:
+        POST /chat   {"messages": [{"role": "user", "content": "..."}, ...]} -> {"response": "..."}
+        GET /health  -> {"status": "ok", "catalog_version": "..."}
+        GET /traces  -> the traces and per-node histograms, if the agent is traced
+
+    Usage:
+        python api.py --port 8000
+        curl -X POST localhost:8000/chat \
+             -d '{"messages": [{"role": "user", "content": "Wie viel wiegt XBO 4000 W/HS XL OFR?"}]}'
+    """
+
+    def __init__(self, agent: LLMAgent, host: str = "127.0.0.1", port: int = 8000):
+        self.agent = agent
+        self.host = host
+        self.port = port
+
+    async def serve_forever(self) -> None:
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port, backlog=1024,
+                                            limit=MAX_LINE_BYTES)
+        async with server:
+            print(f"Serving on http://{self.host}:{self.port}", flush=True)
+            await server.serve_forever()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer the requests of a connection until the client closes it or asks not to keep it alive."""
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), IDLE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except HTTPError as error:
+                    await self.write_response(writer, error.status, {"error": str(error)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                method, path, keep_alive, body = request
+                try:
+                    status, payload = 200, await self.route(method, path, body)
+                except HTTPError as error:
+                    status, payload = error.status, {"error": str(error)}
+                except Exception as error:
+                    status, payload = 500, {"error": f"{type(error).__name__}: {error}"}
+                await self.write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def read_request(reader: asyncio.StreamReader) -> Union[Tuple[str, str, bool, bytes], None]:
+        """Read a request as (method, path, keep_alive, body), None if the connection was closed before it."""
+        request_line = await read_line(reader, HTTPError(400, f"The request line exceeds {MAX_LINE_BYTES} bytes."))
+        if not request_line:
+            return None
+        try:
+            method, path, version = request_line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(400, "Malformed request line.")
+
+        headers = {}
+        too_large = HTTPError(431, f"A header line exceeds {MAX_LINE_BYTES} bytes.")
+        num_headers = 0
+        while (line := await read_line(reader, too_large)) not in (b"\r\n", b"\n", b""):
+            num_headers += 1
+            if num_headers > MAX_HEADERS:
+                raise HTTPError(431, f"The request has more than {MAX_HEADERS} headers.")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        # only bodies with a Content-Length are supported
+        if "transfer-encoding" in headers:
+            raise HTTPError(501, "Transfer-Encoding is not supported, send the body with a Content-Length header.")
+
+        try:
+            content_length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length header.")
+        if content_length < 0:
+            raise HTTPError(400, "Invalid Content-Length header.")
+        if content_length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"The request body exceeds {MAX_BODY_BYTES} bytes.")
+        body = await reader.readexactly(content_length) if content_length else b""
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+        return method, path.split("?")[0], keep_alive, body
+
+    @staticmethod
+    async def write_response(writer: asyncio.StreamWriter, status: int, payload: dict, keep_alive: bool) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        writer.write((f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                      "Content-Type: application/json; charset=utf-8\r\n"
+                      f"Content-Length: {len(body)}\r\n"
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + body)
+        await writer.drain()
+
+    async def route(self, method: str, path: str, body: bytes) -> dict:
+        if path == "/chat":
+            if method != "POST":
+                raise HTTPError(405, "Use POST for /chat.")
+            return {"response": await self.agent.achat(validate_messages(body))}
+        if path == "/health":
+            return {"status": "ok", "catalog_version": self.agent.catalog.version}
+        if path == "/traces":
+            if self.agent.tracer is None:
+                raise HTTPError(404, "Tracing is disabled, start the server with --tracing.")
+            return self.agent.tracer.export()
+        raise HTTPError(404, f"Unknown path '{path}'.")
+
+
+def load_secrets(path: str = SECRETS_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as file:
+        return tomllib.load(file)
+
+
+def main():
+    secrets = load_secrets()
+    parser = argparse.ArgumentParser(description="Headless HTTP/JSON endpoint of the Leuchtmittel Chatbot.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_PATH)
+    parser.add_argument("--workflow-mode", default=secrets.get("WORKFLOW_MODE", "sequential"), choices=WORKFLOW_MODES)
+    parser.add_argument("--cache-path", default=secrets.get("CACHE_PATH"))
+    parser.add_argument("--tracing", action="store_true", default=secrets.get("TRACING", False))
+    parser.add_argument("--openai-base-url", default=None,
+                        help="OpenAI-compatible server, e.g. a mock_openai.MockOpenAIServer for load tests.")
+    args = parser.parse_args()
+
+    openai_api_key = os.environ.get("OPENAI_API_KEY", secrets.get("OPENAI_API_KEY"))
+    if openai_api_key is None:
+        parser.error(f"Set the OPENAI_API_KEY environment variable or add it to {SECRETS_PATH}.")
+
+    agent = get_agent(openai_api_key=openai_api_key, catalog_path=args.catalog, workflow_mode=args.workflow_mode,
+                      cache_path=args.cache_path, tracing_enabled=args.tracing, openai_base_url=args.openai_base_url)
+    try:
+        asyncio.run(ChatServer(agent, host=args.host, port=args.port).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
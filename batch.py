@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Tuple
+
+from api import load_secrets, SECRETS_PATH
+from cache import normalize_text
+from catalog import DEFAULT_CATALOG_PATH
+from llm_agent import LLMAgent, WORKFLOW_MODES, get_agent
+
+# Number of unique questions that are routed, filtered in one pass over the catalog and answered together
+DEFAULT_CHUNK_SIZE = 256
+
+# Maximum number of concurrent LLM calls
+DEFAULT_MAX_WORKERS = 16
+
+
+def print_progress(completed: int, total: int, description: str) -> None:
+    print(f"[{completed}/{total}] {description}", flush=True)
+
+
+def read_questions(path: str) -> List[dict]:
+    """
+    Read the questions of a batch from a JSONL file with one {"id": ..., "question": "..."} object per line. The id
+    defaults to the line number, ids have to be unique since they identify the answered questions when resuming.
+    """
+    questions = []
+    ids = set()
+    with open(path, encoding='utf-8') as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if not isinstance(item, dict) or not isinstance(item.get("question"), str):
+                raise ValueError(f"Line {line_number} of {path} needs a string 'question'.")
+            question_id = str(item.get("id", line_number))
+            if question_id in ids:
+                raise ValueError(f"Line {line_number} of {path} repeats the id '{question_id}'.")
+            ids.add(question_id)
+            questions.append({"id": question_id, "question": item["question"]})
+    return questions
+
+
+def canonicalize_question(question: str) -> str:
+    """The canonical form of a question, questions with the same canonical form are answered once."""
+    return normalize_text(question)
+
+
+class AnswerLog:
+    """
+    The answers of a batch run, appended to a JSONL file and flushed to disk one by one, which is also the checkpoint
+    of the run: on resume, the questions with an answer in the file are skipped and their successful answers are reused
+    for duplicate questions. A line torn by a crash during an append is dropped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # the successful answers by the canonical form of their question
+        self.answers: Dict[str, dict] = {}
+        self.answered_ids = set()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        content = ""
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                content = file.read()
+        records = []
+        for line in content.splitlines():
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        # errors are not checkpointed, so their questions are retried on resume
+        records = [record for record in records if record.get("error") is None]
+        for record in records:
+            self.answered_ids.add(record["id"])
+            self.answers.setdefault(canonicalize_question(record["question"]), record)
+
+        if len(records) != len(content.splitlines()) or (content and not content.endswith("\n")):
+            directory = os.path.dirname(os.path.abspath(path))
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, suffix='.tmp',
+                                             delete=False) as file:
+                file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(file.name, path)
+
+    def write(self, records: List[dict]) -> None:
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+                file.flush()
+                os.fsync(file.fileno())
+            for record in records:
+                if record.get("error") is None:
+                    self.answered_ids.add(record["id"])
+                    self.answers.setdefault(canonicalize_question(record["question"]), record)
+
+
+def milliseconds(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 3)
+
+
+def run_batch(agent: LLMAgent, questions: List[dict], output_path: str, max_workers: int = DEFAULT_MAX_WORKERS,
+              chunk_size: int = DEFAULT_CHUNK_SIZE,
+              progress: Callable[[int, int, str], None] = print_progress) -> dict:
+    """
+    Answer a batch of questions and stream the answers with per-question timings to a JSONL file.
+
+    The questions are canonicalized and deduplicated, every unique question is answered once and its answer is written
+    for all of its duplicates. The unique questions are processed in chunks in three phases:
+    1. Routing and filter extraction of all questions of the chunk run concurrently in a bounded worker pool.
+    2. The filter plans of the chunk are executed in one vectorized pass over a single catalog snapshot.
+    3. The text search and response generation run concurrently, every answer is written as soon as it is complete.
+
+    The output file is the checkpoint of the run: questions already answered in it are skipped, so an interrupted run
+    resumes where it stopped. Failed questions are written with their error and retried by the next run.
+
+    Parameters:
+    agent (LLMAgent): The agent answering the questions.
+    questions (list): The {"id": ..., "question": ...} dicts of read_questions.
+    output_path (str): The JSONL file the answers are appended to.
+    max_workers (int): The maximum number of concurrent routing, extraction and response calls.
+    chunk_size (int): The number of unique questions whose filters are executed in one pass.
+    progress (callable): Called with (answered questions, total questions, description) after every answer, None to
+                         disable.
+
+    Returns:
+    dict: The number of questions, unique questions, answered, skipped (already answered) and failed questions.
+    """
+    log = AnswerLog(output_path)
+    pending = [question for question in questions if question["id"] not in log.answered_ids]
+    stats = {"questions": len(questions), "unique": len({canonicalize_question(question["question"])
+                                                          for question in questions}),
+             "skipped": len(questions) - len(pending), "answered": 0, "deduplicated": 0, "failed": 0}
+    completed = stats["skipped"]
+
+    def write(items: List[dict], result: dict, deduplicated: bool = False) -> None:
+        nonlocal completed
+        records = [{"id": item["id"], "question": item["question"], **result,
+                    "deduplicated": deduplicated or index > 0} for index, item in enumerate(items)]
+        log.write(records)
+        failed = result.get("error") is not None
+        stats["failed" if failed else "answered"] += len(records)
+        stats["deduplicated"] += 0 if failed else sum(record["deduplicated"] for record in records)
+        completed += len(records)
+        if progress is not None:
+            progress(completed, len(questions), f"{'Failed' if failed else 'Answered'}: {items[0]['question']}")
+
+    # the duplicates of every unique question, in the order of their first occurrence
+    groups: Dict[str, List[dict]] = {}
+    for question in pending:
+        groups.setdefault(canonicalize_question(question["question"]), []).append(question)
+
+    # questions answered by a previous run only need a copy of their answer
+    for canonical, items in list(groups.items()):
+        if canonical in log.answers:
+            answer = {key: value for key, value in log.answers[canonical].items()
+                      if key not in ("id", "question", "deduplicated")}
+            write(items, answer, deduplicated=True)
+            del groups[canonical]
+
+    unique = list(groups.values())
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(unique), chunk_size):
+            chunk = unique[start:start + chunk_size]
+            for items, result in answer_chunk(agent, chunk, executor):
+                write(items, result)
+    return stats
+
+
+def answer_chunk(agent: LLMAgent, chunk: List[List[dict]], executor: ThreadPoolExecutor):
+    """Answer the groups of duplicate questions of a chunk, yielding (group, result) as soon as a result is ready."""
+    def plan(question: str) -> Tuple[dict, float]:
+        start = time.perf_counter()
+        return agent.plan([{"role": "user", "content": question}]), milliseconds(start)
+
+    def answer(state: dict) -> Tuple[str, float]:
+        start = time.perf_counter()
+        return agent.answer(state), milliseconds(start)
+
+    def failure(error: BaseException, timings: dict) -> dict:
+        return {"response": None, "error": f"{type(error).__name__}: {error}", "timings_ms": timings}
+
+    # 1. route and extract the filters concurrently
+    planned = []
+    futures = {executor.submit(plan, items[0]["question"]): items for items in chunk}
+    for future in as_completed(futures):
+        try:
+            state, plan_ms = future.result()
+        except Exception as error:
+            yield futures[future], failure(error, {})
+            continue
+        planned.append((futures[future], state, {"plan": plan_ms}))
+
+    # 2. execute the filters of all retrieval questions in one pass over one catalog snapshot
+    catalog = agent.catalog.catalog
+    retrievals = []
+    errors = {}
+    for index, (items, state, timings) in enumerate(planned):
+        state['catalog'] = catalog
+        if state['chat_mode'] != "retrieval":
+            continue
+        try:
+            retrievals.append((state, catalog.filter_engine.compile(state['filters'])))
+        except ValueError as error:
+            errors[index] = error
+
+    start = time.perf_counter()
+    results = catalog.filter_engine.execute_many([plan for _, plan in retrievals])
+    for (state, _), retrieved_data in zip(retrievals, results):
+        state['retrieved_data'] = retrieved_data
+    filter_ms = milliseconds(start)
+
+    # 3. search the datasheets and generate the responses concurrently
+    futures = {}
+    for index, (items, state, timings) in enumerate(planned):
+        if index in errors:
+            yield items, failure(errors[index], timings)
+            continue
+        if state['chat_mode'] == "retrieval":
+            # the filters of the chunk are executed in one pass, so they share its duration
+            timings["filter_pass"] = filter_ms
+        futures[executor.submit(answer, state)] = (items, state, timings)
+
+    for future in as_completed(futures):
+        items, state, timings = futures[future]
+        try:
+            response, timings["answer"] = future.result()
+        except Exception as error:
+            yield items, failure(error, timings)
+            continue
+        timings["total"] = round(sum(timings.values()), 3)
+        yield items, {"response": response, "error": None, "route": state['route'], "chat_mode": state['chat_mode'],
+                      "rows": len(state['retrieved_data'] or []), "catalog_version": catalog.version,
+                      "timings_ms": timings}
+
+
+def main():
+    secrets = load_secrets()
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions and write the answers with their "
+                                                 "timings to a JSONL file. An interrupted run resumes where it stopped.")
+    parser.add_argument("questions", help='JSONL file with one {"id": ..., "question": "..."} object per line.')
+    parser.add_argument("output", help="JSONL file the answers are appended to, also the checkpoint of the run.")
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_PATH)
+    parser.add_argument("--workflow-mode", default=secrets.get("WORKFLOW_MODE", "sequential"), choices=WORKFLOW_MODES)
+    parser.add_argument("--cache-path", default=secrets.get("CACHE_PATH"))
+    parser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--openai-base-url", default=None,
+                        help="OpenAI-compatible server, e.g. a mock_openai.MockOpenAIServer.")
+    args = parser.parse_args()
+
+    openai_api_key = os.environ.get("OPENAI_API_KEY", secrets.get("OPENAI_API_KEY"))
+    if openai_api_key is None:
+        parser.error(f"Set the OPENAI_API_KEY environment variable or add it to {SECRETS_PATH}.")
+
+    agent = get_agent(openai_api_key=openai_api_key, catalog_path=args.catalog, workflow_mode=args.workflow_mode,
+                      cache_path=args.cache_path, openai_base_url=args.openai_base_url)
+    stats = run_batch(agent, read_questions(args.questions), args.output, max_workers=args.max_workers,
+                      chunk_size=args.chunk_size)
+    print(f"{stats['questions']} question(s), {stats['unique']} unique: {stats['answered']} answered "
+          f"({stats['deduplicated']} deduplicated), {stats['skipped']} already answered, {stats['failed']} failed.")
+
+
+if __name__ == "__main__":
+    main()
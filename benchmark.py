@@ -0,0 +1,732 @@
+import argparse
+import base64
+import glob
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import fitz
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from catalog import CATALOG_SCHEMA, Catalog, CatalogManager, compile_catalog
+from context import build_context
+from filtering import QUERY_OPTIONS, FilterEngine
+from fulltext import FULLTEXT_INDEX_EXTENSION, BM25Index, build_fulltext_index
+from llm_agent import LLMAgent, WORKFLOW_MODES
+from mock_openai import MockOpenAIServer, RecordedResponder, default_arguments
+from preprocessing import (EXTRACTION_MODES, INFO_TYPE_SCHEMAS, PAGE_SCHEMAS, RateLimiter, RenderOptions,
+                           clip_rect, custom_json_encoder, extract_structured_info_from_pages, ingest_pdfs, parse_fields,
+                           parse_text_layer, render_pages, text_lines)
+from tracing import Tracer
+
+# Filter dicts as produced by ExtractData for the README reference questions and multi-condition variants
+BENCHMARK_QUERIES = {
+    "name": {"name": "XBO 4000 W/HS XL OFR"},
+    "erzeugnisnummer": {"erzeugnisnummer": 4008321299963},
+    "scip_deklarationsnummer": {"scip_deklarationsnummer": "dd2ddf15-037b-4473-8156-97498e721fb3"},
+    "1 condition": {"nennleistung": {"operator": ">=", "value": 1500.0}},
+    "2 conditions": {"nennleistung": {"operator": ">=", "value": 1500.0},
+                     "lifetime": {"operator": ">", "value": 3000.0}},
+    "4 conditions": {"nennleistung": {"operator": ">=", "value": 1500.0},
+                     "lifetime": {"operator": ">", "value": 3000.0},
+                     "produktgewicht": {"operator": "<", "value": 800.0},
+                     "max_temp": {"operator": "<=", "value": 230.0}},
+    "8 conditions": {"nennleistung": {"operator": ">=", "value": 1500.0},
+                     "lifetime": {"operator": ">", "value": 1000.0},
+                     "produktgewicht": {"operator": "<", "value": 1200.0},
+                     "max_temp": {"operator": "<=", "value": 230.0},
+                     "nennstrom": {"operator": ">", "value": 20.0},
+                     "durchmesser": {"operator": ">=", "value": 40.0},
+                     "kabel_laenge": {"operator": "<", "value": 500.0},
+                     "kuehlung": "Forciert"},
+}
+
+# The README reference questions with the filters ExtractData extracts from them
+REFERENCE_QUERIES = [
+    ("Wie viel wiegt XBO 4000 W/HS XL OFR?", BENCHMARK_QUERIES["name"]),
+    ("Welche Leuchte hat SCIP Nummer dd2ddf15-037b-4473-8156-97498e721fb3?",
+     BENCHMARK_QUERIES["scip_deklarationsnummer"]),
+    ("Welche Leuchte hat die Erzeugnissnummer 4008321299963?", BENCHMARK_QUERIES["erzeugnisnummer"]),
+    ("Gebe mir alle Leuchtmittel mit mindestens 1500W und einer Lebensdauer von mehr als 3000 Stunden?",
+     BENCHMARK_QUERIES["2 conditions"]),
+]
+
+# Sorted, limited and aggregated queries, e.g. 'Welches Leuchtmittel mit mindestens 1500W ist das leichteste?'
+PUSHDOWN_QUERIES = {
+    "lightest": {"nennleistung": {"operator": ">=", "value": 1500.0},
+                 "order_by": {"column": "produktgewicht", "descending": False}, "limit": 1},
+    "top 10 lifetime": {"order_by": {"column": "lifetime", "descending": True}, "limit": 10},
+    "count": {"nennleistung": {"operator": ">=", "value": 1500.0}, "lifetime": {"operator": ">", "value": 3000.0},
+              "aggregations": [{"function": "count", "column": None, "group_by": None}]},
+    "group by brennstellung": {"aggregations": [
+        {"function": "count", "column": None, "group_by": "brennstellung"},
+        {"function": "mean", "column": "nennleistung", "group_by": "brennstellung"},
+        {"function": "max", "column": "lifetime", "group_by": "brennstellung"}]},
+}
+
+# Free-text questions answered from the free-text columns and the datasheet text
+FULLTEXT_QUERIES = [
+    "Welche Lampen haben eine Heißwiederzündung?",
+    "Wie ist die Farbtemperatur der XBO Lampen?",
+    "Was muss ich für den sicheren Gebrauch beachten?",
+    "Welche Leuchtmittel haben die Brennstellung s20/p20?",
+    "Wie groß ist die Versandschachtel der XBO 3000 W/HS XL OFR?",
+]
+
+
+def legacy_filter_dataframe(df, filters):
+    """Reference implementation of the chained masking filter the FilterEngine replaces."""
+    filtered_df = df
+
+    for column, condition in filters.items():
+        if column not in df.columns:
+            raise ValueError(f"Column '{column}' does not exist in the DataFrame.")
+
+        if condition is None:
+            continue
+
+        if isinstance(condition, dict) and 'operator' in condition and 'value' in condition:
+            operator = condition['operator']
+            value = condition['value']
+
+            if operator not in ['>', '<', '>=', '<=', '==', '!=']:
+                raise ValueError(f"Operator '{operator}' is not supported.")
+
+            if operator == '>':
+                filtered_df = filtered_df[filtered_df[column] > value]
+            elif operator == '<':
+                filtered_df = filtered_df[filtered_df[column] < value]
+            elif operator == '>=':
+                filtered_df = filtered_df[filtered_df[column] >= value]
+            elif operator == '<=':
+                filtered_df = filtered_df[filtered_df[column] <= value]
+            elif operator == '==':
+                filtered_df = filtered_df[filtered_df[column] == value]
+            elif operator == '!=':
+                filtered_df = filtered_df[filtered_df[column] != value]
+        else:
+            if isinstance(df[column].iloc[0], list):
+                filtered_df = filtered_df[filtered_df[column].apply(lambda x: condition in x)]
+            else:
+                filtered_df = filtered_df[filtered_df[column] == condition]
+
+    return filtered_df.to_dict('records') if not filtered_df.empty else None
+
+
+def scale_catalog(df: pd.DataFrame, num_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Scale a catalog to num_rows by repeating its rows, jittering the numeric columns and giving the synthetic rows
+    unique names and identifiers. The original rows are kept untouched so the reference lookups still hit.
+    """
+    rng = np.random.default_rng(seed)
+    scaled_df = df.iloc[np.arange(num_rows) % len(df)].reset_index(drop=True)
+    synthetic_rows = np.arange(num_rows) >= len(df)
+
+    for column in scaled_df.select_dtypes(include='number').columns:
+        factors = np.where(synthetic_rows, rng.uniform(0.8, 1.2, num_rows), 1.0)
+        scaled_df[column] = (scaled_df[column] * factors).round(1)
+
+    rows = np.flatnonzero(synthetic_rows)
+    scaled_df.loc[rows, 'name'] = scaled_df.loc[rows, 'name'] + [f" #{row}" for row in rows]
+    scaled_df['erzeugnisnummer'] = [numbers if row < len(df) else [9000000000000 + row]
+                                    for row, numbers in enumerate(scaled_df['erzeugnisnummer'])]
+    scaled_df['scip_deklarationsnummer'] = [numbers if row < len(df) else [f"{row:08x}-0000-4000-8000-000000000000"]
+                                            for row, numbers in enumerate(scaled_df['scip_deklarationsnummer'])]
+
+    return scaled_df
+
+
+def _best_time(function, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def benchmark_filtering(catalog_path: str = "data/illuminants.jsonl", sizes=(1_000, 10_000, 100_000),
+                        repeats: int = 5) -> list:
+    """Compare the legacy chained filter with the compiled FilterEngine on scaled catalogs."""
+    base_df = pd.read_json(catalog_path, lines=True)
+    results = []
+
+    for size in sizes:
+        df = scale_catalog(base_df, size)
+        start = time.perf_counter()
+        engine = FilterEngine(df)
+        build_time = time.perf_counter() - start
+
+        # the results of both are compared in tests/test_filtering.py
+        for query_name, filters in BENCHMARK_QUERIES.items():
+            results.append({
+                "rows": size,
+                "query": query_name,
+                "legacy_ms": _best_time(lambda: legacy_filter_dataframe(df, filters), repeats) * 1000,
+                "engine_ms": _best_time(lambda: engine.filter(filters), repeats) * 1000,
+                "engine_mask_ms": _best_time(lambda: engine.compile(filters).mask(), repeats) * 1000,
+                "engine_build_ms": build_time * 1000,
+            })
+
+    return results
+
+
+def write_scaled_catalog(base_df: pd.DataFrame, num_rows: int, path: str) -> pd.DataFrame:
+    """Write a scaled catalog as JSONL, rounding the jittered integer columns back to integers, and return it."""
+    df = scale_catalog(base_df, num_rows)
+    for field in CATALOG_SCHEMA:
+        if pa.types.is_integer(field.type) and field.name in df:
+            df[field.name] = df[field.name].round().astype('Int64')
+    df.to_json(path, orient='records', lines=True, force_ascii=False)
+    return df
+
+
+def benchmark_catalog(catalog_path: str = "data/illuminants.jsonl", sizes=(1_000, 10_000, 100_000)) -> list:
+    """
+    Compare the startup time and memory of parsing the JSONL catalog into a DataFrame with compiling it once and
+    memory-mapping the compiled Arrow catalog on scaled catalogs.
+    """
+    base_df = pd.read_json(catalog_path, lines=True, convert_dates=False)
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = os.path.join(directory, f"catalog_{size}.jsonl")
+            write_scaled_catalog(base_df, size, path)
+
+            start = time.perf_counter()
+            FilterEngine(pd.read_json(path, lines=True))
+            jsonl_load_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            compiled_path = compile_catalog(path)
+            compile_time = time.perf_counter() - start
+
+            allocated_bytes = pa.total_allocated_bytes()
+            start = time.perf_counter()
+            catalog = Catalog(path)
+            mmap_load_time = time.perf_counter() - start
+            mmap_allocated_bytes = pa.total_allocated_bytes() - allocated_bytes
+
+            start = time.perf_counter()
+            catalog.filter_engine.filter(BENCHMARK_QUERIES["erzeugnisnummer"])
+            first_lookup_time = time.perf_counter() - start
+
+            results.append({
+                "rows": size,
+                "jsonl_mb": os.path.getsize(path) / 2**20,
+                "arrow_mb": os.path.getsize(compiled_path) / 2**20,
+                "jsonl_load_ms": jsonl_load_time * 1000,
+                "compile_ms": compile_time * 1000,
+                "mmap_load_ms": mmap_load_time * 1000,
+                "mmap_allocated_mb": mmap_allocated_bytes / 2**20,
+                "first_lookup_ms": first_lookup_time * 1000,
+            })
+
+    return results
+
+
+def benchmark_pushdown(catalog_path: str = "data/illuminants.jsonl", sizes=(1_000, 10_000, 100_000),
+                       repeats: int = 5) -> list:
+    """
+    Compare sorting, limiting and aggregating in the FilterEngine with returning every matching row to the prompt,
+    by the time to compute the result and the tokens of the context built from it.
+    """
+    base_df = pd.read_json(catalog_path, lines=True)
+    results = []
+
+    for size in sizes:
+        engine = FilterEngine(scale_catalog(base_df, size))
+        for query_name, query in PUSHDOWN_QUERIES.items():
+            filters = {column: condition for column, condition in query.items() if column not in QUERY_OPTIONS}
+            all_rows, rows = engine.filter(filters), engine.filter(query)
+            results.append({
+                "rows": size,
+                "query": query_name,
+                "filter_ms": _best_time(lambda: engine.filter(filters), repeats) * 1000,
+                "pushdown_ms": _best_time(lambda: engine.filter(query), repeats) * 1000,
+                "filter_rows": len(all_rows or []),
+                "pushdown_rows": len(rows or []),
+                "filter_context_tokens": build_context(all_rows, query)[1]["tokens"],
+                "pushdown_context_tokens": build_context(rows, query)[1]["tokens"],
+            })
+
+    return results
+
+
+def benchmark_fulltext(catalog_path: str = "data/illuminants.jsonl", pdfs_dir: str = "data", repeats: int = 5,
+                       k: int = 5) -> list:
+    """Measure building, persisting and loading the BM25 index of the catalog and ranking free-text questions."""
+    catalog = Catalog(catalog_path)
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "catalog" + FULLTEXT_INDEX_EXTENSION)
+        start = time.perf_counter()
+        index = build_fulltext_index(catalog.table, pdfs_dir, version=catalog.version)
+        build_time = time.perf_counter() - start
+        index.save(path)
+        load_time = _best_time(lambda: BM25Index.load(path), repeats)
+        index_size = os.path.getsize(path)
+
+    for query in FULLTEXT_QUERIES:
+        passages = index.search(query, k=k)
+        results.append({
+            "query": query,
+            "search_ms": _best_time(lambda: index.search(query, k=k), repeats) * 1000,
+            "passages": len(passages),
+            "top_passage": f"{passages[0]['file_name']} p. {passages[0]['page']}" if passages else None,
+            "chunks": len(index.chunks),
+            "build_ms": build_time * 1000,
+            "load_ms": load_time * 1000,
+            "index_kb": index_size / 1024,
+        })
+
+    return results
+
+
+def retrieval_responder(request: dict) -> str:
+    """Mock responder that routes every structured request to the 'retrieval' chat mode."""
+    if not request.get('tools'):
+        return "Das XBO 4000 W/HS XL OFR wiegt 1030 Gramm."
+
+    arguments = default_arguments(request['tools'][0]['function']['parameters'])
+    if 'chat_mode' in arguments:
+        arguments['chat_mode'] = "retrieval"
+    return json.dumps(arguments)
+
+
+def benchmark_workflow_modes(latency: float = 0.2, turns: int = 10, trace_dir: str = None) -> list:
+    """
+    Compare the turn latency of the workflow modes against a mock OpenAI server with a fixed latency per call.
+
+    The workflow modes are compared with the fast path disabled, since the query would otherwise skip the LLM routing
+    in every mode, the last row measures the fast path on its own. The turns are traced, the traces and per-node
+    histograms of every mode are exported as JSON to trace_dir if given.
+    """
+    messages = [{"role": "user", "content": "Wie viel wiegt XBO 4000 W/HS XL OFR?"}]
+    results = []
+
+    with MockOpenAIServer(responder=retrieval_responder, latency=latency) as server:
+        for workflow_mode, fast_path in [(mode, False) for mode in WORKFLOW_MODES] + [("sequential", True)]:
+            tracer = Tracer()
+            agent = LLMAgent(openai_api_key="mock", openai_base_url=server.base_url, workflow_mode=workflow_mode,
+                             fast_path=fast_path, tracer=tracer)
+            requests_before = len(server.requests)
+            timings = []
+            for _ in range(turns):
+                start = time.perf_counter()
+                agent.chat(messages)
+                timings.append(time.perf_counter() - start)
+
+            agent.close()
+
+            histograms = tracer.histograms()
+            results.append({
+                "workflow_mode": workflow_mode,
+                "fast_path": fast_path,
+                "llm_calls_per_turn": (len(server.requests) - requests_before) / turns,
+                "p50_ms": np.percentile(timings, 50) * 1000,
+                "p95_ms": np.percentile(timings, 95) * 1000,
+                "tokens_per_turn": (histograms["turn"]["prompt_tokens"]
+                                    + histograms["turn"]["completion_tokens"]) / turns,
+                "slowest_node": max((name for name in histograms if name != "turn" and not name.startswith("llm.")),
+                                    key=lambda name: histograms[name]["p50_ms"]),
+            })
+            if trace_dir is not None:
+                os.makedirs(trace_dir, exist_ok=True)
+                name = "fast_path" if fast_path else workflow_mode
+                tracer.export_json(os.path.join(trace_dir, f"workflow_{name}.json"))
+
+    return results
+
+
+def build_query_corpus(df: pd.DataFrame, num_queries: int = 200, seed: int = 0) -> List[dict]:
+    """
+    Build a query corpus of the README reference questions and synthetic variants over the rows of a (scaled)
+    catalog, each with the chat mode and filters recorded as the LLM would extract them.
+
+    Parameters:
+    df (pd.DataFrame): The catalog the questions refer to, e.g. a scale_catalog result.
+    num_queries (int): The number of queries, the reference questions included.
+    seed (int): The seed of the sampled rows and templates.
+
+    Returns:
+    list: Dicts with the 'question', its 'chat_mode' and its 'extract_data' filters.
+    """
+    rng = np.random.default_rng(seed)
+    corpus = [{"question": question, "chat_mode": "retrieval", "extract_data": filters}
+              for question, filters in REFERENCE_QUERIES]
+
+    while len(corpus) < num_queries:
+        row = df.iloc[int(rng.integers(len(df)))]
+        power = float(rng.choice([500, 1000, 1500, 2000, 3000]))
+        lifetime = float(rng.choice([1000, 2000, 3000]))
+        template = len(corpus) % 7
+        if template == 0:
+            question, filters = f"Wie schwer ist die {row['name']}?", {"name": row['name']}
+        elif template == 1:
+            question = f"Zu welchem Leuchtmittel gehört die Erzeugnisnummer {row['erzeugnisnummer'][0]}?"
+            filters = {"erzeugnisnummer": int(row['erzeugnisnummer'][0])}
+        elif template == 2:
+            question = f"Welches Leuchtmittel hat die SCIP Deklarationsnummer {row['scip_deklarationsnummer'][0]}?"
+            filters = {"scip_deklarationsnummer": row['scip_deklarationsnummer'][0]}
+        elif template == 3:
+            question = (f"Zeige mir Leuchtmittel mit mindestens {power:.0f}W und mehr als {lifetime:.0f} Stunden "
+                        f"Lebensdauer (Anfrage {len(corpus)})")
+            filters = {"nennleistung": {"operator": ">=", "value": power},
+                       "lifetime": {"operator": ">", "value": lifetime}}
+        elif template == 4:
+            question = f"Welches Leuchtmittel mit mindestens {power:.0f}W ist das leichteste (Anfrage {len(corpus)})?"
+            filters = {"nennleistung": {"operator": ">=", "value": power},
+                       "order_by": {"column": "produktgewicht", "descending": False}, "limit": 1}
+        elif template == 5:
+            question = f"Wie viele Leuchtmittel mit mehr als {lifetime:.0f} Stunden gibt es je Brennstellung?"
+            filters = {"lifetime": {"operator": ">", "value": lifetime},
+                       "aggregations": [{"function": "count", "column": None, "group_by": "brennstellung"}]}
+        else:
+            question, filters = f"Hallo, was kannst du alles? (Anfrage {len(corpus)})", None
+        corpus.append({"question": question, "chat_mode": "retrieval" if filters else "chit-chat",
+                       "extract_data": filters})
+
+    return corpus
+
+
+def _percentile_ms(timings: List[float], percentile: float) -> float:
+    return float(np.percentile(timings, percentile) * 1000)
+
+
+def benchmark_end_to_end(catalog_path: str = "data/illuminants.jsonl", sizes=(1_000, 10_000, 100_000),
+                         latency: float = 0.2, turns: int = 100, concurrency=(1, 8, 32), pdfs_dir: str = "data",
+                         max_pdfs: int = None) -> dict:
+    """
+    Replay a query corpus through the whole agent against a mock OpenAI server with recorded structured responses,
+    on scaled catalogs and with concurrent sessions, and ingest the datasheets against the same server.
+
+    Parameters:
+    catalog_path (str): The catalog scaled to the sizes and the source of the README reference questions.
+    sizes (iterable): The numbers of catalog rows.
+    latency (float): The mock OpenAI latency per call in seconds.
+    turns (int): The number of replayed turns per catalog size and number of concurrent sessions.
+    concurrency (iterable): The numbers of concurrent sessions.
+    pdfs_dir (str): The directory with the datasheets to ingest.
+    max_pdfs (int or None): The maximum number of ingested datasheets, None for all.
+
+    Returns:
+    dict: The 'turns' results per catalog size and number of sessions and the 'ingestion' results per extraction mode.
+    """
+    base_df = pd.read_json(catalog_path, lines=True, convert_dates=False)
+    results = {"turns": [], "ingestion": []}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = os.path.join(directory, f"catalog_{size}.jsonl")
+            corpus = build_query_corpus(write_scaled_catalog(base_df, size, path), num_queries=turns)
+            recordings = {query["question"]: query for query in corpus}
+            catalog = CatalogManager(path)
+
+            with MockOpenAIServer(responder=RecordedResponder(recordings), latency=latency) as server:
+                for sessions in concurrency:
+                    tracer = Tracer()
+                    agent = LLMAgent(openai_api_key="mock", catalog=catalog, openai_base_url=server.base_url,
+                                     tracer=tracer)
+
+                    def turn(query: dict) -> float:
+                        start = time.perf_counter()
+                        agent.chat([{"role": "user", "content": query["question"]}])
+                        return time.perf_counter() - start
+
+                    requests_before = len(server.requests)
+                    start = time.perf_counter()
+                    with ThreadPoolExecutor(max_workers=sessions) as executor:
+                        timings = list(executor.map(turn, corpus))
+                    wall_time = time.perf_counter() - start
+                    agent.close()
+
+                    filter_histogram = tracer.histograms().get("filter", {})
+                    results["turns"].append({
+                        "rows": size,
+                        "sessions": sessions,
+                        "p50_ms": _percentile_ms(timings, 50),
+                        "p95_ms": _percentile_ms(timings, 95),
+                        "turns_per_s": len(corpus) / wall_time,
+                        "filter_p50_ms": filter_histogram.get("p50_ms"),
+                        "filter_p95_ms": filter_histogram.get("p95_ms"),
+                        "llm_calls_per_turn": (len(server.requests) - requests_before) / len(corpus),
+                        "fast_path_rate": agent.route_counts["fast_path"] / len(corpus),
+                    })
+
+    pdf_paths = sorted(glob.glob(os.path.join(pdfs_dir, "*.pdf")))[:max_pdfs]
+    with MockOpenAIServer(latency=latency) as server:
+        for extraction_mode in EXTRACTION_MODES:
+            requests_before = len(server.requests)
+            start = time.perf_counter()
+            # without rate limits, so the timings measure the extraction and not the wait for the token bucket
+            ingest_pdfs(pdf_paths, openai_api_key="mock", openai_base_url=server.base_url,
+                        extraction_mode=extraction_mode, progress=None, rate_limiter=RateLimiter(None, None))
+            wall_time = time.perf_counter() - start
+            results["ingestion"].append({
+                "extraction_mode": extraction_mode,
+                "pdfs": len(pdf_paths),
+                "per_pdf_ms": wall_time / len(pdf_paths) * 1000 if pdf_paths else None,
+                "llm_calls_per_pdf": (len(server.requests) - requests_before) / len(pdf_paths) if pdf_paths else None,
+            })
+
+    return results
+
+
+# Metrics of the end-to-end benchmark compared with the baseline and whether higher values are better
+BASELINE_METRICS = {"p50_ms": False, "p95_ms": False, "turns_per_s": True, "filter_p50_ms": False,
+                    "filter_p95_ms": False, "per_pdf_ms": False}
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float = 0.2) -> pd.DataFrame:
+    """
+    Compare end-to-end results with a stored baseline by the ratio of every metric to its baseline value.
+
+    Parameters:
+    results (dict): The benchmark_end_to_end results with the 'config' of the run.
+    baseline (dict): Earlier results with their 'config', e.g. loaded from benchmark_baseline.json.
+    tolerance (float): The relative change of a metric beyond which it counts as a regression.
+
+    Returns:
+    pd.DataFrame: One row per metric found in both, with the 'ratio' to the baseline and a 'regression' flag.
+    """
+    if results.get("config") != baseline.get("config"):
+        raise ValueError(f"The benchmark configuration {results.get('config')} differs from the baseline "
+                         f"configuration {baseline.get('config')}, run it with the options of the baseline.")
+
+    comparison = []
+    for section, keys in (("turns", ("rows", "sessions")), ("ingestion", ("extraction_mode", "pdfs"))):
+        baseline_rows = {tuple(row[key] for key in keys): row for row in baseline.get(section, [])}
+        for row in results.get(section, []):
+            baseline_row = baseline_rows.get(tuple(row[key] for key in keys))
+            if baseline_row is None:
+                continue
+            for metric, higher_is_better in BASELINE_METRICS.items():
+                if row.get(metric) is None or not baseline_row.get(metric):
+                    continue
+                ratio = row[metric] / baseline_row[metric]
+                comparison.append({
+                    "benchmark": " ".join(f"{key}={row[key]}" for key in keys),
+                    "metric": metric,
+                    "baseline": baseline_row[metric],
+                    "current": row[metric],
+                    "ratio": ratio,
+                    "regression": ratio < 1 - tolerance if higher_is_better else ratio > 1 + tolerance,
+                })
+    if not comparison:
+        raise ValueError("No benchmark result matches a baseline result.")
+    return pd.DataFrame(comparison)
+
+
+def benchmark_extraction(pdfs_dir: str = "data", catalog_path: str = "data/illuminants.jsonl") -> list:
+    """
+    Parse the text layer of every datasheet offline and compare the fields with the catalog.
+
+    Reports the parse time per PDF, the fields that would need the vision fallback and the fields that differ from
+    the catalog record of the same file, e.g. OCR errors of the vision extraction.
+    """
+    with open(catalog_path, encoding='utf-8') as file:
+        catalog = {record['file_name']: record for record in map(json.loads, file)}
+    results = []
+
+    for pdf_path in sorted(glob.glob(os.path.join(pdfs_dir, "*.pdf"))):
+        start = time.perf_counter()
+        data, missing_fields = parse_text_layer(pdf_path)
+        parse_time = time.perf_counter() - start
+
+        # compare the JSON representation, as stored in the catalog
+        data = json.loads(json.dumps(data, default=custom_json_encoder))
+        record = catalog.get(os.path.basename(pdf_path), {})
+        results.append({
+            "file_name": os.path.basename(pdf_path),
+            "parse_ms": parse_time * 1000,
+            "missing_fields": ", ".join(field_name for field_names in missing_fields.values()
+                                        for field_name in field_names),
+            "differing_fields": ", ".join(field_name for field_name, value in data.items()
+                                          if field_name in record and record[field_name] != value),
+        })
+
+    return results
+
+
+# Rendering configurations compared by the payload benchmark, the first one is the former whole page rendering
+PAYLOAD_CONFIGS = [
+    RenderOptions(clip=False, dpi=72, image_format="png"),
+    RenderOptions(clip=False, dpi=150, image_format="png"),
+    RenderOptions(clip=True, dpi=72, image_format="png"),
+    RenderOptions(clip=True, dpi=100, image_format="png"),
+    RenderOptions(clip=True, dpi=150, image_format="png"),
+    RenderOptions(clip=True, dpi=150, image_format="jpeg", jpeg_quality=85),
+    RenderOptions(clip=True, dpi=150, image_format="jpeg", jpeg_quality=60),
+    RenderOptions(clip=True, dpi=200, image_format="png"),
+]
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Estimate the input tokens of an image with high detail: 85 plus 170 per 512 px tile of the scaled image."""
+    scale = min(1.0, 2048 / max(width, height))
+    scale *= min(1.0, 768 / (min(width, height) * scale))
+    return 85 + 170 * math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+
+
+def clip_coverage(pdf_path: str) -> float:
+    """The fraction of fields whose value is parsed identically from the region of its info type as from the page."""
+    pdf_document = fitz.open(pdf_path)
+    try:
+        covered, total = 0, 0
+        for info_type, (schema, page) in INFO_TYPE_SCHEMAS.items():
+            pdf_page = pdf_document.load_page(page)
+            expected = parse_fields(schema, text_lines(pdf_page))
+            clipped = parse_fields(schema, text_lines(pdf_page, clip=clip_rect(pdf_page, [info_type])))
+            covered += sum(clipped.get(field_name) == value for field_name, value in expected.items())
+            total += len(expected)
+        return covered / total
+    finally:
+        pdf_document.close()
+
+
+def benchmark_payload(pdfs_dir: str = "data", configs=PAYLOAD_CONFIGS, openai_api_key: str = None,
+                      llm_model_name: str = "gpt-4o", max_pdfs: int = None) -> list:
+    """
+    Compare the page images of the rendering configurations by their size, estimated vision tokens and render time.
+
+    The clip coverage checks offline that the clip regions contain the text of all fields. With an OpenAI API key,
+    every PDF is also extracted with one vision call per page and the accuracy is the fraction of fields matching the
+    text layer.
+    """
+    pdf_paths = sorted(glob.glob(os.path.join(pdfs_dir, "*.pdf")))[:max_pdfs]
+    coverage = np.mean([clip_coverage(pdf_path) for pdf_path in pdf_paths])
+    llm_client = None
+    if openai_api_key is not None:
+        import instructor
+        from openai import OpenAI
+        llm_client = instructor.from_openai(OpenAI(api_key=openai_api_key))
+    results = []
+
+    for config in configs:
+        payload_bytes, tokens, render_times, accuracies = [], [], [], []
+        for pdf_path in pdf_paths:
+            start = time.perf_counter()
+            images = render_pages(pdf_path=pdf_path, pages=list(PAGE_SCHEMAS), render_options=config)
+            render_times.append(time.perf_counter() - start)
+            payload_bytes.append(sum(len(image) for image in images.values()))
+            pixmaps = [fitz.Pixmap(base64.b64decode(image)) for image in images.values()]
+            tokens.append(sum(estimate_image_tokens(pixmap.width, pixmap.height) for pixmap in pixmaps))
+
+            if llm_client is not None:
+                expected = json.loads(json.dumps(parse_text_layer(pdf_path)[0], default=custom_json_encoder))
+                extracted = {}
+                for extracted_data in extract_structured_info_from_pages(
+                        pdf_path=pdf_path, openai_api_key=openai_api_key, llm_model_name=llm_model_name,
+                        llm_client=llm_client, render_options=config):
+                    extracted.update(json.loads(extracted_data.json()))
+                accuracies.append(np.mean([extracted.get(field_name) == value for field_name, value in expected.items()]))
+
+        results.append({
+            "clip": config.clip,
+            "dpi": config.dpi,
+            "format": config.image_format if config.image_format == "png" else f"jpeg q{config.jpeg_quality}",
+            "kb_per_pdf": np.mean(payload_bytes) / 1024,
+            "image_tokens_per_pdf": np.mean(tokens),
+            "render_ms_per_pdf": np.mean(render_times) * 1000,
+            "clip_coverage": coverage if config.clip else 1.0,
+            "accuracy": np.mean(accuracies) if accuracies else np.nan,
+        })
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the Leuchtmittel Chatbot.")
+    parser.add_argument("--catalog", default="data/illuminants.jsonl")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock OpenAI latency per call in seconds.")
+    parser.add_argument("--turns", type=int, default=None,
+                        help="Turns per workflow mode (default 10) or per end-to-end configuration (default 100).")
+    parser.add_argument("--trace-dir", default=None, help="Export the traces of the workflow modes as JSON files.")
+    parser.add_argument("--pdfs-dir", default="data")
+    parser.add_argument("--max-pdfs", type=int, default=None)
+    parser.add_argument("--accuracy", action="store_true",
+                        help="Measure the vision extraction accuracy of the payload configurations with the OpenAI API "
+                             "key from the OPENAI_API_KEY environment variable.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32],
+                        help="Numbers of concurrent sessions of the end-to-end benchmark.")
+    parser.add_argument("--baseline", default=None,
+                        help="Compare the end-to-end results with this baseline JSON file and exit with status 1 on "
+                             "regressions.")
+    parser.add_argument("--save-baseline", default=None, help="Save the end-to-end results as baseline JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative change of a metric beyond which it counts as a regression.")
+    parser.add_argument("benchmarks", nargs="*", default=["filtering", "workflow_modes", "extraction", "payload",
+                                                       "catalog", "pushdown", "fulltext"],
+                        choices=["filtering", "workflow_modes", "extraction", "payload", "catalog", "pushdown",
+                                 "fulltext", "e2e"])
+    args = parser.parse_args()
+
+    if "filtering" in args.benchmarks:
+        results = benchmark_filtering(catalog_path=args.catalog, sizes=args.sizes, repeats=args.repeats)
+        print(pd.DataFrame(results).to_string(index=False, float_format="%.3f"))
+
+    if "workflow_modes" in args.benchmarks:
+        results = benchmark_workflow_modes(latency=args.latency, turns=args.turns or 10, trace_dir=args.trace_dir)
+        print(pd.DataFrame(results).to_string(index=False, float_format="%.3f"))
+
+    if "extraction" in args.benchmarks:
+        results = benchmark_extraction(pdfs_dir=args.pdfs_dir, catalog_path=args.catalog)
+        print(pd.DataFrame(results).to_string(index=False, float_format="%.3f"))
+
+    if "payload" in args.benchmarks:
+        results = benchmark_payload(pdfs_dir=args.pdfs_dir, max_pdfs=args.max_pdfs,
+                                    openai_api_key=os.environ["OPENAI_API_KEY"] if args.accuracy else None)
+        print(pd.DataFrame(results).to_string(index=False, float_format="%.3f"))
+
+    if "pushdown" in args.benchmarks:
+        results = benchmark_pushdown(catalog_path=args.catalog, sizes=args.sizes, repeats=args.repeats)
+        print(pd.DataFrame(results).to_string(index=False, float_format="%.3f"))
+
+    if "fulltext" in args.benchmarks:
+        results = benchmark_fulltext(catalog_path=args.catalog, pdfs_dir=args.pdfs_dir, repeats=args.repeats)
+        print(pd.DataFrame(results).to_string(index=False, float_format="%.3f"))
+
+    if "catalog" in args.benchmarks:
+        results = benchmark_catalog(catalog_path=args.catalog, sizes=args.sizes)
+        print(pd.DataFrame(results).to_string(index=False, float_format="%.3f"))
+
+    if "e2e" in args.benchmarks:
+        config = {"sizes": args.sizes, "latency": args.latency, "turns": args.turns or 100,
+                  "concurrency": args.concurrency, "max_pdfs": args.max_pdfs}
+        results = benchmark_end_to_end(catalog_path=args.catalog, sizes=args.sizes, latency=args.latency,
+                                       turns=config["turns"], concurrency=args.concurrency, pdfs_dir=args.pdfs_dir,
+                                       max_pdfs=args.max_pdfs)
+        results = {"config": config, **results}
+        print(pd.DataFrame(results["turns"]).to_string(index=False, float_format="%.3f"))
+        print(pd.DataFrame(results["ingestion"]).to_string(index=False, float_format="%.3f"))
+
+        if args.save_baseline is not None:
+            with open(args.save_baseline, 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+
+        if args.baseline is not None:
+            with open(args.baseline, encoding='utf-8') as file:
+                baseline = json.load(file)
+            try:
+                comparison = compare_with_baseline(results, baseline, tolerance=args.tolerance)
+            except ValueError as error:
+                sys.exit(f"Can not compare with the baseline {args.baseline}: {error}")
+            print(comparison.to_string(index=False, float_format="%.3f"))
+            if comparison["regression"].any():
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
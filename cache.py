@@ -0,0 +1,135 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Union
+
+from langchain_core.messages import BaseMessage
+
+# Number of most recent messages the cache keys are built from
+DEFAULT_TAIL_MESSAGES = 3
+
+
+def normalize_text(text: str) -> str:
+    """Normalize a message for cache keys, so near-identical questions share an entry."""
+    return " ".join(text.lower().split()).rstrip("?!. ")
+
+
+def cache_key(kind: str, messages: List[BaseMessage], version: str = "",
+              tail_messages: Union[int, None] = DEFAULT_TAIL_MESSAGES, summary: Union[str, None] = None) -> str:
+    """
+    Build a cache key from the kind of the cached result, the normalized conversation tail and a version.
+
+    Parameters:
+    kind (str): What is cached, e.g. 'chat_mode', 'extract_data' or 'response', including the model name.
+    messages (list): The conversation.
+    version (str): The catalog version for results depending on the catalog, so they are invalidated when it changes.
+    tail_messages (int): The number of most recent messages the result depends on, None for all messages.
+    summary (str): The rolling summary of the older messages the result also depends on, if any.
+
+    Returns:
+    str: The hex digest of the key.
+    """
+    tail = messages if tail_messages is None else messages[-tail_messages:]
+    parts = [kind, version, [(message.type, normalize_text(message.content)) for message in tail]]
+    if summary is not None:
+        parts.append(summary)
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+class Cache(ABC):
+    """Base class of the cache backends with hit and miss counters. Values have to be JSON serializable."""
+
+    def __init__(self, max_size: int, ttl: Union[float, None]):
+        self.max_size = max_size
+        # seconds until an entry expires, None to keep entries until they are evicted
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    @abstractmethod
+    def get(self, key: str, default=None):
+        """Return the value of a key, or the default if it is missing or expired."""
+
+    @abstractmethod
+    def set(self, key: str, value) -> None:
+        """Store the value of a key, evicting the least recently used entries beyond max_size."""
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class LRUCache(Cache):
+    """An in-memory least recently used cache with a bounded size and a time to live."""
+
+    def __init__(self, max_size: int = 1024, ttl: Union[float, None] = 24 * 3600):
+        super().__init__(max_size=max_size, ttl=ttl)
+        self._entries = OrderedDict()
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[1]):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return json.loads(entry[0])
+
+    def set(self, key: str, value) -> None:
+        with self._lock:
+            self._entries[key] = (json.dumps(value), time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class DiskCache(Cache):
+    """An on-disk least recently used cache backed by SQLite, shared across restarts and processes."""
+
+    def __init__(self, path: str, max_size: int = 100_000, ttl: Union[float, None] = 7 * 24 * 3600,
+                 table: str = "cache"):
+        super().__init__(max_size=max_size, ttl=ttl)
+        self.path = path
+        # caches in separate tables of one database have separate entries, sizes and stats
+        if not table.isidentifier():
+            raise ValueError(f"Table name '{table}' is not a valid identifier.")
+        self.table = table
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                                     "(key TEXT PRIMARY KEY, value TEXT, stored_at REAL, accessed_at REAL)")
+
+    def get(self, key: str, default=None):
+        with self._lock, self._connection:
+            row = self._connection.execute(f"SELECT value, stored_at FROM {self.table} WHERE key = ?",
+                                           (key,)).fetchone()
+            if row is None or self._expired(row[1]):
+                self._connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.misses += 1
+                return default
+
+            self._connection.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, value) -> None:
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)",
+                                     (key, json.dumps(value), now, now))
+            size = self._connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            if size > self.max_size:
+                self._connection.execute(f"DELETE FROM {self.table} WHERE key IN "
+                                         f"(SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)",
+                                         (size - self.max_size,))
@@ -0,0 +1,269 @@
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from datetime import date
+from typing import Dict, Union
+
+import pyarrow as pa
+
+from filtering import FilterEngine
+from fulltext import BM25Index, load_fulltext_index
+
+DEFAULT_CATALOG_PATH = "data/illuminants.jsonl"
+
+# Extension of the compiled catalog written next to its JSONL file
+COMPILED_CATALOG_EXTENSION = ".arrow"
+
+# Free-text columns with few distinct values, stored dictionary encoded
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+# The explicit schema of the compiled catalog. List columns are stored as their flattened values plus offsets.
+CATALOG_SCHEMA = pa.schema([
+    pa.field("name", pa.string()),
+    pa.field("nennstrom", pa.float64()),
+    pa.field("min_stromsteuerbereich", pa.int64()),
+    pa.field("max_stromsteuerbereich", pa.int64()),
+    pa.field("nennleistung", pa.float64()),
+    pa.field("nennspannung", pa.float64()),
+    pa.field("durchmesser", pa.float64()),
+    pa.field("laenge", pa.float64()),
+    pa.field("laenge_sockel", pa.float64()),
+    pa.field("abstand_lichtschwerpunkt", pa.float64()),
+    pa.field("elektrodenabstand_kalt", pa.float64()),
+    pa.field("produktgewicht", pa.float64()),
+    pa.field("kabel_laenge", pa.float64()),
+    pa.field("max_temp", pa.int64()),
+    pa.field("lifetime", pa.int64()),
+    pa.field("warranty", pa.int64()),
+    pa.field("sockel_anode", CATEGORY),
+    pa.field("sockel_kathode", CATEGORY),
+    pa.field("anmerkung_produkt", CATEGORY),
+    pa.field("kuehlung", CATEGORY),
+    pa.field("brennstellung", CATEGORY),
+    pa.field("datum_deklaration", pa.date32()),
+    pa.field("erzeugnisnummer", pa.list_(pa.int64())),
+    pa.field("stoff_kandidatenliste", CATEGORY),
+    pa.field("stoff_cas_nr", CATEGORY),
+    pa.field("info_sicherer_gebrauch", CATEGORY),
+    pa.field("scip_deklarationsnummer", pa.list_(pa.string())),
+    pa.field("file_name", pa.string()),
+])
+
+
+def compiled_catalog_path(path: str) -> str:
+    return os.path.splitext(path)[0] + COMPILED_CATALOG_EXTENSION
+
+
+def _source_metadata(path: str) -> Dict[bytes, bytes]:
+    stat = os.stat(path)
+    return {b"source_size": str(stat.st_size).encode(), b"source_mtime_ns": str(stat.st_mtime_ns).encode()}
+
+
+def compile_catalog(path: str = DEFAULT_CATALOG_PATH, compiled_path: str = None) -> str:
+    """
+    Compile a JSONL catalog into an uncompressed Arrow IPC file with the explicit CATALOG_SCHEMA.
+
+    The file is written atomically, so readers that memory-mapped the previous version keep a consistent view. Its
+    schema metadata holds the catalog version (a hash of the JSONL content) and the size and modification time of the
+    JSONL file, to detect when it has to be compiled again.
+
+    Parameters:
+    path (str): The JSONL catalog.
+    compiled_path (str): The compiled catalog, defaults to the JSONL path with the extension '.arrow'.
+
+    Returns:
+    str: The path of the compiled catalog.
+    """
+    compiled_path = compiled_path if compiled_path is not None else compiled_catalog_path(path)
+    metadata = _source_metadata(path)
+    with open(path, 'rb') as file:
+        content = file.read()
+    metadata[b"version"] = hashlib.sha256(content).hexdigest()[:16].encode()
+
+    records = [json.loads(line) for line in content.splitlines() if line.strip()]
+    unknown_columns = {column for record in records for column in record} - set(CATALOG_SCHEMA.names)
+    if unknown_columns:
+        raise ValueError(f"Columns {sorted(unknown_columns)} are not part of the catalog schema.")
+
+    arrays = []
+    for field in CATALOG_SCHEMA:
+        values = [record.get(field.name) for record in records]
+        if pa.types.is_date(field.type):
+            values = [date.fromisoformat(value) if isinstance(value, str) else value for value in values]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=field.type.value_type).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    table = pa.Table.from_arrays(arrays, schema=CATALOG_SCHEMA.with_metadata(metadata))
+
+    directory = os.path.dirname(os.path.abspath(compiled_path))
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(file_descriptor)
+    try:
+        with pa.OSFile(temporary_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(temporary_path, compiled_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+    return compiled_path
+
+
+def is_compiled_catalog_current(path: str, compiled_path: str) -> bool:
+    """Check whether a compiled catalog was compiled from the current content of its JSONL file."""
+    if not os.path.exists(compiled_path):
+        return False
+    try:
+        with pa.memory_map(compiled_path, 'r') as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except pa.ArrowInvalid:
+        return False
+    return all(metadata.get(key) == value for key, value in _source_metadata(path).items())
+
+
+def read_compiled_catalog(compiled_path: str) -> pa.Table:
+    """Memory-map a compiled catalog, the columns are only paged in from disk when they are accessed."""
+    return pa.ipc.open_file(pa.memory_map(compiled_path, 'r')).read_all()
+
+
+class Catalog:
+    """
+    The illuminant catalog, memory-mapped from its compiled Arrow file together with the filter engine on top of it.
+
+    A JSONL catalog is compiled on first use and whenever it changed, a compiled '.arrow' catalog is used directly.
+    The version is a hash of the JSONL content, so caches keyed on it are invalidated when the file changes.
+    """
+
+    def __init__(self, path: str = DEFAULT_CATALOG_PATH):
+        self.path = path
+        if path.endswith(COMPILED_CATALOG_EXTENSION):
+            self.compiled_path = path
+        else:
+            self.compiled_path = compiled_catalog_path(path)
+            if not is_compiled_catalog_current(path, self.compiled_path):
+                compile_catalog(path, self.compiled_path)
+        self.table = read_compiled_catalog(self.compiled_path)
+        self.version = self.table.schema.metadata[b"version"].decode()
+        self.filter_engine = FilterEngine(self.table)
+
+    @functools.cached_property
+    def fulltext_index(self) -> BM25Index:
+        """The BM25 index of the free-text columns and the datasheets, loaded or built on first access."""
+        return load_fulltext_index(self.path, self.table, self.version)
+
+
+class CatalogManager:
+    """
+    Serves versioned snapshots of a catalog and hot-reloads them when the watched data file changes.
+
+    The watched file is either the JSONL catalog or a compiled '.arrow' catalog. A watcher thread polls its size and
+    modification time, builds the new snapshot including its filter and full-text indexes in the background and swaps
+    it in atomically. Callers take the current snapshot once per query and keep using it, so in-flight queries finish
+    on the version they started with. A data file that can not be loaded, e.g. while it is being written, keeps the
+    previous snapshot in service and is retried on the next poll.
+
+    Usage:
+        catalogs = CatalogManager("data/illuminants.jsonl").start()
+        catalog = catalogs.catalog
+        catalog.filter_engine.filter(filters)
+    """
+
+    def __init__(self, path: str = DEFAULT_CATALOG_PATH, poll_interval: float = 2.0):
+        self.path = path
+        # seconds between two checks of the watched file
+        self.poll_interval = poll_interval
+        # the exception of the last failed reload, None after a successful one
+        self.last_error = None
+        self._signature = self._file_signature()
+        self._catalog = self._load()
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def catalog(self) -> Catalog:
+        """The current snapshot, to be used for a whole query."""
+        return self._catalog
+
+    @property
+    def version(self) -> str:
+        """The version of the current snapshot."""
+        return self._catalog.version
+
+    def _file_signature(self) -> Union[tuple, None]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _load(self) -> Catalog:
+        catalog = Catalog(self.path)
+        catalog.filter_engine.build_indexes()
+        catalog.fulltext_index
+        return catalog
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Load a new snapshot if the watched file changed since the current snapshot was loaded.
+
+        Parameters:
+        force (bool): Load the file even if it did not change.
+
+        Returns:
+        bool: True if a snapshot with a new version was swapped in.
+        """
+        with self._reload_lock:
+            signature = self._file_signature()
+            if signature is None or (signature == self._signature and not force):
+                return False
+
+            catalog = self._load()
+            self._signature = signature
+            self.last_error = None
+            if catalog.version == self._catalog.version:
+                # only the modification time changed, keep the snapshot whose caches are already warm
+                return False
+            self._catalog = catalog
+            return True
+
+    def start(self) -> "CatalogManager":
+        """Start watching the data file in a background thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.reload()
+            except Exception as error:
+                self.last_error = error
+
+
+_catalogs: Dict[str, CatalogManager] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(path: str = DEFAULT_CATALOG_PATH) -> CatalogManager:
+    """
+    Return the process-wide catalog manager for a data file, loading the catalog and starting its watcher on first use.
+
+    The catalog is shared by all agents and sessions of the process, so the data file is parsed and indexed only
+    once no matter how often the UI reruns. Changes to the data file are picked up without restarting the process.
+    """
+    key = os.path.abspath(path)
+    with _catalogs_lock:
+        if key not in _catalogs:
+            _catalogs[key] = CatalogManager(path).start()
+        return _catalogs[key]
@@ -0,0 +1,135 @@
+import math
+from typing import Dict, List, Tuple, Union
+
+from filtering import QUERY_OPTIONS
+
+# Columns that identify an illuminant and are always part of the context
+IDENTIFYING_COLUMNS = ("name",)
+
+# Default maximum number of prompt tokens for the retrieval results
+DEFAULT_CONTEXT_TOKEN_BUDGET = 3000
+
+# Default maximum number of prompt tokens for the full-text search passages
+DEFAULT_PASSAGE_TOKEN_BUDGET = 800
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text with the common four characters per token rule of thumb."""
+    return math.ceil(len(text) / 4)
+
+
+def format_value(value) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    if isinstance(value, list):
+        return ", ".join(str(item) for item in value)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def render_table(rows: List[dict], columns: List[str]) -> List[str]:
+    """Render rows as the lines of a compact pipe separated table with a header line."""
+    return [" | ".join(columns)] + [" | ".join(format_value(row.get(column)) for column in columns) for row in rows]
+
+
+def summarize(rows: List[dict], columns: List[str]) -> str:
+    """Summarize all rows by their count and the minimum and maximum of the numeric columns."""
+    summary = [f"Insgesamt {len(rows)} Leuchtmittel gefunden."]
+    for column in columns:
+        values = [row[column] for row in rows
+                  if isinstance(row.get(column), (int, float)) and not math.isnan(row[column])]
+        if values:
+            summary.append(f"{column}: min {format_value(min(values))}, max {format_value(max(values))}.")
+    return " ".join(summary)
+
+
+def relevant_columns(filters: Union[dict, None]) -> List[str]:
+    """Return the columns of the filters with a condition, the sort column and the group and aggregate columns."""
+    filters = filters or {}
+    columns = [column for column, condition in filters.items()
+               if condition is not None and column not in QUERY_OPTIONS]
+    if filters.get('order_by'):
+        columns.append(filters['order_by']['column'])
+    for aggregation in filters.get('aggregations') or []:
+        column = aggregation.get('column')
+        columns += [aggregation.get('group_by'),
+                    aggregation['function'] if column is None else f"{aggregation['function']}_{column}"]
+    return columns
+
+
+def build_context(retrieved_data: Union[List[dict], None], filters: Union[dict, None] = None,
+                  token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET) -> Tuple[str, dict]:
+    """
+    Serialize retrieval results into a compact table for the prompt that stays within a token budget.
+
+    All columns are kept if they fit into the budget, which keeps point lookups answerable. Otherwise the table is
+    projected to the identifying columns, the columns of the extracted filters and the sort and aggregate columns. If
+    that still exceeds the budget, only the first rows are listed and all rows are summarized by their count and the
+    minimum and maximum of the projected numeric columns.
+
+    Parameters:
+    retrieved_data (list or None): The rows returned by the filter engine.
+    filters (dict or None): The extracted filters, a column is relevant if its condition is not None or the results are
+                            sorted or aggregated by it.
+    token_budget (int): The maximum number of tokens of the context.
+
+    Returns:
+    tuple: The context and statistics including the estimated number of tokens saved compared to the repr of the rows.
+    """
+    raw_tokens = estimate_tokens(str(retrieved_data))
+    if not retrieved_data:
+        return "None", {"rows": 0, "rows_included": 0, "columns": 0, "tokens": 1, "tokens_saved": raw_tokens - 1}
+
+    all_columns = list(retrieved_data[0].keys())
+    lines = render_table(retrieved_data, all_columns)
+    columns = all_columns
+
+    if estimate_tokens("\n".join(lines)) > token_budget:
+        filter_columns = relevant_columns(filters)
+        columns = [column for column in all_columns
+                   if column in IDENTIFYING_COLUMNS or column in filter_columns]
+        lines = render_table(retrieved_data, columns)
+
+    context = "\n".join(lines)
+    rows_included = len(retrieved_data)
+
+    if estimate_tokens(context) > token_budget:
+        summary = summarize(retrieved_data, columns)
+        tokens = estimate_tokens(summary) + estimate_tokens(lines[0])
+        rows_included = 0
+        for line in lines[1:]:
+            line_tokens = estimate_tokens(line) + 1
+            if tokens + line_tokens > token_budget:
+                break
+            tokens += line_tokens
+            rows_included += 1
+        context = "\n".join(lines[:rows_included + 1] + [f"(Die ersten {rows_included} Zeilen.) {summary}"])
+
+    tokens = estimate_tokens(context)
+    return context, {"rows": len(retrieved_data), "rows_included": rows_included, "columns": len(columns),
+                     "tokens": tokens, "tokens_saved": raw_tokens - tokens}
+
+
+def render_passages(passages: Union[List[dict], None], token_budget: int = DEFAULT_PASSAGE_TOKEN_BUDGET) -> str:
+    """
+    Render full-text search passages with their sources for the prompt, as many of the best ranked ones as fit into
+    the token budget. Identical passages, e.g. the product family description shared by many datasheets, are rendered
+    once with all their sources.
+    """
+    sources: Dict[str, List[str]] = {}
+    for passage in passages or []:
+        source = passage['file_name']
+        if passage['page'] is not None:
+            source += f", Seite {passage['page'] + 1}"
+        sources.setdefault(" ".join(passage['text'].split()), []).append(source)
+
+    rendered = []
+    tokens = 0
+    for text, text_sources in sources.items():
+        line = f"[{'; '.join(text_sources)}] {text}"
+        tokens += estimate_tokens(line) + 1
+        if rendered and tokens > token_budget:
+            break
+        rendered.append(line)
+    return "\n".join(rendered)
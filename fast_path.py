@@ -0,0 +1,103 @@
+import re
+from typing import Union
+
+# Identifiers that unambiguously select illuminants
+SCIP_PATTERN = re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", re.IGNORECASE)
+ERZEUGNISNUMMER_PATTERN = re.compile(r"\b\d{13}\b")
+NAME_PATTERN = re.compile(r"\bXBO\s*\d+\s*W\s*/\s*[A-Z]+(?:\s+(?:XL|OFR)\b)*", re.IGNORECASE)
+
+# Comparison phrases and the operator they express, '>=' and '<=' are listed before '>' and '<'
+COMPARISON_PATTERNS = {
+    '>=': r"\b(?:mindestens|wenigstens|minimal|ab)\b|>=|≥",
+    '<=': r"\b(?:höchstens|maximal|bis zu)\b|<=|≤",
+    '>': r"\b(?:mehr als|über|größer als|höher als|länger als)\b|>",
+    '<': r"\b(?:weniger als|unter|kleiner als|niedriger als|kürzer als)\b|<",
+}
+
+# Units and the ExtractData field they constrain
+UNIT_FIELDS = {
+    r"w|watt": 'nennleistung',
+    r"a|ampere": 'nennstrom',
+    r"v|volt": 'nennspannung',
+    r"h|std\.?|stunden": 'lifetime',
+    r"g|gramm": 'produktgewicht',
+}
+
+# German numbers with dots as thousands separators (e.g. '1.500' or '10.000,5'), any other number with an optional
+# decimal point or comma
+THOUSANDS_NUMBER = r"\d{1,3}(?:\.\d{3})+(?:,\d+)?"
+NUMBER = rf"{THOUSANDS_NUMBER}|\d+(?:[.,]\d+)?"
+
+NUMERIC_CONSTRAINT_PATTERNS = [
+    (operator, field, re.compile(rf"(?:{comparison})\s*({NUMBER})\s*(?:{unit})(?![a-zäöüß])", re.IGNORECASE))
+    for operator, comparison in COMPARISON_PATTERNS.items()
+    for unit, field in UNIT_FIELDS.items()
+]
+
+# Queries with negations or exclusions are left to the LLM
+NEGATION_PATTERN = re.compile(r"\b(?:nicht|kein|keine|keinen|ohne|außer)\b", re.IGNORECASE)
+
+# Counts, averages, superlatives and orderings need the query options (order_by, limit, aggregations) of the LLM
+# extractor, superlatives are words ending in -ste(n) after at least three letters, e.g. 'leichteste' or 'hellsten'
+QUERY_OPTION_PATTERN = re.compile(r"\b(?:wie viele|anzahl|zähl\w*|durchschnitt\w*|schnitt|im mittel|mittelwert"
+                                  r"|minimum|maximum|meiste\w*|sortier\w*|reihenfolge|top\s*\d+)\b"
+                                  r"|\b\w{3,}(?<!li)ste[nrs]?\b", re.IGNORECASE)
+
+
+def parse_number(text: str) -> float:
+    """Parse a NUMBER match, e.g. '1.500' -> 1500.0 and '1,5' -> 1.5."""
+    if re.fullmatch(THOUSANDS_NUMBER, text):
+        text = text.replace('.', '')
+    return float(text.replace(',', '.'))
+
+
+def extract_filters(query: str) -> Union[dict, None]:
+    """
+    Extract the filters of an unambiguous query with deterministic rules.
+
+    Recognizes SCIP Deklarationsnummern, 13 digit Erzeugnisnummern, 'XBO <n> W/<suffix>' product names and numeric
+    constraints like 'mindestens 1500W' or 'mehr als 3000 Stunden'. The rules are only confident if every number of
+    the query is part of a recognized pattern, no field is constrained twice and the query contains no negation and
+    asks for no count, average, superlative or ordering.
+
+    Parameters:
+    query (str): The latest user message.
+
+    Returns:
+    dict or None: The filters in the ExtractData format, or None if the rules are not confident.
+    """
+    if NEGATION_PATTERN.search(query) or QUERY_OPTION_PATTERN.search(query):
+        return None
+
+    filters = {}
+    consumed = []
+
+    def add_filter(field: str, condition, span: tuple) -> bool:
+        if field in filters or any(start < span[1] and span[0] < end for start, end in consumed):
+            return False
+        filters[field] = condition
+        consumed.append(span)
+        return True
+
+    for pattern, field, convert in ((SCIP_PATTERN, 'scip_deklarationsnummer', str),
+                                    (ERZEUGNISNUMMER_PATTERN, 'erzeugnisnummer', int),
+                                    (NAME_PATTERN, 'name', lambda name: " ".join(name.split()))):
+        for match in pattern.finditer(query):
+            if not add_filter(field, convert(match.group(0)), match.span()):
+                return None
+
+    for operator, field, pattern in NUMERIC_CONSTRAINT_PATTERNS:
+        for match in pattern.finditer(query):
+            value = parse_number(match.group(1))
+            if not add_filter(field, {"operator": operator, "value": value}, match.span()):
+                return None
+
+    if not filters:
+        return None
+
+    # every number of the query has to be explained by a recognized pattern
+    for match in re.finditer(r"\d+", query):
+        if not any(start <= match.start() and match.end() <= end for start, end in consumed):
+            return None
+
+    return filters
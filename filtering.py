@@ -1,7 +1,630 @@
+import heapq
+import operator as op
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Supported comparison operators mapped to their vectorized implementations
+OPERATORS = {
+    '>': op.gt,
+    '<': op.lt,
+    '>=': op.ge,
+    '<=': op.le,
+    '==': op.eq,
+    '!=': op.ne,
+}
+
+ISO_DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+# Keys of a query dict that are query options instead of column filters
+QUERY_OPTIONS = ('order_by', 'limit', 'aggregations')
+
+# Supported aggregate functions, 'count' counts the rows or the non-missing values of a column
+AGGREGATE_FUNCTIONS = ('count', 'min', 'max', 'mean')
+
+# Minimum trigram similarity for a fuzzy name match to be accepted as a filter result
+MIN_NAME_SIMILARITY = 0.5
+
+# Fuzzy name matches within this similarity of the best match are equally plausible and all returned, e.g. the
+# variants 'XBO 4000 W/HS XL OFR', 'XBO 4000 W/HSA OFR' and 'XBO 4000 W/HTP XL OFR' for 'XBO 4000 W'
+NAME_SIMILARITY_MARGIN = 0.1
+
+# Maximum number of values a column is compared against at once in a batch, bounding the (values x rows) mask
+MAX_BATCH_VALUES = 64
+
+
+def normalize_identifier(value) -> str:
+    """Normalize an identifier (e.g. an Erzeugnisnummer or a SCIP UUID) for case-insensitive index lookups."""
+    return str(value).strip().lower()
+
+
+def canonicalize_name(name) -> str:
+    """
+    Canonicalize an illuminant name for lookups, e.g. 'XBO 4000W/HS XL OFR' -> 'xbo 4000 w hs xl ofr'.
+
+    Lower-cases the name, separates the wattage unit from its number and replaces slashes, punctuation and repeated
+    whitespace by single spaces.
+    """
+    name = str(name).lower()
+    name = re.sub(r"(\d)\s*w\b", r"\1 w", name)
+    name = re.sub(r"[^0-9a-zäöüß]+", " ", name)
+    return " ".join(name.split())
+
+
+def name_trigrams(canonical_name: str) -> set:
+    """Return the set of character trigrams of a canonical name, padded to weight word starts and ends."""
+    padded = f"  {canonical_name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """
+    Index of illuminant names for exact lookups on canonical names and ranked fuzzy search on character trigrams.
+
+    Fuzzy candidates must contain every number of the query (e.g. the wattage), so a misspelled suffix can still
+    match while 'XBO 4000 W/HS' never resolves to 'XBO 4500 W/HS'. A partial name matching several names about equally
+    well resolves to all of them instead of an arbitrary one.
+    """
+
+    def __init__(self, names: np.ndarray, min_similarity: float = MIN_NAME_SIMILARITY,
+                 similarity_margin: float = NAME_SIMILARITY_MARGIN):
+        self.min_similarity = min_similarity
+        self.similarity_margin = similarity_margin
+        # canonical name -> row ids, display name and trigram count
+        self.rows: Dict[str, List[int]] = {}
+        self.display_names: Dict[str, str] = {}
+        self.trigram_counts: Dict[str, int] = {}
+        # trigram -> canonical names containing it
+        self.trigrams: Dict[str, List[str]] = {}
+
+        for row, name in enumerate(names):
+            if not isinstance(name, str):
+                continue
+            canonical_name = canonicalize_name(name)
+            if canonical_name not in self.rows:
+                self.rows[canonical_name] = []
+                self.display_names[canonical_name] = name
+                trigrams = name_trigrams(canonical_name)
+                self.trigram_counts[canonical_name] = len(trigrams)
+                for trigram in trigrams:
+                    self.trigrams.setdefault(trigram, []).append(canonical_name)
+            self.rows[canonical_name].append(row)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[str, float]]:
+        """
+        Rank the indexed names by trigram similarity to the query.
+
+        Parameters:
+        query (str): The (possibly misspelled or differently formatted) name to search for.
+        k (int): The maximum number of results.
+
+        Returns:
+        list: Up to k (name, similarity) tuples ordered by descending Dice similarity in [0, 1].
+        """
+        canonical_query = canonicalize_name(query)
+        if canonical_query in self.rows:
+            return [(self.display_names[canonical_query], 1.0)]
+
+        query_trigrams = name_trigrams(canonical_query)
+        shared_trigrams = Counter()
+        for trigram in query_trigrams:
+            shared_trigrams.update(self.trigrams.get(trigram, ()))
+
+        query_numbers = {token for token in canonical_query.split() if token.isdigit()}
+        scored = []
+        for canonical_name, shared in shared_trigrams.items():
+            if not query_numbers.issubset(canonical_name.split()):
+                continue
+            similarity = 2 * shared / (len(query_trigrams) + self.trigram_counts[canonical_name])
+            scored.append((similarity, canonical_name))
+
+        return [(self.display_names[canonical_name], similarity)
+                for similarity, canonical_name in heapq.nlargest(k, scored)]
+
+    def lookup(self, query: str) -> List[int]:
+        """
+        Return the ascending row ids of the best matching name and of all names within similarity_margin of it, or an
+        empty list if no name is similar enough.
+        """
+        matches = self.search(query, k=len(self.rows))
+        if not matches or matches[0][1] < self.min_similarity:
+            return []
+        threshold = max(self.min_similarity, matches[0][1] - self.similarity_margin)
+        return sorted(row for name, similarity in matches if similarity >= threshold
+                      for row in self.rows[canonicalize_name(name)])
+
+
+def predicate_key(predicate: tuple) -> Union[tuple, None]:
+    """The key of a (column array, operator function, value) predicate, None if its value is not hashable."""
+    array, compare, value = predicate
+    try:
+        hash(value)
+    except TypeError:
+        return None
+    return id(array), compare, value
+
+
+class QueryPlan:
+    """
+    A compiled query dict that evaluates all predicates as a single boolean mask and optionally sorts, limits or
+    aggregates the matching rows, so only the small result is materialized.
+    """
+
+    def __init__(self, engine: "FilterEngine", predicates: List[tuple], index_lookups: List[List[int]],
+                 order_by: Union[dict, None] = None, limit: Union[int, None] = None,
+                 aggregations: Union[List[dict], None] = None):
+        self.engine = engine
+        # (column array, operator function, value) triples evaluated vectorized over the whole catalog
+        self.predicates = predicates
+        # row ids resolved through the inverted indexes of list columns
+        self.index_lookups = index_lookups
+        # {'column': ..., 'descending': ...}, rows with a missing value are ordered last
+        self.order_by = order_by
+        # maximum number of returned rows or groups
+        self.limit = limit
+        # [{'function': ..., 'column': ..., 'group_by': ...}], all aggregations share the group_by of the first one
+        self.aggregations = aggregations
+
+    def mask(self, predicate_masks: Dict[tuple, np.ndarray] = None) -> np.ndarray:
+        """
+        Evaluate the plan and return a boolean mask over the catalog rows, reusing the masks of predicates evaluated
+        for a whole batch (see FilterEngine.predicate_masks).
+        """
+        mask = np.ones(self.engine.num_rows, dtype=bool)
+
+        for row_ids in self.index_lookups:
+            lookup_mask = np.zeros(self.engine.num_rows, dtype=bool)
+            lookup_mask[row_ids] = True
+            mask &= lookup_mask
+
+        for predicate in self.predicates:
+            predicate_mask = predicate_masks.get(predicate_key(predicate)) if predicate_masks else None
+            if predicate_mask is None:
+                array, compare, value = predicate
+                predicate_mask = compare(array, value)
+            mask &= predicate_mask
+
+        return mask
+
+    def row_ids(self, mask: np.ndarray = None) -> np.ndarray:
+        """Evaluate the plan and return the ids of the matching rows in the requested order, at most limit many."""
+        row_ids = np.flatnonzero(self.mask() if mask is None else mask)
+        if self.order_by is not None:
+            key = self.engine.sort_key(self.order_by['column'], row_ids, self.order_by.get('descending', False))
+            if self.limit is not None and self.limit < row_ids.size:
+                # select the top-k in linear time and sort only those
+                top = np.argpartition(key, self.limit - 1)[:self.limit]
+                row_ids, key = row_ids[top], key[top]
+            # ties keep the catalog order
+            row_ids = row_ids[np.lexsort((row_ids, key))]
+        return row_ids[:self.limit] if self.limit is not None else row_ids
+
+    def execute(self, mask: np.ndarray = None) -> Union[List[dict], None]:
+        """
+        Evaluate the plan and materialize only the matching rows as a list of dictionaries, or with aggregations one
+        dictionary per group holding the group value and the aggregates. A precomputed mask of the plan is used
+        instead of evaluating it.
+        """
+        if mask is None:
+            mask = self.mask()
+        if self.aggregations:
+            return self.engine.aggregate(np.flatnonzero(mask), self.aggregations, self.limit)
+
+        row_ids = self.row_ids(mask)
+        if row_ids.size == 0:
+            return None
+        return self.engine.rows(row_ids)
+
+
+class FilterEngine:
+    """
+    Precomputes typed column arrays of a catalog once and compiles filter dicts into query plans against them.
+
+    The catalog is either a DataFrame or an Arrow table, e.g. a memory-mapped compiled catalog. Numeric columns are
+    kept as NumPy arrays, date columns (date32 or ISO date strings) as datetime64 arrays and dictionary encoded
+    string columns as their integer codes, which are zero-copy views of a memory-mapped table. List columns (e.g.
+    'erzeugnisnummer', 'scip_deklarationsnummer') get an inverted index from normalized identifier to row ids, so
+    filtering never has to inspect the rows again. The 'name' column is resolved through a NameIndex, so differently
+    formatted or misspelled names still match. Object arrays and indexes are built on first use, which keeps the
+    construction on a memory-mapped table independent of the number of rows.
+    """
+
+    NAME_COLUMN = 'name'
+
+    def __init__(self, data: Union[pd.DataFrame, pa.Table]):
+        self.df = data if isinstance(data, pd.DataFrame) else None
+        self.table = data if isinstance(data, pa.Table) else None
+        self.columns = list(data.columns) if self.df is not None else data.column_names
+        self.num_rows = len(data)
+        self.numeric: Dict[str, np.ndarray] = {}
+        self.dates: Dict[str, np.ndarray] = {}
+        # dictionary encoded column -> (codes, code per value)
+        self.categories: Dict[str, Tuple[np.ndarray, Dict[str, int]]] = {}
+        self.list_columns = set()
+        self._objects: Dict[str, np.ndarray] = {}
+        self._indexes: Dict[str, Dict[str, List[int]]] = {}
+        self._name_index = None
+        # DataFrame column -> numpy array the rows are materialized from, built on first use
+        self._row_values: Union[Dict[str, Union[np.ndarray, None]], None] = None
+        self._lock = threading.Lock()
+
+        if self.df is not None:
+            self._add_dataframe_columns()
+        else:
+            self._add_arrow_columns()
+
+    def _add_dataframe_columns(self) -> None:
+        for column in self.df.columns:
+            series = self.df[column]
+            if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+                if series.dtype.kind in 'iuf':
+                    self.numeric[column] = series.to_numpy()
+                else:
+                    self.numeric[column] = series.to_numpy(dtype='float64', na_value=np.nan)
+                continue
+
+            first_value = series.iloc[0] if self.num_rows else None
+            if isinstance(first_value, list):
+                self.list_columns.add(column)
+            elif isinstance(first_value, str) and ISO_DATE_PATTERN.match(first_value):
+                dates = pd.to_datetime(series, format='%Y-%m-%d', errors='coerce')
+                self.dates[column] = dates.to_numpy(dtype='datetime64[D]')
+
+    def _add_arrow_columns(self) -> None:
+        for field in self.table.schema:
+            column = self.table.column(field.name)
+            if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+                self.numeric[field.name] = column.to_numpy()
+            elif pa.types.is_date(field.type):
+                self.dates[field.name] = column.to_numpy().astype('datetime64[D]')
+            elif pa.types.is_dictionary(field.type):
+                encoded = column.combine_chunks() if column.num_chunks != 1 else column.chunk(0)
+                codes = encoded.indices.fill_null(-1).to_numpy()
+                self.categories[field.name] = (codes, {value: code for code, value
+                                                       in enumerate(encoded.dictionary.to_pylist())})
+            elif pa.types.is_list(field.type) or pa.types.is_large_list(field.type):
+                self.list_columns.add(field.name)
+
+    @property
+    def name_index(self) -> Union[NameIndex, None]:
+        if self.NAME_COLUMN not in self.columns or self.NAME_COLUMN in self.list_columns:
+            return None
+        with self._lock:
+            if self._name_index is None:
+                self._name_index = NameIndex(self._column_values(self.NAME_COLUMN))
+            return self._name_index
+
+    def build_indexes(self) -> None:
+        """Build the name index and the inverted indexes of all list columns up front instead of on first use."""
+        self.name_index
+        for column in self.list_columns:
+            self.inverted_index(column)
+
+    def compile(self, filters: dict) -> QueryPlan:
+        """
+        Compile a filter dict into a query plan.
+
+        Parameters:
+        filters (dict): A dictionary where keys are column names and values are the conditions.
+                        Conditions can be:
+                        - A dictionary with 'operator' and 'value' keys
+                        - A direct value for equality check (case-insensitive membership check for list columns,
+                          canonical or fuzzy match for the 'name' column)
+                        - None to skip filtering for that column
+                        The query options are:
+                        - 'order_by': {'column': ..., 'descending': ...} to sort by a numeric or date column
+                        - 'limit': the maximum number of rows, e.g. the top-k with 'order_by'
+                        - 'aggregations': a list of {'function': ..., 'column': ..., 'group_by': ...} with a function
+                          of AGGREGATE_FUNCTIONS, returned instead of the rows
+
+        Returns:
+        QueryPlan: The compiled plan.
+        """
+        predicates = []
+        index_lookups = []
+
+        for column, condition in filters.items():
+            if column in QUERY_OPTIONS:
+                continue
+            if column not in self.columns:
+                raise ValueError(f"Column '{column}' does not exist in the DataFrame.")
+
+            if condition is None:
+                continue
+
+            if isinstance(condition, dict) and 'operator' in condition and 'value' in condition:
+                operator = condition['operator']
+                value = condition['value']
+
+                if operator not in OPERATORS:
+                    raise ValueError(f"Operator '{operator}' is not supported.")
+
+                array, value = self._typed_column(column, value, operator)
+                predicates.append((array, OPERATORS[operator], value))
+            elif column in self.list_columns:
+                index_lookups.append(self.lookup(column, condition))
+            elif column == self.NAME_COLUMN and isinstance(condition, str) and self.name_index is not None:
+                index_lookups.append(self.name_index.lookup(condition))
+            else:
+                array, value = self._typed_column(column, condition, '==')
+                predicates.append((array, op.eq, value))
+
+        order_by = filters.get('order_by')
+        if order_by is not None:
+            self._check_sortable(order_by['column'])
+        limit = filters.get('limit')
+        if limit is not None and limit < 0:
+            raise ValueError(f"Limit {limit} must not be negative.")
+        aggregations = filters.get('aggregations')
+        for aggregation in aggregations or []:
+            self._check_aggregation(aggregation)
+
+        return QueryPlan(self, predicates, index_lookups, order_by=order_by, limit=limit, aggregations=aggregations)
+
+    def filter(self, filters: dict) -> Union[List[dict], None]:
+        """Compile and execute a filter dict, returning the matching rows or None if nothing matches."""
+        return self.compile(filters).execute()
+
+    def predicate_masks(self, predicates: List[tuple]) -> Dict[tuple, np.ndarray]:
+        """
+        Evaluate the predicates of many query plans at once.
+
+        Every distinct predicate is evaluated once, and the predicates comparing the same column with the same
+        operator against different values are evaluated together as one (values x rows) comparison, e.g. the wattage
+        thresholds of all questions of a batch.
+
+        Parameters:
+        predicates (list): The (column array, operator function, value) predicates of the plans.
+
+        Returns:
+        dict: The boolean mask of every distinct predicate by its predicate_key.
+        """
+        groups: Dict[tuple, Tuple[np.ndarray, Callable, dict]] = {}
+        for predicate in predicates:
+            key = predicate_key(predicate)
+            if key is None:
+                continue
+            array, compare, value = predicate
+            groups.setdefault((id(array), compare), (array, compare, {}))[2][value] = key
+
+        masks = {}
+        for array, compare, keys in groups.values():
+            values = list(keys)
+            if len(values) == 1:
+                masks[keys[values[0]]] = compare(array, values[0])
+                continue
+            for start in range(0, len(values), MAX_BATCH_VALUES):
+                chunk = values[start:start + MAX_BATCH_VALUES]
+                chunk_array = np.array(chunk, dtype=object if array.dtype == object else None)
+                comparison = compare(array[np.newaxis, :], chunk_array[:, np.newaxis])
+                for value, predicate_mask in zip(chunk, comparison):
+                    masks[keys[value]] = predicate_mask
+        return masks
+
+    def execute_many(self, plans: List[QueryPlan]) -> List[Union[List[dict], None]]:
+        """
+        Execute many query plans in one vectorized pass over the catalog, sharing the evaluation of their predicates.
+
+        Parameters:
+        plans (list): Query plans compiled by this engine, e.g. the extracted filters of a batch of questions.
+
+        Returns:
+        list: The result of every plan in the order of the plans, as returned by QueryPlan.execute.
+        """
+        predicate_masks = self.predicate_masks([predicate for plan in plans for predicate in plan.predicates])
+        return [plan.execute(plan.mask(predicate_masks)) for plan in plans]
+
+    def _check_sortable(self, column: str) -> None:
+        if column not in self.numeric and column not in self.dates:
+            raise ValueError(f"Column '{column}' is neither numeric nor a date and can not be sorted or aggregated.")
+
+    def _check_aggregation(self, aggregation: dict) -> None:
+        function, column, group_by = aggregation['function'], aggregation.get('column'), aggregation.get('group_by')
+        if function not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Aggregate function '{function}' is not supported.")
+        if column is None and function != 'count':
+            raise ValueError(f"Aggregate function '{function}' needs a column.")
+        if column is not None:
+            if function == 'count' and column not in self.columns:
+                raise ValueError(f"Column '{column}' does not exist in the DataFrame.")
+            if function != 'count':
+                self._check_sortable(column)
+            if function == 'mean' and column in self.dates:
+                raise ValueError(f"The mean of the date column '{column}' is not supported.")
+        if group_by is not None and (group_by not in self.columns or group_by in self.list_columns):
+            raise ValueError(f"Column '{group_by}' can not be grouped by.")
+
+    def _float_column(self, column: str) -> np.ndarray:
+        """A numeric or date column as float64 array with NaN for missing values."""
+        if column in self.dates:
+            dates = self.dates[column]
+            return np.where(np.isnat(dates), np.nan, dates.astype('int64').astype('float64'))
+        return self.numeric[column].astype('float64', copy=False)
+
+    def sort_key(self, column: str, row_ids: np.ndarray, descending: bool = False) -> np.ndarray:
+        """Return the ascending sort key of a numeric or date column for the given rows, missing values last."""
+        values = self._float_column(column)[row_ids]
+        values = -values if descending else values
+        return np.where(np.isnan(values), np.inf, values)
+
+    def group_codes(self, column: str) -> Tuple[np.ndarray, list]:
+        """Return a code per row, -1 for missing values, and the value of every code."""
+        if column in self.categories:
+            codes, code_per_value = self.categories[column]
+            return codes, list(code_per_value)
+        with self._lock:
+            values = self._column_values(column)
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        return codes, [value.item() if isinstance(value, np.generic) else value for value in uniques]
+
+    def aggregate(self, row_ids: np.ndarray, aggregations: List[dict], limit: Union[int, None] = None) -> List[dict]:
+        """
+        Aggregate the given rows vectorized, per group of the group_by column of the first aggregation if it has one.
+
+        Parameters:
+        row_ids (np.ndarray): The ids of the rows to aggregate.
+        aggregations (list): Dicts with the aggregate 'function', its 'column' (None to count rows) and 'group_by'.
+        limit (int or None): The maximum number of groups, the largest groups first.
+
+        Returns:
+        list: One dict per group with the group value and one entry per aggregation, e.g. 'count' or
+              'max_nennleistung'. Without group_by a single dict, also if no row matches.
+        """
+        group_by = aggregations[0].get('group_by')
+        if group_by is None:
+            groups, labels = np.zeros(row_ids.size, dtype=np.int64), [None]
+        else:
+            codes, values = self.group_codes(group_by)
+            # missing values form their own group, stored after the regular ones
+            groups = codes[row_ids].astype(np.int64)
+            groups[groups < 0] = len(values)
+            labels = values + [None]
+
+        num_groups = len(labels)
+        rows_per_group = np.bincount(groups, minlength=num_groups)
+        results = [{group_by: labels[group]} if group_by is not None else {} for group in range(num_groups)]
+
+        for aggregation in aggregations:
+            function, column = aggregation['function'], aggregation.get('column')
+            name = function if column is None else f"{function}_{column}"
+            if column is None:
+                aggregates = rows_per_group
+            elif function == 'count' and column not in self.numeric and column not in self.dates:
+                with self._lock:
+                    present = pd.notna(self._column_values(column)[row_ids])
+                aggregates = np.bincount(groups, weights=present, minlength=num_groups)
+            else:
+                values = self._float_column(column)[row_ids]
+                present = ~np.isnan(values)
+                counts = np.bincount(groups[present], minlength=num_groups)
+                if function == 'count':
+                    aggregates = counts
+                elif function == 'mean':
+                    sums = np.bincount(groups[present], weights=values[present], minlength=num_groups)
+                    aggregates = np.divide(sums, counts, out=np.full(num_groups, np.nan), where=counts > 0)
+                else:
+                    reduce = np.fmin if function == 'min' else np.fmax
+                    aggregates = np.full(num_groups, np.nan)
+                    reduce.at(aggregates, groups[present], values[present])
+
+            for group, value in enumerate(aggregates.tolist()):
+                results[group][name] = self._aggregate_value(column, function, value)
+
+        if group_by is None:
+            return results
+        # only the groups with rows, the largest first
+        order = sorted(np.flatnonzero(rows_per_group).tolist(), key=lambda group: -rows_per_group[group])
+        return [results[group] for group in order[:limit]]
+
+    def _aggregate_value(self, column: Union[str, None], function: str, value: float):
+        if function == 'count':
+            return int(value)
+        if np.isnan(value):
+            return None
+        if column in self.dates:
+            return str(np.datetime64(int(value), 'D'))
+        if column in self.numeric and self.numeric[column].dtype.kind in 'iu' and function != 'mean':
+            return int(value)
+        return value
+
+    def rows(self, row_ids: np.ndarray) -> List[dict]:
+        """Materialize rows as dictionaries."""
+        if self.df is None:
+            return self.table.take(pa.array(row_ids)).to_pylist()
+
+        # column by column, which is several times faster than DataFrame.to_dict('records') and yields the same values;
+        # datetime and extension columns (without a cached array) are boxed by pandas
+        with self._lock:
+            if self._row_values is None:
+                self._row_values = {column: series.to_numpy() if series.dtype.kind in 'iufbO' else None
+                                    for column, series in self.df.items()}
+        values = [array[row_ids].tolist() if array is not None else self.df[column].iloc[row_ids].tolist()
+                  for column, array in self._row_values.items()]
+        return [dict(zip(self._row_values, row)) for row in zip(*values)]
+
+    def lookup(self, column: str, identifier) -> List[int]:
+        """Return the ids of all rows whose list column contains the identifier (case-insensitive)."""
+        return self.inverted_index(column).get(normalize_identifier(identifier), [])
+
+    def inverted_index(self, column: str) -> Dict[str, List[int]]:
+        with self._lock:
+            if column not in self._indexes:
+                self._indexes[column] = self._build_inverted_index(column)
+            return self._indexes[column]
+
+    def _build_inverted_index(self, column: str) -> Dict[str, List[int]]:
+        """Build an inverted index from normalized identifier to the ascending ids of the rows containing it."""
+        if self.table is not None:
+            # the flattened values of all lists and the row of every value from the list offsets
+            lists = self.table.column(column).combine_chunks()
+            rows = np.repeat(np.arange(self.num_rows), np.diff(lists.offsets.to_numpy()))
+            items = zip(rows.tolist(), lists.flatten().to_pylist())
+        else:
+            items = ((row, identifier) for row, identifiers in enumerate(self.df[column].to_numpy(dtype=object))
+                     if isinstance(identifiers, list) for identifier in identifiers)
+
+        index = {}
+        for row, identifier in items:
+            rows = index.setdefault(normalize_identifier(identifier), [])
+            if not rows or rows[-1] != row:
+                rows.append(row)
+        return index
+
+    def _column_values(self, column: str) -> np.ndarray:
+        """The values of a column as an object array, converted on first use."""
+        if column not in self._objects:
+            if self.df is not None:
+                self._objects[column] = self.df[column].to_numpy(dtype=object)
+            else:
+                self._objects[column] = self.table.column(column).to_numpy(zero_copy_only=False)
+        return self._objects[column]
+
+    def _typed_column(self, column: str, value, operator: str) -> tuple:
+        """Return the column array matching the type of the comparison value, together with the converted value."""
+        if column in self.numeric:
+            return self.numeric[column], value
+        if column in self.dates and not (isinstance(value, str) and self.df is not None):
+            return self.dates[column], np.datetime64(pd.Timestamp(value).date(), 'D')
+        if column in self.categories and operator in ('==', '!=') and isinstance(value, str):
+            # compare the codes, a value missing from the dictionary matches no row
+            codes, code_per_value = self.categories[column]
+            return codes, code_per_value.get(value, -2)
+        with self._lock:
+            return self._column_values(column), value
+
+
+# FilterEngines of the DataFrames most recently passed to filter_dataframe, by the id of the DataFrame
+_dataframe_engines: "OrderedDict[int, FilterEngine]" = OrderedDict()
+_dataframe_engines_lock = threading.Lock()
+MAX_DATAFRAME_ENGINES = 8
+
+
+def dataframe_engine(df: pd.DataFrame) -> FilterEngine:
+    """Return the FilterEngine of a DataFrame, building it on first use. The DataFrame must not be modified later."""
+    with _dataframe_engines_lock:
+        engine = _dataframe_engines.get(id(df))
+        # the id of a garbage collected DataFrame may be reused by a new one
+        if engine is None or engine.df is not df:
+            engine = FilterEngine(df)
+            _dataframe_engines[id(df)] = engine
+        _dataframe_engines.move_to_end(id(df))
+        while len(_dataframe_engines) > MAX_DATAFRAME_ENGINES:
+            _dataframe_engines.popitem(last=False)
+        return engine
+
+
 def filter_dataframe(df, filters):
     """
     Filters a DataFrame based on specified conditions and returns the result as a list of dictionaries.
 
+    The FilterEngine of the DataFrame is built on the first call and reused, so the DataFrame must not be modified in
+    place between calls.
+
     Parameters:
     df (pd.DataFrame): The DataFrame to filter.
     filters (dict): A dictionary where keys are column names and values are the conditions.
@@ -13,40 +636,4 @@ def filter_dataframe(df, filters):
     Returns:
     list or None: The filtered DataFrame as a list of dictionaries or None if the result is empty.
     """
-    filtered_df = df
-
-    for column, condition in filters.items():
-        if column not in df.columns:
-            raise ValueError(f"Column '{column}' does not exist in the DataFrame.")
-
-        if condition is None:
-            continue
-
-        if isinstance(condition, dict) and 'operator' in condition and 'value' in condition:
-            operator = condition['operator']
-            value = condition['value']
-
-            if operator not in ['>', '<', '>=', '<=', '==', '!=']:
-                raise ValueError(f"Operator '{operator}' is not supported.")
-
-            if operator == '>':
-                filtered_df = filtered_df[filtered_df[column] > value]
-            elif operator == '<':
-                filtered_df = filtered_df[filtered_df[column] < value]
-            elif operator == '>=':
-                filtered_df = filtered_df[filtered_df[column] >= value]
-            elif operator == '<=':
-                filtered_df = filtered_df[filtered_df[column] <= value]
-            elif operator == '==':
-                filtered_df = filtered_df[filtered_df[column] == value]
-            elif operator == '!=':
-                filtered_df = filtered_df[filtered_df[column] != value]
-        else:
-            # Direct value comparison
-            if isinstance(df[column].iloc[0], list):
-                # For list columns, check if the value is in the list
-                filtered_df = filtered_df[filtered_df[column].apply(lambda x: condition in x)]
-            else:
-                filtered_df = filtered_df[filtered_df[column] == condition]
-
-    return filtered_df.to_dict('records') if not filtered_df.empty else None
\ No newline at end of file
+    return dataframe_engine(df).filter(filters)
@@ -0,0 +1,267 @@
+import bisect
+import json
+import math
+import os
+import re
+import tempfile
+from collections import Counter
+from typing import Iterable, List, Union
+
+import fitz
+import numpy as np
+import pyarrow as pa
+
+# Extension of the full-text index written next to its catalog
+FULLTEXT_INDEX_EXTENSION = ".bm25.npz"
+
+# Catalog columns with free text, indexed as one chunk per illuminant
+FREE_TEXT_COLUMNS = ("name", "anmerkung_produkt", "info_sicherer_gebrauch", "kuehlung", "brennstellung",
+                     "sockel_anode", "sockel_kathode", "stoff_kandidatenliste")
+
+# Maximum number of words of a datasheet chunk and the number of lines shared by consecutive chunks, so a label and
+# its value always end up in a common chunk
+CHUNK_WORDS = 60
+CHUNK_OVERLAP_LINES = 2
+
+# Minimum length of a query term that is not in the vocabulary to match the terms it is a prefix of, e.g. the
+# German compound 'heißwiederzündungsfunktion' for 'heißwiederzündung'
+MIN_PREFIX_LENGTH = 5
+
+# Standard BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Page footers repeated on every datasheet page
+FOOTER_PATTERN = re.compile(r"^(?:__|Produktdatenblatt|Seite \d+ von \d+|©.*|\d{1,2}\. \w+ \d{4}, [\d:]+)$")
+
+TOKEN_PATTERN = re.compile(r"[0-9a-zäöüß]+(?:[./-][0-9a-zäöüß]+)*")
+
+STOPWORDS = {"der", "die", "das", "den", "dem", "des", "ein", "eine", "einer", "eines", "einem", "einen", "und",
+             "oder", "mit", "von", "zu", "zum", "zur", "für", "im", "in", "ist", "sind", "auf", "bei", "aus", "als",
+             "wie", "was", "welche", "welcher", "welches", "gibt", "es", "hat", "haben", "ich", "mir", "sie", "the",
+             "of", "and", "for", "a", "an", "to"}
+
+GERMAN_SUFFIX_PATTERN = re.compile(r"(?:ern|em|en|er|es|e|n|s)$")
+
+
+def stem(token: str) -> str:
+    """Strip common German inflection suffixes from longer words, e.g. 'lampen' and 'lampe' -> 'lamp'."""
+    if len(token) <= 4 or not token.isalpha():
+        return token
+    return GERMAN_SUFFIX_PATTERN.sub("", token)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lower-case, stemmed terms without stopwords.
+
+    Compound identifiers like 's20/p20' or '7439-92-1' are kept as one term and additionally split into their parts.
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        parts = re.split(r"[./-]", token)
+        for term in ([token] if len(parts) > 1 else []) + parts:
+            if term and term not in STOPWORDS:
+                terms.append(stem(term))
+    return terms
+
+
+def fulltext_index_path(catalog_path: str) -> str:
+    return os.path.splitext(catalog_path)[0] + FULLTEXT_INDEX_EXTENSION
+
+
+def chunk_lines(lines: List[str], chunk_words: int = CHUNK_WORDS,
+                overlap_lines: int = CHUNK_OVERLAP_LINES) -> List[str]:
+    """Group consecutive lines into chunks of at most chunk_words words, sharing overlap_lines lines."""
+    chunks = []
+    start = 0
+    while start < len(lines):
+        end, words = start, 0
+        while end < len(lines) and (end == start or words + len(lines[end].split()) <= chunk_words):
+            words += len(lines[end].split())
+            end += 1
+        chunks.append("\n".join(lines[start:end]))
+        if end == len(lines):
+            break
+        start = max(start + 1, end - overlap_lines)
+    return chunks
+
+
+def catalog_chunks(table: pa.Table) -> List[dict]:
+    """One chunk per illuminant with the values of its free-text columns."""
+    columns = [column for column in FREE_TEXT_COLUMNS if column in table.column_names]
+    rows = table.select(columns + ["file_name"]).to_pylist()
+    return [{"source": "catalog", "file_name": row["file_name"], "page": None,
+             "text": "\n".join(f"{column}: {row[column]}" for column in columns if row[column])}
+            for row in rows]
+
+
+def pdf_chunks(pdf_path: str) -> List[dict]:
+    """The chunks of the text layer of a datasheet, without the page footers."""
+    chunks = []
+    with fitz.open(pdf_path) as pdf:
+        for page_number, page in enumerate(pdf):
+            lines = [line.strip() for line in page.get_text().split("\n") if line.strip()]
+            # the footer ends with the product name and the page number
+            lines = [line for index, line in enumerate(lines)
+                     if not FOOTER_PATTERN.match(line) and not (index == len(lines) - 2
+                                                                 and FOOTER_PATTERN.match(lines[-1]))]
+            chunks += [{"source": "pdf", "file_name": os.path.basename(pdf_path), "page": page_number, "text": text}
+                       for text in chunk_lines(lines)]
+    return chunks
+
+
+class BM25Index:
+    """
+    A sparse inverted index with BM25 scoring over text chunks, e.g. the free-text columns of the catalog and the
+    text layer of the datasheets.
+
+    The postings of all terms are stored in flat NumPy arrays (document ids and term frequencies plus offsets per
+    term), so a query only touches the postings of its terms and scores them vectorized. The index is persisted as a
+    single '.npz' file together with the catalog version it was built from.
+    """
+
+    def __init__(self, terms: List[str], offsets: np.ndarray, doc_ids: np.ndarray, term_frequencies: np.ndarray,
+                 doc_lengths: np.ndarray, chunks: List[dict], version: str = "",
+                 k1: float = BM25_K1, b: float = BM25_B):
+        # the terms are sorted, so the terms with a common prefix are adjacent
+        self.terms = terms
+        self.vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_frequencies = term_frequencies
+        self.doc_lengths = doc_lengths
+        self.chunks = chunks
+        # version of the catalog the index was built from
+        self.version = version
+        self.k1 = k1
+        self.b = b
+        self.file_names = np.array([chunk["file_name"] or "" for chunk in chunks], dtype=object)
+        average_length = doc_lengths.mean() if len(doc_lengths) else 0.0
+        # the document length normalization of BM25 per document
+        self._length_norms = k1 * (1 - b + b * doc_lengths / average_length) if average_length else doc_lengths
+
+    @classmethod
+    def build(cls, chunks: List[dict], version: str = "") -> "BM25Index":
+        """Build the index of a list of chunks, dicts with the 'text' and its 'source', 'file_name' and 'page'."""
+        postings = {}
+        doc_lengths = np.zeros(len(chunks), dtype=np.int32)
+        for doc_id, chunk in enumerate(chunks):
+            terms = tokenize(chunk["text"])
+            doc_lengths[doc_id] = len(terms)
+            for term, frequency in Counter(terms).items():
+                postings.setdefault(term, []).append((doc_id, frequency))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        flat = np.array([posting for term in terms for posting in postings[term]], dtype=np.int32).reshape(-1, 2)
+        return cls(terms, offsets, flat[:, 0].copy(), flat[:, 1].copy(), doc_lengths, chunks, version=version)
+
+    def save(self, path: str) -> None:
+        """Write the index atomically, so readers never load a partially written file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                np.savez(file, terms=np.array(self.terms, dtype=str), offsets=self.offsets,
+                         doc_ids=self.doc_ids, term_frequencies=self.term_frequencies, doc_lengths=self.doc_lengths,
+                         chunks=np.array(json.dumps(self.chunks, ensure_ascii=False)),
+                         version=np.array(self.version), parameters=np.array([self.k1, self.b]))
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path, allow_pickle=False) as data:
+            k1, b = data["parameters"].tolist()
+            return cls(data["terms"].tolist(), data["offsets"], data["doc_ids"], data["term_frequencies"],
+                       data["doc_lengths"], json.loads(str(data["chunks"])), version=str(data["version"]),
+                       k1=k1, b=b)
+
+    def term_ids(self, term: str) -> List[int]:
+        """Return the id of a term, or the ids of the terms it is a prefix of if it is not in the vocabulary."""
+        if term in self.vocabulary:
+            return [self.vocabulary[term]]
+        if len(term) < MIN_PREFIX_LENGTH:
+            return []
+        start = bisect.bisect_left(self.terms, term)
+        end = start
+        while end < len(self.terms) and self.terms[end].startswith(term):
+            end += 1
+        return list(range(start, end))
+
+    def scores(self, query: str) -> np.ndarray:
+        """Return the BM25 score of every chunk for the query."""
+        num_docs = len(self.chunks)
+        scores = np.zeros(num_docs)
+        term_ids = {term_id for term in tokenize(query) for term_id in self.term_ids(term)}
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            doc_ids, frequencies = self.doc_ids[start:end], self.term_frequencies[start:end]
+            idf = math.log(1 + (num_docs - (end - start) + 0.5) / ((end - start) + 0.5))
+            scores[doc_ids] += idf * frequencies * (self.k1 + 1) / (frequencies + self._length_norms[doc_ids])
+        return scores
+
+    def search(self, query: str, k: int = 5, file_names: Union[Iterable[str], None] = None) -> List[dict]:
+        """
+        Rank the chunks by their BM25 score for the query.
+
+        Parameters:
+        query (str): The free-text query.
+        k (int): The maximum number of results.
+        file_names (iterable or None): Only rank the chunks of these datasheets, None to rank all chunks.
+
+        Returns:
+        list: Up to k chunks with a positive 'score', ordered by descending score.
+        """
+        scores = self.scores(query)
+        if file_names is not None:
+            scores[~np.isin(self.file_names, list(file_names))] = 0.0
+
+        candidates = np.flatnonzero(scores > 0)
+        if candidates.size > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [{**self.chunks[doc_id], "score": float(scores[doc_id])} for doc_id in candidates]
+
+
+def build_fulltext_index(table: pa.Table, pdfs_dir: Union[str, None], version: str = "") -> BM25Index:
+    """
+    Build the full-text index of a catalog from its free-text columns and the text layer of its datasheets.
+
+    Parameters:
+    table (pa.Table): The catalog.
+    pdfs_dir (str or None): The directory with the datasheets named in the 'file_name' column, None to only index
+                            the catalog columns. Missing datasheets are skipped.
+    version (str): The catalog version stored with the index.
+
+    Returns:
+    BM25Index: The index.
+    """
+    chunks = catalog_chunks(table)
+    if pdfs_dir is not None:
+        for file_name in sorted(set(table.column("file_name").to_pylist()) - {None}):
+            pdf_path = os.path.join(pdfs_dir, file_name)
+            if os.path.exists(pdf_path):
+                chunks += pdf_chunks(pdf_path)
+    return BM25Index.build(chunks, version=version)
+
+
+def load_fulltext_index(catalog_path: str, table: pa.Table, version: str) -> BM25Index:
+    """
+    Load the persisted full-text index of a catalog, or build and persist it if it is missing or was built from
+    another catalog version. The datasheets are expected in the directory of the catalog.
+    """
+    path = fulltext_index_path(catalog_path)
+    if os.path.exists(path):
+        index = BM25Index.load(path)
+        if index.version == version:
+            return index
+
+    index = build_fulltext_index(table, os.path.dirname(os.path.abspath(catalog_path)), version=version)
+    index.save(path)
+    return index
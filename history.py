@@ -0,0 +1,115 @@
+import threading
+from typing import Callable, Dict, List, Tuple, Union
+
+from langchain_core.messages import AIMessage, BaseMessage
+
+from cache import Cache, LRUCache, cache_key
+from context import estimate_tokens
+
+# Maximum number of tokens of the conversation window per graph node
+DEFAULT_HISTORY_TOKEN_BUDGETS = {
+    "select_chat_mode": 500,
+    "extract_data": 500,
+    "generate_response": 2000,
+}
+
+SUMMARY_PROMPT = """Fasse den folgenden Gesprächsverlauf zwischen einem Nutzer und einem Assistenten für Leuchtmittel in wenigen Sätzen zusammen. Behalte alle erwähnten Leuchtmittel, Produktnamen, Nummern und Suchkriterien bei.
+
+Bisherige Zusammenfassung: {summary}
+
+Gesprächsverlauf:
+{messages}"""
+
+
+def render_messages(messages: List[BaseMessage]) -> str:
+    """Render messages as compact 'Nutzer: ...' and 'Assistent: ...' lines."""
+    return "\n".join(f"{'Assistent' if isinstance(message, AIMessage) else 'Nutzer'}: {message.content}"
+                     for message in messages)
+
+
+class HistoryManager:
+    """
+    Bounds the conversation history sent to the LLM by a sliding window over the most recent messages plus a rolling
+    summary of the older ones.
+
+    The summary boundary moves in steps of summary_step messages, so a long session costs one small summarization
+    call every few turns. Summaries are cached by the summarized prefix and extended incrementally from the longest
+    cached prefix. Within the window, each graph node only gets the most recent messages fitting its token budget.
+    """
+
+    def __init__(self, summarize: Union[Callable[[str], str], None] = None, window_messages: int = 6,
+                 summary_step: int = 4, token_budgets: Dict[str, int] = None, summaries: Cache = None):
+        # function answering a summary prompt, None to drop older messages without summarizing them
+        self.summarize = summarize
+        self.window_messages = window_messages
+        self.summary_step = summary_step
+        self.token_budgets = {**DEFAULT_HISTORY_TOKEN_BUDGETS, **(token_budgets or {})}
+        self.summaries = summaries if summaries is not None else LRUCache()
+        # one lock per summarized prefix, so concurrent nodes of a turn summarize it once without blocking other
+        # sessions during the summarization call
+        self._summary_locks: Dict[str, threading.Lock] = {}
+        self._summary_locks_lock = threading.Lock()
+
+    def split(self, messages: List[BaseMessage]) -> Tuple[Union[str, None], List[BaseMessage]]:
+        """Split a conversation into the summary of the older messages and the window of the recent ones."""
+        num_older = max(0, len(messages) - self.window_messages) // self.summary_step * self.summary_step
+        if num_older == 0 or self.summarize is None:
+            return None, messages[-self.window_messages:]
+        return self._summary(messages[:num_older]), messages[num_older:]
+
+    def window(self, messages: List[BaseMessage], node: str) -> Tuple[Union[str, None], List[BaseMessage]]:
+        """Return the summary and the most recent messages fitting the token budget of a graph node."""
+        summary, window = self.split(messages)
+        budget = self.token_budgets.get(node)
+        if budget is None or not window:
+            return summary, window
+
+        budget -= estimate_tokens(summary) if summary else 0
+        # the latest message is always included
+        num_messages, tokens = 1, estimate_tokens(window[-1].content)
+        for message in reversed(window[:-1]):
+            tokens += estimate_tokens(message.content)
+            if tokens > budget:
+                break
+            num_messages += 1
+        return summary, window[-num_messages:]
+
+    def render(self, messages: List[BaseMessage], node: str) -> str:
+        """Render the bounded history of a graph node as text for a prompt."""
+        summary, window = self.window(messages, node)
+        rendered = render_messages(window)
+        if summary:
+            rendered = f"Zusammenfassung des früheren Gesprächs: {summary}\n{rendered}"
+        return rendered
+
+    def _summary(self, messages: List[BaseMessage]) -> str:
+        def key(num_messages: int) -> str:
+            return cache_key("summary", messages[:num_messages], tail_messages=num_messages)
+
+        prefix_key = key(len(messages))
+        with self._summary_locks_lock:
+            lock = self._summary_locks.setdefault(prefix_key, threading.Lock())
+        try:
+            with lock:
+                return self._extend_summary(messages, key)
+        finally:
+            with self._summary_locks_lock:
+                self._summary_locks.pop(prefix_key, None)
+
+    def _extend_summary(self, messages: List[BaseMessage], key: Callable[[int], str]) -> str:
+        summary = self.summaries.get(key(len(messages)))
+        if summary is not None:
+            return summary
+
+        # extend the summary of the longest cached prefix
+        start, summary = 0, ""
+        for num_messages in range(len(messages) - self.summary_step, 0, -self.summary_step):
+            cached_summary = self.summaries.get(key(num_messages))
+            if cached_summary is not None:
+                start, summary = num_messages, cached_summary
+                break
+
+        summary = self.summarize(SUMMARY_PROMPT.format(summary=summary or "Keine",
+                                                       messages=render_messages(messages[start:])))
+        self.summaries.set(key(len(messages)), summary)
+        return summary
@@ -1,209 +1,841 @@
+import asyncio
+import atexit
+import contextvars
+import inspect
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
-from typing import List, Dict, TypedDict, Literal, Union
+from typing import Callable, Iterator, List, Dict, Tuple, TypedDict, Literal, Union
 
 import instructor
-import pandas as pd
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from langgraph.graph import StateGraph, END
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from pydantic import BaseModel, Field
 
-from filtering import filter_dataframe
+from cache import Cache, DiskCache, LRUCache, cache_key
+from catalog import Catalog, CatalogManager, DEFAULT_CATALOG_PATH, get_catalog
+from context import DEFAULT_CONTEXT_TOKEN_BUDGET, DEFAULT_PASSAGE_TOKEN_BUDGET, build_context, render_passages
+import tracing
+from history import HistoryManager
+from fast_path import extract_filters
+from filtering import QUERY_OPTIONS
+from tracing import Tracer
+
+# How the chat mode selection and the filter extraction are executed:
+# - "sequential": one LLM call for the chat mode, followed by one for the filters in retrieval mode
+# - "combined": a single structured LLM call returning the chat mode and the filters
+# - "speculative": both calls run concurrently, the extracted filters are discarded in chit-chat mode, trading the
+#   tokens of an extraction call per chit-chat turn for the latency of one LLM round trip per retrieval turn
+WORKFLOW_MODES = ("sequential", "combined", "speculative")
+
+CHAT_MODE_PROMPT = """Analysiere die Chat Historie und Entscheide welche Chat Modus benötigt wird. Falls ein Nutzer Informationen über Leuchtmittel benötigt (zum Beispiel falls er fragt 'Wie viel wiegt XBO 4000 W/HS XL OFR?') müssen diese aus einer Datenbank retrieved werden. Schalte in diesem Fall in den 'retrieval' Modus. Falls keine neuen Informationen über Leuchtmittel aus der Datenbank benötigt werden (zum Beispiel weil es sich um eine eine chit-chat query handelt), schalte in den 'chit-chat' Modus. 
+
+            Chat Historie: {messages}"""
+
+EXTRACT_DATA_PROMPT = """Basierend auf der Nutzeranfrage, enzscheide welche Informationen benötigt werden und extrahiere diese. 
+
+                        Nutzeranfrage: {messages}"""
+
+CHAT_MODE_AND_EXTRACT_DATA_PROMPT = """Analysiere die Chat Historie und Entscheide welche Chat Modus benötigt wird. Falls ein Nutzer Informationen über Leuchtmittel benötigt (zum Beispiel falls er fragt 'Wie viel wiegt XBO 4000 W/HS XL OFR?') müssen diese aus einer Datenbank retrieved werden. Schalte in diesem Fall in den 'retrieval' Modus. Falls keine neuen Informationen über Leuchtmittel aus der Datenbank benötigt werden (zum Beispiel weil es sich um eine eine chit-chat query handelt), schalte in den 'chit-chat' Modus. Falls du in den 'retrieval' Modus schaltest, entscheide außerdem basierend auf der Nutzeranfrage welche Informationen benötigt werden und extrahiere diese. Im 'chit-chat' Modus extrahiere None.
+
+Chat Historie: {messages}"""
+
+
+class ChatMode(BaseModel):
+    chat_mode: Literal[tuple(["chit-chat", "retrieval"])] = Field(
+        description="Der Modus in welchen der Chatbot gehen soll, basierend auf der Chat Historie.")
+
+
+class FloatSearchOperator(BaseModel):
+    operator: Literal['==', '>', '>=', '<', '<='] = Field(...,
+                                                          description="Der Such bzw. Vergleichs Operator. Default zu exakt Match Operator.")
+    value: float = Field(..., description="The numerische Wert.")
+
+
+class IntSearchOperator(BaseModel):
+    operator: Literal['==', '>', '>=', '<', '<='] = Field(...,
+                                                          description="Der Such bzw. Vergleichs Operator. Default zu exakt Match Operator.")
+    value: float = Field(..., description="The numerische Wert.")
+
+
+class DateSearchOperator(BaseModel):
+    operator: Literal['==', '>', '>=', '<', '<='] = Field(...,
+                                                          description="Der Such bzw. Vergleichs Operator. Default zu exakt Match Operator.")
+    value: date = Field(..., description="Das Datum im DD-MMM-YYYY Format")
+
+
+# Columns the retrieval results can be sorted by and aggregated over, and the columns they can be grouped by
+SORTABLE_COLUMNS = ("nennstrom", "min_stromsteuerbereich", "max_stromsteuerbereich", "nennleistung", "nennspannung",
+                    "durchmesser", "laenge", "laenge_sockel", "abstand_lichtschwerpunkt", "elektrodenabstand_kalt",
+                    "produktgewicht", "kabel_laenge", "max_temp", "lifetime", "warranty", "datum_deklaration")
+GROUPABLE_COLUMNS = ("sockel_anode", "sockel_kathode", "anmerkung_produkt", "kuehlung", "brennstellung",
+                     "stoff_kandidatenliste", "info_sicherer_gebrauch", "max_temp", "warranty")
+
+
+class OrderBy(BaseModel):
+    column: Literal[SORTABLE_COLUMNS] = Field(..., description="Die Spalte nach der sortiert wird.")
+    descending: bool = Field(..., description="True für absteigend (z.B. das schwerste zuerst), False für aufsteigend (z.B. das leichteste zuerst).")
+
+
+class Aggregation(BaseModel):
+    function: Literal['count', 'min', 'max', 'mean'] = Field(...,
+                                                             description="Die Aggregatfunktion: Anzahl (count), Minimum (min), Maximum (max) oder Durchschnitt (mean).")
+    column: Union[Literal[SORTABLE_COLUMNS], None] = Field(
+        description="Die aggregierte Spalte. None um bei 'count' die Leuchtmittel zu zählen.")
+    group_by: Union[Literal[GROUPABLE_COLUMNS], None] = Field(
+        description="Die Spalte nach der gruppiert wird, zum Beispiel 'kuehlung' für die Anzahl je Kühlung. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+
+
+class ExtractData(BaseModel):
+    name: Union[str, None] = Field(
+        description="Der Name, Titel oder die Bezeichnung des Leuchmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    nennstrom: Union[FloatSearchOperator, None] = Field(
+        description="Der Nennstrom des Lechtmittels in Ampere. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    min_stromsteuerbereich: Union[IntSearchOperator, None] = Field(
+        description="Das Minimum des Stromsteuerbereichs in Ampere. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    max_stromsteuerbereich: Union[IntSearchOperator, None] = Field(
+        description="Das Maximum des Stromsteuerbereichs in Ampere. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    nennleistung: Union[FloatSearchOperator, None] = Field(
+        description="Die Nennleistung des Lechtmittels in Watt. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    nennspannung: Union[FloatSearchOperator, None] = Field(
+        description="Die Nennspannung des Lechtmittels in Volt. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    durchmesser: Union[FloatSearchOperator, None] = Field(
+        description="Der Durchmesser des Lechtmittels in Millimeter. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    laenge: Union[FloatSearchOperator, None] = Field(
+        description="Die Länge des Lechtmittels in Millimeter. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    laenge_sockel: Union[FloatSearchOperator, None] = Field(
+        description="Die Länge des Lechtmittels mit Sockel jedoch ohne Sockelstift in Millimeter. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    abstand_lichtschwerpunkt: Union[FloatSearchOperator, None] = Field(
+        description="Der Abstand Lichtschwerpunkt (LCL) des Lechtmittels in Millimeter. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    elektrodenabstand_kalt: Union[FloatSearchOperator, None] = Field(
+        description="Der Elektrodenabstand kalt des Lechtmittels in Millimeter. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    produktgewicht: Union[FloatSearchOperator, None] = Field(
+        description="Das Produktgewicht des Lechtmittels in Gramm. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    kabel_laenge: Union[FloatSearchOperator, None] = Field(
+        description="Die Kabellänge des Lechtmittels. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    max_temp: Union[IntSearchOperator, None] = Field(
+        description="Die maximal zulässige Umgebungstemperatur Quetschung des Lechtmittels in Grad Celsius. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    lifetime: Union[IntSearchOperator, None] = Field(
+        description="Die Lebensdauer des Lechtmittels in Stunden/h. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    warranty: Union[IntSearchOperator, None] = Field(
+        description="Die Service Warranty Lifetime des Lechtmittels in Stunden/h. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    sockel_anode: Union[str, None] = Field(
+        description="Die Sockel Anode (Normbezeichnung) des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    sockel_kathode: Union[str, None] = Field(
+        description="Die Sockel Kathode (Normbezeichnung) des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    anmerkung_produkt: Union[str, None] = Field(
+        description="Die Anmerkung zum Produkt des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    kuehlung: Union[str, None] = Field(
+        description="Die Kühlung des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    brennstellung: Union[str, None] = Field(
+        description="Die Brennstellung des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    datum_deklaration: Union[DateSearchOperator, None] = Field(
+        description="Das Datum der Deklaration des Lechtmittels im DD-MMM-YYYY Format. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    erzeugnisnummer: Union[int, None] = Field(
+        description="Die Erzeugnisnummer des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    stoff_kandidatenliste: Union[str, None] = Field(
+        description="Der Stoff der Kandidatenliste des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    stoff_cas_nr: Union[str, None] = Field(
+        description="Die CAS Nr. des Stoffes des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    info_sicherer_gebrauch: Union[str, None] = Field(
+        description="Die nformationen zum sicheren Gebrauch des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    scip_deklarationsnummer: Union[str, None] = Field(
+        description="Die SCIP Deklarationsnummer des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    order_by: Union[OrderBy, None] = Field(
+        description="Die Sortierung der Leuchtmittel, zum Beispiel nach produktgewicht aufsteigend für 'Welches Leuchtmittel ist das leichteste?'. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    limit: Union[int, None] = Field(
+        description="Die maximale Anzahl der Leuchtmittel, zum Beispiel 1 für 'das leichteste' oder 3 für 'die drei hellsten'. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+    aggregations: Union[List[Aggregation], None] = Field(
+        description="Die Aggregate, falls der Nutzer nach einer Anzahl, einem Minimum, Maximum oder Durchschnitt fragt, zum Beispiel count für 'Wie viele Leuchtmittel haben mindestens 1500W?'. Alle Aggregate verwenden dieselbe Gruppierung. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
+
+
+class ChatModeAndExtractData(BaseModel):
+    chat_mode: Literal[tuple(["chit-chat", "retrieval"])] = Field(
+        description="Der Modus in welchen der Chatbot gehen soll, basierend auf der Chat Historie.")
+    extract_data: Union[ExtractData, None] = Field(
+        description="Die aus der Nutzeranfrage extrahierten Informationen im 'retrieval' Modus. Im 'chit-chat' Modus None.")
 
 
 class AgentState(TypedDict):
     messages: List[HumanMessage | AIMessage | SystemMessage]
     response: str
     chat_mode: str
-    data: pd.DataFrame
+    catalog: Catalog
     retrieved_data: List[dict]
+    passages: List[dict]
+    filters: dict
+    context_stats: dict
+    stream: bool
+    response_stream: Iterator
+    route: str
 
 
 class LLMAgent:
-    def __init__(self, openai_api_key: str):
+    def __init__(self, openai_api_key: str, catalog: CatalogManager = None, openai_base_url: str = None,
+                 workflow_mode: str = "sequential", fast_path: bool = True, cache: Cache = None,
+                 context_token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET, history_window_messages: int = 6,
+                 history_token_budgets: Dict[str, int] = None, text_search: bool = True, num_passages: int = 5,
+                 passage_token_budget: int = DEFAULT_PASSAGE_TOKEN_BUDGET, tracer: Tracer = None):
+        if workflow_mode not in WORKFLOW_MODES:
+            raise ValueError(f"Workflow mode '{workflow_mode}' is not supported.")
+
         self.openai_key = openai_api_key
         self.llm_model_name = "gpt-4o"
-        self.llm_client = instructor.from_openai(OpenAI(api_key=self.openai_key))
-        self.state: AgentState = self._initialize_state()
+        # openai_base_url allows pointing the agent to an OpenAI-compatible server, e.g. mock_openai.MockOpenAIServer
+        self.openai_client = OpenAI(api_key=self.openai_key, base_url=openai_base_url)
+        self.llm_client = instructor.from_openai(self.openai_client)
+        # the async clients of achat share one connection pool, they are bound to the event loop of the first call
+        self.async_openai_client = AsyncOpenAI(api_key=self.openai_key, base_url=openai_base_url)
+        self.async_llm_client = instructor.from_openai(self.async_openai_client)
+        self.catalog = catalog if catalog is not None else get_catalog()
+        self.workflow_mode = workflow_mode
+        # runs the speculative extractions of the sync workflow, shut down by close()
+        self.executor = ThreadPoolExecutor() if workflow_mode == "speculative" else None
+        self.fast_path = fast_path
+        # cache for the chat mode, extracted data and response, None to disable caching
+        self.cache = cache
+        # maximum number of prompt tokens for the retrieval results
+        self.context_token_budget = context_token_budget
+        # BM25 search of the free-text columns and datasheets next to the structured filters in retrieval mode
+        self.text_search = text_search
+        self.num_passages = num_passages
+        self.passage_token_budget = passage_token_budget
+        # sliding window and rolling summary bounding the conversation history per graph node, the summaries are
+        # cached separately, so their prefix lookups do not count towards the hit rate of the response cache
+        summaries = DiskCache(cache.path, table="summaries") if isinstance(cache, DiskCache) else LRUCache()
+        self.history = HistoryManager(summarize=self._summarize, window_messages=history_window_messages,
+                                      token_budgets=history_token_budgets, summaries=summaries)
+        # number of turns per route ("fast_path" or "llm") to measure the hit rate of the fast path
+        self.route_counts = Counter()
+        self._route_counts_lock = threading.Lock()
+        # collects per-turn traces of the graph nodes and LLM calls, None to disable the instrumentation
+        self.tracer = tracer
         self.workflow = self._create_workflow()
-
-    def _initialize_state(self) -> AgentState:
-        """Initialize the agent state."""
+        self.async_workflow = self._create_async_workflow()
+
+    def close(self) -> None:
+        """
+        Shut down the executor of the speculative extractions without waiting for running ones and close the
+        connections of the sync OpenAI client. Agents of get_agent are closed when the process exits.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.openai_client.close()
+
+    def _initialize_state(self, messages: List[HumanMessage | AIMessage | SystemMessage],
+                          stream: bool = False) -> AgentState:
+        """Initialize a fresh agent state for a single conversation turn."""
         return {
-            "messages": [],
+            "messages": messages,
             "chat_mode": "chit-chat",
             "response": None,
-            "data": pd.read_json("data/illuminants.jsonl", lines=True),
-            "retrieved_data": None
+            # the catalog snapshot is pinned for the whole turn, so a reload does not affect a running turn
+            "catalog": self.catalog.catalog,
+            "retrieved_data": None,
+            "passages": None,
+            "filters": None,
+            "context_stats": None,
+            "stream": stream,
+            "response_stream": None,
+            "route": None
         }
 
-    def _create_workflow(self):
-        workflow = StateGraph(AgentState)
-
-        def select_chat_mode(state: AgentState) -> AgentState:
-            class ChatMode(BaseModel):
-                chat_mode: Literal[tuple(["chit-chat", "retrieval"])] = Field(
-                    description="Der Modus in welchen der Chatbot gehen soll, basierend auf der Chat Historie.")
-
-            prompt = f"""Analysiere die Chat Historie und Entscheide welche Chat Modus benötigt wird. Falls ein Nutzer Informationen über Leuchtmittel benötigt (zum Beispiel falls er fragt 'Wie viel wiegt XBO 4000 W/HS XL OFR?') müssen diese aus einer Datenbank retrieved werden. Schalte in diesem Fall in den 'retrieval' Modus. Falls keine neuen Informationen über Leuchtmittel aus der Datenbank benötigt werden (zum Beispiel weil es sich um eine eine chit-chat query handelt), schalte in den 'chit-chat' Modus. 
-
-            Chat Historie: {state['messages']}"""
-
-            # query the OpenAI model and get a structured response
-            response = self.llm_client.chat.completions.create(
+    def _cache_key(self, kind: str, messages: List[HumanMessage | AIMessage | SystemMessage],
+                   version: str = "", **kwargs) -> Union[str, None]:
+        if self.cache is None:
+            return None
+        return cache_key(f"{kind}:{self.llm_model_name}", messages, version=version, **kwargs)
+
+    def _cached(self, kind: str, messages: List[HumanMessage | AIMessage | SystemMessage], compute,
+                version: str = ""):
+        """Return the cached result for the conversation tail or compute and cache it, if caching is enabled."""
+        key = self._cache_key(kind, messages, version=version)
+        if key is None:
+            return compute()
+
+        value = self.cache.get(key)
+        if value is None:
+            tracing.record(cache_misses=1)
+            value = compute()
+            self.cache.set(key, value)
+        else:
+            tracing.record(cache_hits=1)
+        return value
+
+    async def _acached(self, kind: str, messages: List[HumanMessage | AIMessage | SystemMessage], compute,
+                       version: str = ""):
+        """Async variant of _cached for a compute coroutine function, the cache is accessed in worker threads."""
+        key = self._cache_key(kind, messages, version=version)
+        if key is None:
+            return await compute()
+
+        # a DiskCache lookup is a blocking SQLite query
+        value = await asyncio.to_thread(self.cache.get, key)
+        if value is None:
+            tracing.record(cache_misses=1)
+            value = await compute()
+            await asyncio.to_thread(self.cache.set, key, value)
+        else:
+            tracing.record(cache_hits=1)
+        return value
+
+    def _create_structured(self, kind: str, prompt: str, response_model: type):
+        """Query the OpenAI model for a structured response, recording the call and its token usage when traced."""
+        with tracing.span(f"llm.{kind}"):
+            response, completion = self.llm_client.chat.completions.create_with_completion(
                 model=self.llm_model_name,
                 messages=[{"role": "user", "content": prompt}],
-                response_model=ChatMode,
+                response_model=response_model,
                 temperature=0
             )
+            tracing.record_usage(completion.usage)
+        return response
 
-            state['chat_mode'] = response.chat_mode
-            return state
-
-        def retrieve(state: AgentState) -> AgentState:
-            prompt = f"""Basierend auf der Nutzeranfrage, enzscheide welche Informationen benötigt werden und extrahiere diese. 
-
-                        Nutzeranfrage: {state['messages']}"""
-
-            class FloatSearchOperator(BaseModel):
-                operator: Literal['==', '>', '>=', '<', '<='] = Field(...,
-                                                                      description="Der Such bzw. Vergleichs Operator. Default zu exakt Match Operator.")
-                value: float = Field(..., description="The numerische Wert.")
-
-            class IntSearchOperator(BaseModel):
-                operator: Literal['==', '>', '>=', '<', '<='] = Field(...,
-                                                                      description="Der Such bzw. Vergleichs Operator. Default zu exakt Match Operator.")
-                value: float = Field(..., description="The numerische Wert.")
-
-            class DateSearchOperator(BaseModel):
-                operator: Literal['==', '>', '>=', '<', '<='] = Field(...,
-                                                                      description="Der Such bzw. Vergleichs Operator. Default zu exakt Match Operator.")
-                value: date = Field(..., description="Das Datum im DD-MMM-YYYY Format")
-
-            class ExtractData(BaseModel):
-                name: Union[str, None] = Field(
-                    description="Der Name, Titel oder die Bezeichnung des Leuchmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                nennstrom: Union[FloatSearchOperator, None] = Field(
-                    description="Der Nennstrom des Lechtmittels in Ampere. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                min_stromsteuerbereich: Union[IntSearchOperator, None] = Field(
-                    description="Das Minimum des Stromsteuerbereichs in Ampere. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                max_stromsteuerbereich: Union[IntSearchOperator, None] = Field(
-                    description="Das Maximum des Stromsteuerbereichs in Ampere. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                nennleistung: Union[FloatSearchOperator, None] = Field(
-                    description="Die Nennleistung des Lechtmittels in Watt. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                nennspannung: Union[FloatSearchOperator, None] = Field(
-                    description="Die Nennspannung des Lechtmittels in Volt. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                durchmesser: Union[FloatSearchOperator, None] = Field(
-                    description="Der Durchmesser des Lechtmittels in Millimeter. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                laenge: Union[FloatSearchOperator, None] = Field(
-                    description="Die Länge des Lechtmittels in Millimeter. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                laenge_sockel: Union[FloatSearchOperator, None] = Field(
-                    description="Die Länge des Lechtmittels mit Sockel jedoch ohne Sockelstift in Millimeter. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                abstand_lichtschwerpunkt: Union[FloatSearchOperator, None] = Field(
-                    description="Der Abstand Lichtschwerpunkt (LCL) des Lechtmittels in Millimeter. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                elektrodenabstand_kalt: Union[FloatSearchOperator, None] = Field(
-                    description="Der Elektrodenabstand kalt des Lechtmittels in Millimeter. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                produktgewicht: Union[FloatSearchOperator, None] = Field(
-                    description="Das Produktgewicht des Lechtmittels in Gramm. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                kabel_laenge: Union[FloatSearchOperator, None] = Field(
-                    description="Die Kabellänge des Lechtmittels. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10.0, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                max_temp: Union[IntSearchOperator, None] = Field(
-                    description="Die maximal zulässige Umgebungstemperatur Quetschung des Lechtmittels in Grad Celsius. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                lifetime: Union[IntSearchOperator, None] = Field(
-                    description="Die Lebensdauer des Lechtmittels in Stunden/h. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                warranty: Union[IntSearchOperator, None] = Field(
-                    description="Die Service Warranty Lifetime des Lechtmittels in Stunden/h. Dazu der Such Operator, ob ein exaktes Match (==), größer (>), größer gleich (>=), kleiner gleich (<=) oder kleiner (<) als dieser Wert gesucht wird. Zum Beispiel (10, >=). Default zu exakt Match Operator. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                sockel_anode: Union[str, None] = Field(
-                    description="Die Sockel Anode (Normbezeichnung) des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                sockel_kathode: Union[str, None] = Field(
-                    description="Die Sockel Kathode (Normbezeichnung) des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                anmerkung_produkt: Union[str, None] = Field(
-                    description="Die Anmerkung zum Produkt des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                kuehlung: Union[str, None] = Field(
-                    description="Die Kühlung des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                brennstellung: Union[str, None] = Field(
-                    description="Die Brennstellung des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                datum_deklaration: Union[DateSearchOperator, None] = Field(
-                    description="Das Datum der Deklaration des Lechtmittels im DD-MMM-YYYY Format. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                erzeugnisnummer: Union[int, None] = Field(
-                    description="Die Erzeugnisnummer des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                stoff_kandidatenliste: Union[str, None] = Field(
-                    description="Der Stoff der Kandidatenliste des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                stoff_cas_nr: Union[str, None] = Field(
-                    description="Die CAS Nr. des Stoffes des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                info_sicherer_gebrauch: Union[str, None] = Field(
-                    description="Die nformationen zum sicheren Gebrauch des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-                scip_deklarationsnummer: Union[str, None] = Field(
-                    description="Die SCIP Deklarationsnummer des Lechtmittels. Falls der Nutzer nichts derartiges fragt, extrahiere None.")
-
-            response = self.llm_client.chat.completions.create(
+    async def _acreate_structured(self, kind: str, prompt: str, response_model: type):
+        """Async variant of _create_structured using the pooled async client."""
+        with tracing.span(f"llm.{kind}"):
+            response, completion = await self.async_llm_client.chat.completions.create_with_completion(
                 model=self.llm_model_name,
                 messages=[{"role": "user", "content": prompt}],
-                response_model=ExtractData,
+                response_model=response_model,
                 temperature=0
             )
+            tracing.record_usage(completion.usage)
+        return response
 
-            state['retrieved_data'] = filter_dataframe(df=state['data'], filters=response.dict())
+    def _select_chat_mode(self, messages: List[HumanMessage | AIMessage | SystemMessage]) -> str:
+        def compute():
+            # query the OpenAI model and get a structured response
+            response = self._create_structured("chat_mode", CHAT_MODE_PROMPT.format(
+                messages=self.history.render(messages, "select_chat_mode")), ChatMode)
+            return response.chat_mode
+
+        return self._cached("chat_mode", messages, compute)
+
+    async def _aselect_chat_mode(self, messages: List[HumanMessage | AIMessage | SystemMessage]) -> str:
+        async def compute():
+            # rendering the history may summarize older messages with a blocking LLM call
+            history = await asyncio.to_thread(self.history.render, messages, "select_chat_mode")
+            response = await self._acreate_structured("chat_mode", CHAT_MODE_PROMPT.format(messages=history),
+                                                      ChatMode)
+            return response.chat_mode
+
+        return await self._acached("chat_mode", messages, compute)
+
+    def _extract_data(self, messages: List[HumanMessage | AIMessage | SystemMessage]) -> ExtractData:
+        def compute():
+            response = self._create_structured("extract_data", EXTRACT_DATA_PROMPT.format(
+                messages=self.history.render(messages, "extract_data")), ExtractData)
+            return response.model_dump(mode='json')
+
+        return ExtractData.model_validate(self._cached("extract_data", messages, compute))
+
+    async def _aextract_data(self, messages: List[HumanMessage | AIMessage | SystemMessage]) -> ExtractData:
+        async def compute():
+            history = await asyncio.to_thread(self.history.render, messages, "extract_data")
+            response = await self._acreate_structured("extract_data", EXTRACT_DATA_PROMPT.format(messages=history),
+                                                      ExtractData)
+            return response.model_dump(mode='json')
+
+        return ExtractData.model_validate(await self._acached("extract_data", messages, compute))
+
+    def _select_chat_mode_and_extract_data(self, messages: List[HumanMessage | AIMessage | SystemMessage]) -> tuple:
+        """Select the chat mode and extract the filters in one round trip, according to the workflow mode."""
+        if self.workflow_mode == "combined":
+            def compute():
+                response = self._create_structured(
+                    "chat_mode_and_extract_data", CHAT_MODE_AND_EXTRACT_DATA_PROMPT.format(
+                        messages=self.history.render(messages, "extract_data")), ChatModeAndExtractData)
+                return response.model_dump(mode='json')
+
+            response = ChatModeAndExtractData.model_validate(
+                self._cached("chat_mode_and_extract_data", messages, compute))
+            return response.chat_mode, response.extract_data
+
+        # speculatively extract the filters while the chat mode is selected, in the context of the current trace
+        extract_data = self.executor.submit(contextvars.copy_context().run, self._extract_data, messages)
+        chat_mode = self._select_chat_mode(messages)
+        if chat_mode != "retrieval":
+            # only drops an extraction that has not started yet, a running LLM call cannot be interrupted, it finishes
+            # in the background and its tokens are paid for
+            extract_data.cancel()
+            return chat_mode, None
+        return chat_mode, extract_data.result()
+
+    async def _aselect_chat_mode_and_extract_data(self,
+                                                  messages: List[HumanMessage | AIMessage | SystemMessage]) -> tuple:
+        """Async variant of _select_chat_mode_and_extract_data, a discarded speculative extraction is cancelled."""
+        if self.workflow_mode == "combined":
+            async def compute():
+                history = await asyncio.to_thread(self.history.render, messages, "extract_data")
+                response = await self._acreate_structured(
+                    "chat_mode_and_extract_data", CHAT_MODE_AND_EXTRACT_DATA_PROMPT.format(messages=history),
+                    ChatModeAndExtractData)
+                return response.model_dump(mode='json')
+
+            response = ChatModeAndExtractData.model_validate(
+                await self._acached("chat_mode_and_extract_data", messages, compute))
+            return response.chat_mode, response.extract_data
+
+        # the task runs in a copy of the current context, so it is recorded on the current trace
+        extract_data = asyncio.create_task(self._aextract_data(messages))
+        try:
+            chat_mode = await self._aselect_chat_mode(messages)
+        except BaseException:
+            extract_data.cancel()
+            raise
+        if chat_mode != "retrieval":
+            extract_data.cancel()
+            return chat_mode, None
+        return chat_mode, await extract_data
+
+    def _summarize(self, prompt: str) -> str:
+        with tracing.span("llm.summary"):
+            response = self.openai_client.chat.completions.create(model=self.llm_model_name,
+                                                                  messages=[{"role": "user", "content": prompt}],
+                                                                  temperature=0)
+            tracing.record_usage(response.usage)
+        return response.choices[0].message.content
+
+    @staticmethod
+    def _filter(state: AgentState) -> Union[List[dict], None]:
+        """Run the extracted filters on the catalog snapshot of the turn."""
+        with tracing.span("filter"):
+            retrieved_data = state['catalog'].filter_engine.filter(state['filters'])
+            tracing.record(rows=len(retrieved_data or []))
+        return retrieved_data
+
+    def _traced(self, name: str, node):
+        """Wrap a graph node to record it as a span of the current trace, or return it unchanged without a tracer."""
+        if self.tracer is None:
+            return node
+
+        if inspect.iscoroutinefunction(node):
+            async def traced_async_node(state: AgentState) -> AgentState:
+                with tracing.span(name):
+                    return await node(state)
+
+            return traced_async_node
+
+        def traced_node(state: AgentState) -> AgentState:
+            with tracing.span(name):
+                return node(state)
+
+        return traced_node
+
+    def _count_route(self, route: str) -> None:
+        with self._route_counts_lock:
+            self.route_counts[route] += 1
+
+    def _fast_path_filters(self, state: AgentState) -> Union[dict, None]:
+        """The filters of the deterministic rules for the last user message, None if the LLM has to extract them."""
+        user_messages = [message for message in state['messages'] if isinstance(message, HumanMessage)]
+        filters = extract_filters(user_messages[-1].content) if self.fast_path and user_messages else None
+        if filters is None:
+            return None
+        return ExtractData(**{**dict.fromkeys(ExtractData.model_fields), **filters}).dict()
+
+    def _fast_path(self, state: AgentState) -> AgentState:
+        # deterministic rules for unambiguous queries, the LLM router and extractor are only used as fallback
+        filters = self._fast_path_filters(state)
+
+        if filters is None:
+            state['route'] = "llm"
+        else:
+            state['route'] = "fast_path"
+            state['chat_mode'] = "retrieval"
+            state['filters'] = filters
+            state['retrieved_data'] = self._filter(state)
+
+        self._count_route(state['route'])
+        return state
+
+    def _search_text(self, state: AgentState) -> AgentState:
+        # hybrid retrieval: the passages are restricted to the datasheets of the filtered illuminants, or ranked
+        # over all datasheets if the filters are empty or match nothing
+        filters = state['filters'] or {}
+        if filters.get('aggregations'):
+            return state
+
+        user_messages = [message for message in state['messages'] if isinstance(message, HumanMessage)]
+        file_names = {row['file_name'] for row in state['retrieved_data'] or []} or None
+        state['passages'] = state['catalog'].fulltext_index.search(user_messages[-1].content, k=self.num_passages,
+                                                                   file_names=file_names)
+        return state
+
+    def _prepare_response(self, state: AgentState) -> Tuple[List[dict], Union[str, None]]:
+        """Build the messages of the response prompt and the response cache key of a turn."""
+        messages = state['messages']
+
+        system_message = (
+            "Du bist ein sachkundiger und freundlicher Assistent der Informationen über Leuchtmittel bereitstellt. "
+            "Antworte immer auf Deutsch. ")
+
+        if state['chat_mode'] == "retrieval":
+            # compact table of the relevant columns instead of the repr of every row
+            context, state['context_stats'] = build_context(state['retrieved_data'], state['filters'],
+                                                            token_budget=self.context_token_budget)
+            system_message += ("Beantworte die Nutzeranfrage mit den folgenden Retrieval Ergebnissen:. "
+                               f"Ergebnisse: " + context +
+                               " Falls die Ergebnisse None sind, sage dem Nutzer dass keine Leuctmittel zu dieser Anfrage gefunden wurden.")
+            if any((state['filters'] or {}).get(option) is not None for option in QUERY_OPTIONS):
+                system_message += (" Die Ergebnisse sind bereits wie angefragt sortiert, begrenzt oder aggregiert, "
+                                   "übernimm die Werte ohne sie neu zu berechnen.")
+            if state['passages']:
+                system_message += (" Textstellen aus den Datenblättern, die zur Nutzeranfrage passen: "
+                                   + render_passages(state['passages'], token_budget=self.passage_token_budget))
+
+        # only the recent messages are sent, older ones are part of the rolling summary
+        summary, window = self.history.window(messages, "generate_response")
+        if summary:
+            system_message += f" Zusammenfassung des früheren Gesprächs: {summary}"
+
+        # Prepare the messages for the API call
+        formatted_messages = [{"role": "system", "content": system_message}] + [
+            {"role": "assistant" if isinstance(message, AIMessage) else "user", "content": message.content}
+            for message in window
+        ]
 
+        # the response depends on exactly the rendered history, i.e. the window and the summary, and on the catalog, so
+        # it is invalidated when the catalog changes
+        key = self._cache_key("response", window, version=state['catalog'].version, tail_messages=None,
+                              summary=summary)
+        return formatted_messages, key
+
+    def _cached_response(self, key: Union[str, None]) -> Union[str, None]:
+        if key is None:
+            return None
+        cached_response = self.cache.get(key)
+        tracing.record(**({"cache_hits": 1} if cached_response is not None else {"cache_misses": 1}))
+        return cached_response
+
+    def _generate_response(self, state: AgentState) -> AgentState:
+        formatted_messages, key = self._prepare_response(state)
+        cached_response = self._cached_response(key)
+        if cached_response is not None:
+            state['response'] = cached_response
+            state['response_stream'] = iter([cached_response])
             return state
 
-        def generate_response(state: AgentState) -> AgentState:
-            messages = state['messages']
+        # Call the OpenAI API with the latest method for generating completions
+        with tracing.span("llm.response"):
+            response = self.openai_client.chat.completions.create(
+                model=self.llm_model_name, messages=formatted_messages, temperature=0, stream=state['stream'],
+                # the token usage of a stream is sent with its last chunk
+                **({"stream_options": {"include_usage": True}} if state['stream'] else {}))
+            if not state['stream']:
+                tracing.record_usage(response.usage)
+
+        if state['stream']:
+            # The request has been sent, the tokens are consumed lazily by chat_stream
+            state['response_stream'] = self._stream_tokens(response, key, tracing.current_trace())
+            return state
 
-            system_message = (
-                "Du bist ein sachkundiger und freundlicher Assistent der Informationen über Leuchtmittel bereitstellt. "
-                "Antworte immer auf Deutsch. ")
+        # Update the state with the response content
+        state['response'] = response.choices[0].message.content
+        if key is not None:
+            self.cache.set(key, state['response'])
+        return state
 
+    def _create_workflow(self):
+        def select_chat_mode(state: AgentState) -> AgentState:
+            state['chat_mode'] = self._select_chat_mode(state['messages'])
+            return state
+
+        def retrieve(state: AgentState) -> AgentState:
+            response = self._extract_data(state['messages'])
+            state['filters'] = response.dict()
+            state['retrieved_data'] = self._filter(state)
+
+            return state
+
+        def select_chat_mode_and_retrieve(state: AgentState) -> AgentState:
+            state['chat_mode'], response = self._select_chat_mode_and_extract_data(state['messages'])
             if state['chat_mode'] == "retrieval":
-                system_message += ("Beantworte die Nutzeranfrage mit den folgenden Retrieval Ergebnissen:. "
-                                   f"Ergebnisse: " + str(state['retrieved_data']) +
-                                   " Falls die Ergebnisse None sind, sage dem Nutzer dass keine Leuctmittel zu dieser Anfrage gefunden wurden.")
-
-            # Prepare the messages for the API call
-            formatted_messages = [{"role": "system", "content": system_message}] + [
-                {"role": "assistant" if isinstance(message, AIMessage) else "user", "content": message.content}
-                for message in messages
-            ]
-
-            # Call the OpenAI API with the latest method for generating completions
-            client = OpenAI(api_key=self.openai_key)
-            response = client.chat.completions.create(model=self.llm_model_name,
-                                                      messages=formatted_messages,
-                                                      temperature=0)
-
-            # Update the state with the response content
+                state['filters'] = response.dict() if response is not None else {}
+                state['retrieved_data'] = self._filter(state)
+
+            return state
+
+        return self._compile_workflow({
+            "fast_path": self._fast_path,
+            "select_chat_mode": select_chat_mode,
+            "retrieve": retrieve,
+            "select_chat_mode_and_retrieve": select_chat_mode_and_retrieve,
+            "search_text": self._search_text,
+            "generate_response": self._generate_response,
+        })
+
+    def _create_async_workflow(self):
+        """
+        The workflow of achat: the LLM calls are awaited on the pooled async client, the CPU-bound filtering, text
+        search and context building run in worker threads so they do not block the event loop.
+        """
+        async def fast_path(state: AgentState) -> AgentState:
+            return await asyncio.to_thread(self._fast_path, state)
+
+        async def select_chat_mode(state: AgentState) -> AgentState:
+            state['chat_mode'] = await self._aselect_chat_mode(state['messages'])
+            return state
+
+        async def retrieve(state: AgentState) -> AgentState:
+            response = await self._aextract_data(state['messages'])
+            state['filters'] = response.dict()
+            state['retrieved_data'] = await asyncio.to_thread(self._filter, state)
+            return state
+
+        async def select_chat_mode_and_retrieve(state: AgentState) -> AgentState:
+            state['chat_mode'], response = await self._aselect_chat_mode_and_extract_data(state['messages'])
+            if state['chat_mode'] == "retrieval":
+                state['filters'] = response.dict() if response is not None else {}
+                state['retrieved_data'] = await asyncio.to_thread(self._filter, state)
+            return state
+
+        async def search_text(state: AgentState) -> AgentState:
+            return await asyncio.to_thread(self._search_text, state)
+
+        async def generate_response(state: AgentState) -> AgentState:
+            formatted_messages, key = await asyncio.to_thread(self._prepare_response, state)
+            cached_response = await asyncio.to_thread(self._cached_response, key)
+            if cached_response is not None:
+                state['response'] = cached_response
+                return state
+
+            with tracing.span("llm.response"):
+                response = await self.async_openai_client.chat.completions.create(
+                    model=self.llm_model_name, messages=formatted_messages, temperature=0)
+                tracing.record_usage(response.usage)
+
             state['response'] = response.choices[0].message.content
+            if key is not None:
+                await asyncio.to_thread(self.cache.set, key, state['response'])
             return state
 
+        return self._compile_workflow({
+            "fast_path": fast_path,
+            "select_chat_mode": select_chat_mode,
+            "retrieve": retrieve,
+            "select_chat_mode_and_retrieve": select_chat_mode_and_retrieve,
+            "search_text": search_text,
+            "generate_response": generate_response,
+        })
+
+    def _compile_workflow(self, nodes: Dict[str, Callable]):
+        """Wire the graph of the workflow mode from the node functions, either all sync or all async."""
+        workflow = StateGraph(AgentState)
+
+        def fast_path_routing_function(state: AgentState):
+            return state['route'] == "fast_path"
+
         def routing_function(state: AgentState):
             if state['chat_mode'] == "retrieval":
                 return True
             else:
                 return False
 
-        workflow.add_node("select_chat_mode", select_chat_mode)
-        workflow.add_node("generate_response", generate_response)
-        workflow.add_node("retrieve", retrieve)
+        workflow.add_node("fast_path", self._traced("fast_path", nodes["fast_path"]))
+        workflow.add_node("generate_response", self._traced("generate_response", nodes["generate_response"]))
+
+        # the structured retrieval is followed by the full-text search, if enabled
+        after_retrieval = "generate_response"
+        if self.text_search:
+            workflow.add_node("search_text", self._traced("search_text", nodes["search_text"]))
+            workflow.add_edge("search_text", "generate_response")
+            after_retrieval = "search_text"
+
+        if self.workflow_mode == "sequential":
+            workflow.add_node("select_chat_mode", self._traced("select_chat_mode", nodes["select_chat_mode"]))
+            workflow.add_node("retrieve", self._traced("retrieve", nodes["retrieve"]))
+
+            llm_entry_point = "select_chat_mode"
+            # Add conditional edges
+            workflow.add_conditional_edges(
+                "select_chat_mode",
+                routing_function,
+                {True: "retrieve", False: "generate_response"}
+            )
+            workflow.add_edge("retrieve", after_retrieval)
+        else:
+            workflow.add_node("select_chat_mode_and_retrieve",
+                              self._traced("select_chat_mode_and_retrieve", nodes["select_chat_mode_and_retrieve"]))
+            llm_entry_point = "select_chat_mode_and_retrieve"
+            workflow.add_conditional_edges(
+                "select_chat_mode_and_retrieve",
+                routing_function,
+                {True: after_retrieval, False: "generate_response"}
+            )
 
-        workflow.set_entry_point("select_chat_mode")
-        # Add conditional edges
+        # fast path hits are retrieval turns, so they take the same post-retrieval steps as the LLM extraction
+        workflow.set_entry_point("fast_path")
         workflow.add_conditional_edges(
-            "select_chat_mode",
-            routing_function,
-            {True: "retrieve", False: "generate_response"}
+            "fast_path",
+            fast_path_routing_function,
+            {True: after_retrieval, False: llm_entry_point}
         )
-        workflow.add_edge("retrieve", "generate_response")
         workflow.add_edge("generate_response", END)
 
         return workflow.compile()
 
-    def chat(self, messages: List[Dict[str, str]]) -> str:
-        # Update the state with new messages
-        self.state['messages'] = [
+    @staticmethod
+    def _to_langchain_messages(messages: List[Dict[str, str]]) -> List[HumanMessage | AIMessage]:
+        return [
             AIMessage(content=m["content"]) if m["role"] == "assistant" else HumanMessage(content=m["content"])
             for m in messages
         ]
 
-        final_state = self.workflow.invoke(self.state)
-        # print("Final state after workflow invocation:", final_state)  # Print final state for debugging
+    def _start_trace(self) -> Union[tracing.Trace, None]:
+        return self.tracer.start(workflow_mode=self.workflow_mode) if self.tracer is not None else None
+
+    def _finish_trace(self, trace: Union[tracing.Trace, None], final_state: Union[AgentState, None]) -> None:
+        if trace is None:
+            return
+        if final_state is None:
+            self.tracer.finish(trace, error=True)
+            return
+        self.tracer.finish(trace, route=final_state['route'], chat_mode=final_state['chat_mode'],
+                           rows=len(final_state['retrieved_data'] or []),
+                           catalog_version=final_state['catalog'].version)
+
+    def chat(self, messages: List[Dict[str, str]]) -> str:
+        # Build a fresh state from the session's messages, so one agent can serve many sessions concurrently
+        state = self._initialize_state(self._to_langchain_messages(messages))
+
+        trace = self._start_trace()
+        final_state = None
+        try:
+            with tracing.activate(trace):
+                final_state = self.workflow.invoke(state)
+        finally:
+            self._finish_trace(trace, final_state)
+        return final_state['response']
+
+    async def achat(self, messages: List[Dict[str, str]]) -> str:
+        """
+        Async variant of chat for serving many concurrent sessions from one event loop.
+
+        The LLM calls share the pooled async OpenAI client, the conversation state is passed with every call like in
+        chat. All calls of an agent must run on the same event loop, the one its async client is bound to.
+        """
+        state = self._initialize_state(self._to_langchain_messages(messages))
+
+        trace = self._start_trace()
+        final_state = None
+        try:
+            with tracing.activate(trace):
+                final_state = await self.async_workflow.ainvoke(state)
+        finally:
+            self._finish_trace(trace, final_state)
         return final_state['response']
+
+    def plan(self, messages: List[Dict[str, str]]) -> AgentState:
+        """
+        Route a turn and extract its filters like chat, but without running the filters or generating the response.
+
+        Together with answer, this splits a turn into phases, so the filters of many questions can be executed in one
+        pass over the catalog with FilterEngine.execute_many (see batch.py). The catalog snapshot is pinned in the
+        returned state, its 'filters' are None in chit-chat mode.
+        """
+        state = self._initialize_state(self._to_langchain_messages(messages))
+        filters = self._fast_path_filters(state)
+
+        if filters is not None:
+            state['route'] = "fast_path"
+            state['chat_mode'] = "retrieval"
+            state['filters'] = filters
+        else:
+            state['route'] = "llm"
+            if self.workflow_mode == "sequential":
+                state['chat_mode'] = self._select_chat_mode(state['messages'])
+                response = self._extract_data(state['messages']) if state['chat_mode'] == "retrieval" else None
+            else:
+                state['chat_mode'], response = self._select_chat_mode_and_extract_data(state['messages'])
+            if state['chat_mode'] == "retrieval":
+                state['filters'] = response.dict() if response is not None else {}
+
+        self._count_route(state['route'])
+        return state
+
+    def answer(self, state: AgentState) -> str:
+        """Search the datasheets and generate the response of a planned turn, once its retrieved_data is set."""
+        if state['chat_mode'] == "retrieval" and self.text_search:
+            state = self._search_text(state)
+        return self._generate_response(state)['response']
+
+    def chat_stream(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        """
+        Streaming variant of chat that yields the response tokens as they arrive from the OpenAI streaming API.
+
+        Routing and retrieval run before the first token is yielded, so the time to the first token is the latency
+        the user perceives.
+        """
+        state = self._initialize_state(self._to_langchain_messages(messages), stream=True)
+
+        trace = self._start_trace()
+        final_state = None
+        try:
+            with tracing.activate(trace):
+                final_state = self.workflow.invoke(state)
+            yield from final_state['response_stream']
+        finally:
+            self._finish_trace(trace, final_state)
+
+    def _stream_tokens(self, response, key: Union[str, None],
+                       trace: Union[tracing.Trace, None] = None) -> Iterator[str]:
+        """
+        Yield the tokens of a streamed completion and cache the full response once the stream is complete.
+
+        The tokens are consumed outside of the context of the trace, so the stream and its token usage are recorded on
+        the trace passed explicitly.
+        """
+        start = time.perf_counter()
+        tokens = []
+        usage = None
+        for chunk in response:
+            usage = chunk.usage or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                tokens.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+
+        if trace is not None:
+            record = {"name": "stream_response"}
+            if usage is not None:
+                record.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+            trace.add_span(record, start)
+
+        if key is not None:
+            self.cache.set(key, "".join(tokens))
+
+
+_agents: Dict[tuple, LLMAgent] = {}
+_agents_lock = threading.Lock()
+
+
+@atexit.register
+def _close_agents() -> None:
+    with _agents_lock:
+        for agent in _agents.values():
+            agent.close()
+
+
+def get_agent(openai_api_key: str, catalog_path: str = DEFAULT_CATALOG_PATH,
+              workflow_mode: str = "sequential", fast_path: bool = True, cache_path: str = None,
+              tracing_enabled: bool = False, openai_base_url: str = None) -> LLMAgent:
+    """
+    Return the process-wide agent for an API key and catalog, creating it on first use.
+
+    The agent holds the shared catalog, the OpenAI clients, the cache and the compiled workflow. It keeps no
+    conversation state, which is passed to every chat call instead, so it can be shared by all sessions of the process.
+    The cache is kept in memory, or on disk if a cache_path is given. With tracing_enabled, the turns are traced by
+    the agent's tracer. openai_base_url points the agent to an OpenAI-compatible server.
+    """
+    key = (openai_api_key, catalog_path, workflow_mode, fast_path, cache_path, tracing_enabled, openai_base_url)
+    with _agents_lock:
+        if key not in _agents:
+            cache = DiskCache(cache_path) if cache_path else LRUCache()
+            _agents[key] = LLMAgent(openai_api_key=openai_api_key, catalog=get_catalog(catalog_path),
+                                    openai_base_url=openai_base_url, workflow_mode=workflow_mode,
+                                    fast_path=fast_path, cache=cache, tracer=Tracer() if tracing_enabled else None)
+        return _agents[key]
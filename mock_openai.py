@@ -0,0 +1,249 @@
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Union
+
+
+def default_arguments(schema: dict, definitions: dict = None) -> Union[dict, list, str, float, int, bool, None]:
+    """Build the smallest valid value for a JSON schema, e.g. the first enum value or None for optional fields."""
+    definitions = definitions if definitions is not None else schema.get('$defs', {})
+
+    if '$ref' in schema:
+        return default_arguments(definitions[schema['$ref'].split('/')[-1]], definitions)
+    if 'anyOf' in schema:
+        if any(option.get('type') == 'null' for option in schema['anyOf']):
+            return None
+        return default_arguments(schema['anyOf'][0], definitions)
+    if 'enum' in schema:
+        return schema['enum'][0]
+    if 'const' in schema:
+        return schema['const']
+
+    schema_type = schema.get('type')
+    if schema_type == 'object':
+        return {name: default_arguments(property_schema, definitions)
+                for name, property_schema in schema.get('properties', {}).items()}
+    if schema_type == 'array':
+        return [default_arguments(schema.get('items', {}), definitions)] * schema.get('minItems', 0)
+    if schema_type == 'string':
+        return "2024-01-01" if schema.get('format') == 'date' else ""
+    if schema_type in ('number', 'integer'):
+        return 0
+    if schema_type == 'boolean':
+        return False
+    return None
+
+
+def default_responder(request: dict) -> str:
+    """Answer structured requests with default tool arguments and free-text requests with a fixed sentence."""
+    if request.get('tools'):
+        return json.dumps(default_arguments(request['tools'][0]['function']['parameters']))
+    return "Das ist eine Antwort des lokalen Mock Servers."
+
+
+class RecordedResponder:
+    """
+    Replays recorded structured responses for known user messages, e.g. the queries of a benchmark corpus.
+
+    A recording holds the 'chat_mode' and the 'extract_data' filters of a user message. The latest recorded message
+    found in the prompt is answered with its recording, all other requests and the fields missing from a recording are
+    answered like the default_responder.
+    """
+
+    def __init__(self, recordings: Dict[str, dict], answer: str = "Das ist eine Antwort des lokalen Mock Servers."):
+        self.recordings = recordings
+        self.answer = answer
+
+    def recording(self, prompt: str) -> Union[dict, None]:
+        positions = {message: prompt.rfind(message) for message in self.recordings}
+        message = max(positions, key=positions.get, default=None)
+        return self.recordings[message] if message is not None and positions[message] >= 0 else None
+
+    def __call__(self, request: dict) -> str:
+        if not request.get('tools'):
+            return self.answer
+
+        parameters = request['tools'][0]['function']['parameters']
+        arguments = default_arguments(parameters)
+        content = request['messages'][-1]['content']
+        recording = self.recording(content if isinstance(content, str) else json.dumps(content, ensure_ascii=False))
+        if recording is None:
+            return json.dumps(arguments)
+
+        extract_data = recording.get('extract_data') or {}
+        if 'chat_mode' in arguments:
+            arguments['chat_mode'] = recording['chat_mode']
+        if 'extract_data' in arguments and recording['chat_mode'] == "retrieval":
+            definitions = parameters.get('$defs', {})
+            arguments['extract_data'] = {**default_arguments(definitions['ExtractData'], definitions), **extract_data}
+        elif request['tools'][0]['function']['name'] == "ExtractData":
+            arguments.update(extract_data)
+        return json.dumps(arguments)
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    # every request opens a connection, the default backlog of 5 drops connections of many concurrent sessions
+    request_queue_size = 128
+
+
+class MockOpenAIServer:
+    """
+    A local OpenAI-compatible chat completions server for offline testing and benchmarking.
+
+    Structured requests (with 'tools', as sent by instructor) are answered with a tool call, all others with a
+    message. Streaming requests are answered as server-sent events with one chunk per token, followed by a usage chunk
+    if requested with stream_options.
+
+    Usage:
+        with MockOpenAIServer(latency=0.2) as server:
+            client = OpenAI(api_key="mock", base_url=server.base_url)
+    """
+
+    def __init__(self, responder: Callable[[dict], str] = default_responder, host: str = "127.0.0.1",
+                 port: int = 0, latency: float = 0.0, token_latency: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 429, seed: int = 0, error_statuses: List[Union[int, None]] = ()):
+        self.responder = responder
+        # seconds before the first token and between two streamed tokens
+        self.latency = latency
+        self.token_latency = token_latency
+        # fraction of requests failing with error_status, e.g. to exercise rate limit and server error handling
+        self.error_rate = error_rate
+        self.error_status = error_status
+        # statuses the first requests fail with one by one, e.g. [429, 500] to fail the first two requests, None
+        # lets a request succeed
+        self.error_statuses = list(error_statuses)
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = []
+        self._httpd = _MockHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                with server._lock:
+                    server.requests.append(request)
+                    if server.error_statuses:
+                        error_status = server.error_statuses.pop(0)
+                    elif server._random.random() < server.error_rate:
+                        error_status = server.error_status
+                    else:
+                        error_status = None
+                    server.errors += error_status is not None
+                time.sleep(server.latency)
+
+                if error_status is not None:
+                    self._send_json({"error": {"message": "Mock error", "type": "mock_error", "code": None}},
+                                    status=error_status)
+                    return
+
+                reply = server.responder(request)
+                if request.get('stream'):
+                    self._stream(request, reply)
+                else:
+                    self._send_json(server.completion(request, reply))
+
+            def _send_json(self, body: dict, status: int = 200):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, request: dict, reply: str):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                for index, token in enumerate(re.findall(r"\s*\S+", reply)):
+                    if index:
+                        time.sleep(server.token_latency)
+                    self._send_event(server.chunk(request, {"content": token}))
+                self._send_event(server.chunk(request, {}, finish_reason="stop"))
+                if (request.get('stream_options') or {}).get('include_usage'):
+                    self._send_event({**server.chunk(request, {}), "choices": [],
+                                      "usage": server.usage(request, reply)})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def _send_event(self, body: dict):
+                self.wfile.write(f"data: {json.dumps(body)}\n\n".encode())
+                self.wfile.flush()
+
+        return Handler
+
+    @staticmethod
+    def usage(request: dict, reply: str) -> dict:
+        """Estimate token usage with the common four characters per token rule of thumb."""
+        prompt_tokens = len(json.dumps(request.get('messages', []))) // 4
+        completion_tokens = max(1, len(reply) // 4)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    @staticmethod
+    def completion(request: dict, reply: str) -> dict:
+        if request.get('tools'):
+            message = {"role": "assistant", "content": None, "tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": request['tools'][0]['function']['name'], "arguments": reply},
+            }]}
+            finish_reason = "tool_calls"
+        else:
+            message = {"role": "assistant", "content": reply}
+            finish_reason = "stop"
+
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get('model', 'mock'),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": MockOpenAIServer.usage(request, reply),
+        }
+
+    @staticmethod
+    def chunk(request: dict, delta: dict, finish_reason: str = None) -> dict:
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get('model', 'mock'),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
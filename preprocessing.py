@@ -1,154 +1,403 @@
+import argparse
 import base64
+import functools
+import hashlib
 import json
 import os
+import random
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
-from io import BytesIO
-from typing import List, Union
+from typing import Callable, Dict, List, Literal, Tuple, Type, Union
 
 import fitz
 import instructor
+import openai
 import streamlit as st
-from PIL import Image
 from openai import OpenAI
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError, create_model
 
+from catalog import DEFAULT_CATALOG_PATH, Catalog
+from fulltext import build_fulltext_index, fulltext_index_path
 
-def custom_json_encoder(obj):
-    """Custom JSON encoder for handling non-serializable types."""
-    if isinstance(obj, date):
-        return obj.isoformat()  # Convert date to ISO format
-    raise TypeError(f'Object of type {obj.__class__.__name__} is not JSON serializable')
-
+INFO_TYPES = ["name", "electrical_data", "size_and_weight", "temperature_data", "lifetime_data",
+              "additional_product_data", "usage_data", "environment_data"]
 
-def dicts_to_jsonl(data_list: List[dict], dir_path: str, filename: str) -> None:
-    """Save a list of dictionaries to a JSONL file in a specified directory."""
-    os.makedirs(dir_path, exist_ok=True)
+# "text" parses the text layer of the datasheets and only extracts the fields it could not parse with the vision
+# model, "page" extracts all schemas of a datasheet page with one call (3 calls per PDF), "info_type" uses one call
+# per info type (8 calls per PDF)
+EXTRACTION_MODES = ("text", "page", "info_type")
 
-    file_path = os.path.join(dir_path, filename)
+# HTTP status codes of the OpenAI API that are worth retrying
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
 
-    if not file_path.endswith('.jsonl'):
-        file_path += '.jsonl'
+# Rough number of tokens of one vision extraction call (page image, prompt and structured response)
+TOKENS_PER_EXTRACTION = 1500
 
-    with open(file_path, 'w', encoding='utf-8') as out:
-        for ddict in data_list:
-            json_line = json.dumps(ddict, default=custom_json_encoder)  # Use custom encoder
-            out.write(json_line + '\n')
+# Version of the schemas and the text layer parser, increase it to re-extract all PDFs on the next ingestion
+EXTRACTOR_VERSION = 1
 
+# Minimum number of seconds between two checkpoints of the manifest and the replaced records during an ingestion
+CHECKPOINT_INTERVAL = 5.0
 
-def pdf_to_base64(pdf_path: str, page: int):
-    # Open the PDF
-    pdf_document = fitz.open(pdf_path)
 
-    # Get the first page
-    page = pdf_document.load_page(page)  # 0 means the first page
-
-    # Convert page to image
-    pix = page.get_pixmap()
+def custom_json_encoder(obj):
+    """Custom JSON encoder for handling non-serializable types."""
+    if isinstance(obj, date):
+        return obj.isoformat()  # Convert date to ISO format
+    raise TypeError(f'Object of type {obj.__class__.__name__} is not JSON serializable')
 
-    # Convert pixmap to PIL Image
-    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
 
-    # Convert image to base64
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
+# Define the schemas for the structured response
+class Name(BaseModel):
+    name: str = Field(description="Der Name, Titel oder die Bezeichnung des Leuchmittels")
+
+
+class ElectricalData(BaseModel):
+    nennstrom: float = Field(description="Der Nennstrom des Lechtmittels in Ampere")
+    min_stromsteuerbereich: int = Field(description="Das Minimum des Stromsteuerbereichs in Ampere")
+    max_stromsteuerbereich: int = Field(description="Das Maximum des Stromsteuerbereichs in Ampere")
+    nennleistung: float = Field(description="Die Nennleistung des Lechtmittels in Watt")
+    nennspannung: float = Field(description="Die Nennspannung des Lechtmittels in Volt")
+
+
+class SizeAndWeightData(BaseModel):
+    durchmesser: float = Field(description="Der Durchmesser des Lechtmittels in Millimeter")
+    laenge: float = Field(description="Die Länge des Lechtmittels in Millimeter")
+    laenge_sockel: float = Field(
+        description="Die Länge des Lechtmittels mit Sockel jedoch ohne Sockelstift in Millimeter")
+    abstand_lichtschwerpunkt: float = Field(
+        description="Der Abstand Lichtschwerpunkt (LCL) des Lechtmittels in Millimeter")
+    elektrodenabstand_kalt: float = Field(description="Der Elektrodenabstand kalt des Lechtmittels in Millimeter")
+    produktgewicht: float = Field(description="Das Produktgewicht des Lechtmittels in Gramm")
+    kabel_laenge: Union[float, None] = Field(
+        description="Falls vorhanden, die Kabellänge des Lechtmittels. Ansonsten None.")
+
+
+class TemperatureData(BaseModel):
+    max_temp: int = Field(
+        description="Die maximal zulässige Umgebungstemperatur Quetschung des Lechtmittels in Grad Celsius")
+
+
+class LifetimeData(BaseModel):
+    lifetime: int = Field(description="Die Lebensdauer des Lechtmittels in Stunden/h")
+    warranty: int = Field(description="Die Service Warranty Lifetime des Lechtmittels in Stunden/h")
+
+
+class AdditionalProductData(BaseModel):
+    sockel_anode: str = Field(description="Die Sockel Anode (Normbezeichnung) des Lechtmittels")
+    sockel_kathode: str = Field(description="Die Sockel Kathode (Normbezeichnung) des Lechtmittels")
+    anmerkung_produkt: str = Field(description="Die Anmerkung zum Produkt des Lechtmittels")
+
+
+class UsageData(BaseModel):
+    kuehlung: str = Field(description="Die Kühlung des Lechtmittels")
+    brennstellung: str = Field(description="Die Brennstellung des Lechtmittels")
+
+
+class EnvironmentData(BaseModel):
+    datum_deklaration: date = Field(description="Das Datum der Deklaration des Lechtmittels im DD-MMM-YYYY Format")
+    erzeugnisnummer: List[int] = Field(
+        description="Die Primäre Erzeugnisnummer(n) des Lechtmittels. Können eine oder mehrere Nummern getrennt duch '|' sein.",
+        min_items=1)
+    stoff_kandidatenliste: str = Field(description="Der Stoff der Kandidatenliste 1 des Lechtmittels")
+    stoff_cas_nr: str = Field(description="Die CAS Nr. des Stoffes 1 des Lechtmittels")
+    info_sicherer_gebrauch: str = Field(description="Die nformationen zum sicheren Gebrauch des Lechtmittels")
+    scip_deklarationsnummer: List[str] = Field(
+        description="Die SCIP Deklarationsnummer(n) des Lechtmittels. Können eine oder mehrere Nummern getrennt duch '|' sein.",
+        min_items=1)
 
-    # Close the PDF
-    pdf_document.close()
 
-    return img_str
+def combine_models(name: str, models: List[Type[BaseModel]]) -> Type[BaseModel]:
+    """Combine the fields of multiple schemas into one schema, keeping their order."""
+    fields = {}
+    for model in models:
+        for field_name, field in model.model_fields.items():
+            fields[field_name] = (field.annotation, field)
+    return create_model(name, **fields)
 
 
-def extract_structured_info_from_pdf(pdf_path: str, data_type: str, openai_api_key: str,
-                                     llm_model_name: str = "gpt-4o"):
-    # Define the schemas for the structured response
-    class Name(BaseModel):
-        name: str = Field(description="Der Name, Titel oder die Bezeichnung des Leuchmittels")
-
-    class ElectricalData(BaseModel):
-        nennstrom: float = Field(description="Der Nennstrom des Lechtmittels in Ampere")
-        min_stromsteuerbereich: int = Field(description="Das Minimum des Stromsteuerbereichs in Ampere")
-        max_stromsteuerbereich: int = Field(description="Das Maximum des Stromsteuerbereichs in Ampere")
-        nennleistung: float = Field(description="Die Nennleistung des Lechtmittels in Watt")
-        nennspannung: float = Field(description="Die Nennspannung des Lechtmittels in Volt")
-
-    class SizeAndWeightData(BaseModel):
-        durchmesser: float = Field(description="Der Durchmesser des Lechtmittels in Millimeter")
-        laenge: float = Field(description="Die Länge des Lechtmittels in Millimeter")
-        laenge_sockel: float = Field(
-            description="Die Länge des Lechtmittels mit Sockel jedoch ohne Sockelstift in Millimeter")
-        abstand_lichtschwerpunkt: float = Field(
-            description="Der Abstand Lichtschwerpunkt (LCL) des Lechtmittels in Millimeter")
-        elektrodenabstand_kalt: float = Field(description="Der Elektrodenabstand kalt des Lechtmittels in Millimeter")
-        produktgewicht: float = Field(description="Das Produktgewicht des Lechtmittels in Gramm")
-        kabel_laenge: Union[float, None] = Field(
-            description="Falls vorhanden, die Kabellänge des Lechtmittels. Ansonsten None.")
-
-    class TemperatureData(BaseModel):
-        max_temp: int = Field(
-            description="Die maximal zulässige Umgebungstemperatur Quetschung des Lechtmittels in Grad Celsius")
-
-    class LifetimeData(BaseModel):
-        lifetime: int = Field(description="Die Lebensdauer des Lechtmittels in Stunden/h")
-        warranty: int = Field(description="Die Service Warranty Lifetime des Lechtmittels in Stunden/h")
-
-    class AdditionalProductData(BaseModel):
-        sockel_anode: str = Field(description="Die Sockel Anode (Normbezeichnung) des Lechtmittels")
-        sockel_kathode: str = Field(description="Die Sockel Kathode (Normbezeichnung) des Lechtmittels")
-        anmerkung_produkt: str = Field(description="Die Anmerkung zum Produkt des Lechtmittels")
-
-    class UsageData(BaseModel):
-        kuehlung: str = Field(description="Die Kühlung des Lechtmittels")
-        brennstellung: str = Field(description="Die Brennstellung des Lechtmittels")
-
-    class EnvironmentData(BaseModel):
-        datum_deklaration: date = Field(description="Das Datum der Deklaration des Lechtmittels im DD-MMM-YYYY Format")
-        erzeugnisnummer: List[int] = Field(
-            description="Die Primäre Erzeugnisnummer(n) des Lechtmittels. Können eine oder mehrere Nummern getrennt duch '|' sein.",
-            min_items=1)
-        stoff_kandidatenliste: str = Field(description="Der Stoff der Kandidatenliste 1 des Lechtmittels")
-        stoff_cas_nr: str = Field(description="Die CAS Nr. des Stoffes 1 des Lechtmittels")
-        info_sicherer_gebrauch: str = Field(description="Die nformationen zum sicheren Gebrauch des Lechtmittels")
-        scip_deklarationsnummer: List[str] = Field(
-            description="Die SCIP Deklarationsnummer(n) des Lechtmittels. Können eine oder mehrere Nummern getrennt duch '|' sein.",
-            min_items=1)
-
-    if data_type == 'name':
-        response_model = Name
-        page = 0
-
-    elif data_type == 'electrical_data':
-        response_model = ElectricalData
-        page = 1
-
-    elif data_type == 'size_and_weight':
-        response_model = SizeAndWeightData
-        page = 1
-
-    elif data_type == 'temperature_data':
-        response_model = TemperatureData
-        page = 1
-
-    elif data_type == 'lifetime_data':
-        response_model = LifetimeData
-        page = 1
-
-    elif data_type == 'additional_product_data':
-        response_model = AdditionalProductData
-        page = 1
-
-    elif data_type == 'usage_data':
-        response_model = UsageData
-        page = 2
-
-    elif data_type == 'environment_data':
-        response_model = EnvironmentData
-        page = 2
+# The schema and the datasheet page (0-based) of every info type
+INFO_TYPE_SCHEMAS = {
+    "name": (Name, 0),
+    "electrical_data": (ElectricalData, 1),
+    "size_and_weight": (SizeAndWeightData, 1),
+    "temperature_data": (TemperatureData, 1),
+    "lifetime_data": (LifetimeData, 1),
+    "additional_product_data": (AdditionalProductData, 1),
+    "usage_data": (UsageData, 2),
+    "environment_data": (EnvironmentData, 2),
+}
+
+# One combined schema per datasheet page, so every page is extracted with a single call
+PAGE_SCHEMAS = {
+    page: combine_models(f"Page{page + 1}Data",
+                         [schema for schema, schema_page in INFO_TYPE_SCHEMAS.values() if schema_page == page])
+    for page in sorted({page for _, page in INFO_TYPE_SCHEMAS.values()})
+}
+
+# All fields in the order of the schemas
+FIELD_NAMES = [field_name for schema, _ in INFO_TYPE_SCHEMAS.values() for field_name in schema.model_fields]
+
+# The info type of every field
+FIELD_INFO_TYPES = {field_name: info_type for info_type, (schema, _) in INFO_TYPE_SCHEMAS.items()
+                    for field_name in schema.model_fields}
+
+# The region of every info type on its datasheet page as (x0, y0, x1, y1) relative to the page size, covering the
+# labels and values of the bundled datasheets with a margin
+INFO_TYPE_CLIPS = {
+    "name": (0.05, 0.08, 0.8, 0.21),
+    "electrical_data": (0.05, 0.14, 0.8, 0.25),
+    "size_and_weight": (0.05, 0.47, 0.8, 0.66),
+    "temperature_data": (0.05, 0.65, 0.8, 0.73),
+    "lifetime_data": (0.05, 0.68, 0.8, 0.79),
+    "additional_product_data": (0.05, 0.79, 0.8, 0.9),
+    "usage_data": (0.05, 0.08, 0.8, 0.25),
+    "environment_data": (0.05, 0.22, 0.8, 0.5),
+}
+
+
+class RenderOptions(BaseModel):
+    """How datasheet pages are rendered to the images sent to the vision model."""
+    # crop every page to the regions of the extracted info types instead of sending the whole page
+    clip: bool = True
+    dpi: int = Field(default=100, gt=0)
+    image_format: Literal["png", "jpeg"] = "png"
+    # only used for JPEG
+    jpeg_quality: int = Field(default=85, ge=1, le=100)
+
+
+def restrict_model(name: str, model: Type[BaseModel], field_names: List[str]) -> Type[BaseModel]:
+    """Create a schema with only the given fields of another schema."""
+    return create_model(name, **{field_name: (field.annotation, field)
+                                 for field_name, field in model.model_fields.items() if field_name in field_names})
+
+
+# Footnote markers after values, e.g. "171,0 mm 1)" or "Forciert  1)"
+FOOTNOTE_MARKER_PATTERN = re.compile(r"\s+\d\)$")
+# Footnotes below the values, e.g. "1) Abstand Sockelboden zu Elektrodenspitze (kalt)"
+FOOTNOTE_PATTERN = re.compile(r"^\d\)\s")
+# Numbers use a decimal comma, e.g. "1022,90 g"
+NUMBER_PATTERN = re.compile(r"^(\d+(?:,\d+)?)(?:\s*(\S+))?$")
+RANGE_PATTERN = re.compile(r"^(\d+(?:,\d+)?)\s*…\s*(\d+(?:,\d+)?)(?:\s*(\S+))?$")
+DATE_PATTERN = re.compile(r"^(\d{2})-(\d{2})-(\d{4})$")
+
+
+def parse_text(lines: List[str]) -> Union[str, None]:
+    return FOOTNOTE_MARKER_PATTERN.sub("", lines[0]).strip() or None
+
+
+def parse_paragraph(lines: List[str]) -> Union[str, None]:
+    return " ".join(lines) or None
+
+
+def parse_number(lines: List[str], unit: Union[str, None]) -> Union[float, None]:
+    match = NUMBER_PATTERN.match(FOOTNOTE_MARKER_PATTERN.sub("", lines[0]))
+    if match is None or match.group(2) not in (unit, None):
+        return None
+    return float(match.group(1).replace(",", "."))
+
+
+def parse_range(lines: List[str], bound: int, unit: str) -> Union[float, None]:
+    match = RANGE_PATTERN.match(FOOTNOTE_MARKER_PATTERN.sub("", lines[0]))
+    if match is None or match.group(3) not in (unit, None):
+        return None
+    return float(match.group(bound + 1).replace(",", "."))
+
+
+def parse_date(lines: List[str]) -> Union[date, None]:
+    match = DATE_PATTERN.match(lines[0])
+    if match is None:
+        return None
+    day, month, year = (int(group) for group in match.groups())
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def parse_list(lines: List[str]) -> Union[List[str], None]:
+    # long lists wrap after the separator
+    return [item.strip() for item in " ".join(lines).split("|") if item.strip()] or None
+
+
+# The label preceding the value of every field in the text layer of a datasheet and the parser of the value lines.
+# Parsers return None if the value does not match the expected format.
+TEXT_LAYER_FIELDS = {
+    "name": ("Produktdatenblatt", parse_text),
+    "nennstrom": ("Nennstrom", functools.partial(parse_number, unit="A")),
+    "min_stromsteuerbereich": ("Stromsteuerbereich", functools.partial(parse_range, bound=0, unit="A")),
+    "max_stromsteuerbereich": ("Stromsteuerbereich", functools.partial(parse_range, bound=1, unit="A")),
+    "nennleistung": ("Nennleistung", functools.partial(parse_number, unit="W")),
+    "nennspannung": ("Nennspannung", functools.partial(parse_number, unit="V")),
+    "durchmesser": ("Durchmesser", functools.partial(parse_number, unit="mm")),
+    "laenge": ("Länge", functools.partial(parse_number, unit="mm")),
+    "laenge_sockel": ("Länge mit Sockel jedoch ohne Sockelstift", functools.partial(parse_number, unit="mm")),
+    "abstand_lichtschwerpunkt": ("Abstand Lichtschwerpunkt (LCL)", functools.partial(parse_number, unit="mm")),
+    "elektrodenabstand_kalt": ("Elektrodenabstand kalt", functools.partial(parse_number, unit="mm")),
+    "produktgewicht": ("Produktgewicht", functools.partial(parse_number, unit="g")),
+    "kabel_laenge": ("Kabellänge", functools.partial(parse_number, unit="mm")),
+    "max_temp": ("Max. zulässige Umgebungstemp. Quetschung", functools.partial(parse_number, unit="°C")),
+    "lifetime": ("Lebensdauer", functools.partial(parse_number, unit="h")),
+    "warranty": ("Service Warranty Lifetime", functools.partial(parse_number, unit="h")),
+    "sockel_anode": ("Sockel Anode (Normbezeichnung)", parse_text),
+    "sockel_kathode": ("Sockel Kathode (Normbezeichnung)", parse_text),
+    "anmerkung_produkt": ("Anmerkung zum Produkt", parse_paragraph),
+    "kuehlung": ("Kühlung", parse_text),
+    "brennstellung": ("Brennstellung", parse_text),
+    "datum_deklaration": ("Datum der Deklaration", parse_date),
+    "erzeugnisnummer": ("Primäre Erzeugnisnummer", parse_list),
+    "stoff_kandidatenliste": ("Stoff der Kandidatenliste 1", parse_text),
+    "stoff_cas_nr": ("CAS Nr. des Stoffes 1", parse_text),
+    "info_sicherer_gebrauch": ("Informationen zum sicheren Gebrauch", parse_paragraph),
+    "scip_deklarationsnummer": ("SCIP Deklarationsnummer", parse_list),
+}
+
+# Section headings of the datasheets, which end the value of the preceding label
+TEXT_LAYER_HEADINGS = {"Technische Daten", "Elektrische Daten", "Abmessungen & Gewicht",
+                       "Temperaturen & Betriebsbedingungen", "Lebensdauer", "Zusätzliche Produktdaten",
+                       "Einsatzmöglichkeiten", "Umwelt Informationen", "Länderspezifische Informationen"}
+
+# Fields whose label is missing from some datasheets, with the value the catalog uses in that case
+TEXT_LAYER_DEFAULTS = {"kabel_laenge": None, "warranty": 0, "anmerkung_produkt": ""}
+
+TEXT_LAYER_STOP_LINES = TEXT_LAYER_HEADINGS | {label for label, _ in TEXT_LAYER_FIELDS.values()}
+
+
+def text_lines(page: fitz.Page, clip: fitz.Rect = None) -> List[str]:
+    return [line.strip() for line in page.get_text(clip=clip).split("\n") if line.strip()]
+
+
+def find_value_lines(lines: List[str], label: str) -> Union[List[str], None]:
+    """Return the lines following a label up to the next label, heading or footnote, None if the label is missing."""
+    for index, line in enumerate(lines):
+        # a label may repeat its section heading, e.g. "Lebensdauer"
+        if line != label or (index + 1 < len(lines) and lines[index + 1] == label):
+            continue
+        end = index + 1
+        while end < len(lines) and lines[end] not in TEXT_LAYER_STOP_LINES and not FOOTNOTE_PATTERN.match(lines[end]):
+            end += 1
+        return lines[index + 1:end] or None
+    return None
+
+
+def validate_fields(schema: Type[BaseModel], values: dict) -> dict:
+    """Validate values against the fields of a schema, dropping the values that fail validation."""
+    while values:
+        try:
+            return restrict_model(schema.__name__, schema, list(values))(**values).dict()
+        except ValidationError as error:
+            invalid_fields = {details['loc'][0] for details in error.errors()}
+            values = {field_name: value for field_name, value in values.items() if field_name not in invalid_fields}
+    return {}
+
+
+def parse_fields(schema: Type[BaseModel], lines: List[str]) -> dict:
+    """Parse and validate the fields of a schema from the text lines of its datasheet page."""
+    values = {}
+    for field_name in schema.model_fields:
+        label, parse = TEXT_LAYER_FIELDS[field_name]
+        value_lines = find_value_lines(lines, label)
+        if value_lines is None:
+            if field_name in TEXT_LAYER_DEFAULTS and lines:
+                values[field_name] = TEXT_LAYER_DEFAULTS[field_name]
+            continue
+        value = parse(value_lines)
+        if value is not None:
+            values[field_name] = value
+    return validate_fields(schema, values)
+
+
+def parse_text_layer(pdf_path: str) -> Tuple[dict, Dict[int, List[str]]]:
+    """
+    Parse the known layout of the text layer of a datasheet into the fields of the extraction schemas.
+
+    Every value is parsed from the lines following its label and validated against its schema. Optional labels
+    missing from a page with a text layer get their catalog default, all other fields that are missing or fail
+    parsing or validation are returned per page, e.g. to extract them with the vision model.
+
+    Parameters:
+    pdf_path (str): The path of the PDF.
+
+    Returns:
+    tuple: The parsed values and the names of the fields that could not be parsed per datasheet page (0-based).
+    """
+    pdf_document = fitz.open(pdf_path)
+    try:
+        pages = {page: text_lines(pdf_document.load_page(page)) for page in PAGE_SCHEMAS}
+    finally:
+        pdf_document.close()
 
-    # Get base64 encoded image
-    base64_image = pdf_to_base64(pdf_path=pdf_path, page=page)
+    data = {}
+    missing_fields = {}
+    for schema, page in INFO_TYPE_SCHEMAS.values():
+        # a section may continue on the next page, e.g. a long "Anmerkung zum Produkt"
+        # a page without a text layer is extracted with the vision model
+        lines = pages[page] + pages.get(page + 1, []) if pages[page] else []
+        parsed = parse_fields(schema, lines)
+        data.update(parsed)
+        missing_fields.setdefault(page, []).extend(field_name for field_name in schema.model_fields
+                                                   if field_name not in parsed)
+
+    return data, {page: field_names for page, field_names in missing_fields.items() if field_names}
+
+
+def clip_rect(page: fitz.Page, info_types: List[str]) -> fitz.Rect:
+    """The smallest rectangle of a page containing the regions of the given info types."""
+    regions = [INFO_TYPE_CLIPS[info_type] for info_type in info_types]
+    rect = page.rect
+    return fitz.Rect(rect.x0 + min(region[0] for region in regions) * rect.width,
+                     rect.y0 + min(region[1] for region in regions) * rect.height,
+                     rect.x0 + max(region[2] for region in regions) * rect.width,
+                     rect.y0 + max(region[3] for region in regions) * rect.height)
+
+
+def page_to_base64(page: fitz.Page, clip: fitz.Rect = None, render_options: RenderOptions = None) -> str:
+    """Render a page, or a region of it, directly to an encoded image and return it base64 encoded."""
+    render_options = render_options if render_options is not None else RenderOptions()
+    pix = page.get_pixmap(dpi=render_options.dpi, clip=clip)
+    if render_options.image_format == "jpeg":
+        image = pix.tobytes("jpeg", jpg_quality=render_options.jpeg_quality)
+    else:
+        image = pix.tobytes("png")
+    return base64.b64encode(image).decode()
+
+
+def pdf_to_base64(pdf_path: str, page: int, info_types: List[str] = None, render_options: RenderOptions = None):
+    return render_pages(pdf_path=pdf_path, pages=[page], info_types=info_types, render_options=render_options)[page]
+
+
+def render_pages(pdf_path: str, pages: List[int], info_types: List[str] = None,
+                 render_options: RenderOptions = None) -> Dict[int, str]:
+    """
+    Open a PDF once and render each of the given pages once to a base64 encoded image.
+
+    With render_options.clip, every page is cropped to the regions of the given info types on it (all by default).
+    """
+    render_options = render_options if render_options is not None else RenderOptions()
+    info_types = info_types if info_types is not None else INFO_TYPES
 
-    llm_client = instructor.from_openai(OpenAI(api_key=openai_api_key))
+    pdf_document = fitz.open(pdf_path)
+    try:
+        images = {}
+        for page in pages:
+            pdf_page = pdf_document.load_page(page)
+            page_info_types = [info_type for info_type in info_types if INFO_TYPE_SCHEMAS[info_type][1] == page]
+            clip = clip_rect(pdf_page, page_info_types) if render_options.clip and page_info_types else None
+            images[page] = page_to_base64(pdf_page, clip=clip, render_options=render_options)
+        return images
+    finally:
+        pdf_document.close()
+
+
+def extract_structured_info_from_image(base64_image: str, response_model: Type[BaseModel], openai_api_key: str,
+                                       llm_model_name: str = "gpt-4o", llm_client: instructor.Instructor = None,
+                                       image_format: str = "png"):
+    if llm_client is None:
+        llm_client = instructor.from_openai(OpenAI(api_key=openai_api_key))
 
     prompt = [
         {
@@ -158,7 +407,7 @@ def extract_structured_info_from_pdf(pdf_path: str, data_type: str, openai_api_k
         {
             "type": "image_url",
             "image_url": {
-                "url": f"data:image/jpeg;base64,{base64_image}"
+                "url": f"data:image/{image_format};base64,{base64_image}"
             }
         }
     ]
@@ -174,33 +423,528 @@ def extract_structured_info_from_pdf(pdf_path: str, data_type: str, openai_api_k
     return response
 
 
-def pdf_to_dict(pdf_path: str, openai_api_key: str, llm_model_name: str = "gpt-4o"):
+def extract_structured_info_from_pdf(pdf_path: str, data_type: str, openai_api_key: str,
+                                     llm_model_name: str = "gpt-4o", llm_client: instructor.Instructor = None,
+                                     render_options: RenderOptions = None):
+    response_model, page = INFO_TYPE_SCHEMAS[data_type]
+    render_options = render_options if render_options is not None else RenderOptions()
+
+    # Get base64 encoded image
+    base64_image = pdf_to_base64(pdf_path=pdf_path, page=page, info_types=[data_type], render_options=render_options)
+
+    return extract_structured_info_from_image(base64_image=base64_image, response_model=response_model,
+                                              openai_api_key=openai_api_key, llm_model_name=llm_model_name,
+                                              llm_client=llm_client, image_format=render_options.image_format)
+
+
+def extract_structured_info_from_pages(pdf_path: str, openai_api_key: str, llm_model_name: str = "gpt-4o",
+                                       llm_client: instructor.Instructor = None,
+                                       render_options: RenderOptions = None) -> List[BaseModel]:
+    """Extract all schemas of a PDF with one call per page, rendering every page only once."""
+    render_options = render_options if render_options is not None else RenderOptions()
+    images = render_pages(pdf_path=pdf_path, pages=list(PAGE_SCHEMAS), render_options=render_options)
+    return [extract_structured_info_from_image(base64_image=images[page], response_model=response_model,
+                                               openai_api_key=openai_api_key, llm_model_name=llm_model_name,
+                                               llm_client=llm_client, image_format=render_options.image_format)
+            for page, response_model in PAGE_SCHEMAS.items()]
+
+
+def fallback_schema(page: int, field_names: List[str]) -> Type[BaseModel]:
+    """The schema of the fields of a datasheet page the text layer parser could not extract."""
+    return restrict_model(f"Page{page + 1}Fallback", PAGE_SCHEMAS[page], field_names)
+
+
+def missing_info_types(missing_fields: Dict[int, List[str]]) -> List[str]:
+    """The info types of the fields the text layer parser could not extract, e.g. to clip the page images to them."""
+    info_types = {FIELD_INFO_TYPES[field_name] for field_names in missing_fields.values() for field_name in field_names}
+    return [info_type for info_type in INFO_TYPES if info_type in info_types]
+
+
+def extract_structured_info_from_text(pdf_path: str, openai_api_key: str, llm_model_name: str = "gpt-4o",
+                                      llm_client: instructor.Instructor = None,
+                                      render_options: RenderOptions = None) -> dict:
+    """Parse the text layer of a PDF and extract only the fields it could not parse from the page images."""
+    render_options = render_options if render_options is not None else RenderOptions()
+    data, missing_fields = parse_text_layer(pdf_path)
+    if missing_fields:
+        images = render_pages(pdf_path=pdf_path, pages=list(missing_fields),
+                              info_types=missing_info_types(missing_fields), render_options=render_options)
+        for page, field_names in missing_fields.items():
+            extracted_data = extract_structured_info_from_image(base64_image=images[page],
+                                                                response_model=fallback_schema(page, field_names),
+                                                                openai_api_key=openai_api_key,
+                                                                llm_model_name=llm_model_name, llm_client=llm_client,
+                                                                image_format=render_options.image_format)
+            data.update(extracted_data.dict())
+    return {field_name: data[field_name] for field_name in FIELD_NAMES}
+
+
+def pdf_to_dict(pdf_path: str, openai_api_key: str, llm_model_name: str = "gpt-4o",
+                llm_client: instructor.Instructor = None, extraction_mode: str = "text",
+                render_options: RenderOptions = None):
     data = {}
-    info_types = ["name", "electrical_data", "size_and_weight", "temperature_data", "lifetime_data",
-                  "additional_product_data", "usage_data", "environment_data"]
+    extraction_kwargs = dict(pdf_path=pdf_path, openai_api_key=openai_api_key, llm_model_name=llm_model_name,
+                             llm_client=llm_client, render_options=render_options)
+
+    if extraction_mode == "text":
+        return extract_structured_info_from_text(**extraction_kwargs)
 
-    for info_type in info_types:
-        extracted_data = extract_structured_info_from_pdf(pdf_path=pdf_path, data_type=info_type,
-                                                          openai_api_key=openai_api_key, llm_model_name=llm_model_name)
+    if extraction_mode == "page":
+        for extracted_data in extract_structured_info_from_pages(**extraction_kwargs):
+            data.update(extracted_data.dict())
+        return data
+
+    for info_type in INFO_TYPES:
+        extracted_data = extract_structured_info_from_pdf(data_type=info_type, **extraction_kwargs)
         data.update(extracted_data.dict())
 
     return data
 
 
+class RateLimiter:
+    """A thread-safe token bucket limiting the requests and tokens per minute across all ingestion workers."""
+
+    def __init__(self, requests_per_minute: Union[float, None] = 500,
+                 tokens_per_minute: Union[float, None] = 100_000):
+        # None disables the respective limit
+        self.limits = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.available = {name: limit for name, limit in self.limits.items() if limit is not None}
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = TOKENS_PER_EXTRACTION) -> None:
+        """Block until one request with the given number of tokens fits into the limits."""
+        needed = {"requests": 1, "tokens": tokens}
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                for name in self.available:
+                    refill = (now - self.updated_at) * self.limits[name] / 60
+                    self.available[name] = min(self.limits[name], self.available[name] + refill)
+                self.updated_at = now
+
+                # a request larger than the bucket only has to wait until the bucket is full
+                missing = {name: min(needed[name], self.limits[name]) - available
+                           for name, available in self.available.items()}
+                if all(amount <= 0 for amount in missing.values()):
+                    for name in self.available:
+                        self.available[name] -= needed[name]
+                    return
+                wait = max(amount * 60 / self.limits[name] for name, amount in missing.items() if amount > 0)
+            time.sleep(wait)
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Check whether an error, or one of its causes (instructor wraps OpenAI errors), is a 429, 5xx or network error."""
+    while error is not None:
+        if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in RETRYABLE_STATUS_CODES
+        error = error.__cause__
+    return False
+
+
+def call_with_retries(function: Callable, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+    """Call a function and retry it with exponential backoff and jitter on retryable OpenAI errors."""
+    for attempt in range(max_retries + 1):
+        try:
+            return function()
+        except Exception as error:
+            if attempt == max_retries or not is_retryable_error(error):
+                raise
+            time.sleep(min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+def print_progress(completed: int, total: int, description: str) -> None:
+    print(f"[{completed}/{total}] {description}", flush=True)
+
+
+def ingest_pdfs(pdf_paths: List[str], openai_api_key: str, llm_model_name: str = "gpt-4o", max_workers: int = 8,
+                rate_limiter: RateLimiter = None, max_retries: int = 5,
+                progress: Callable[[int, int, str], None] = print_progress,
+                openai_base_url: str = None,
+                extraction_mode: str = "text",
+                on_extracted: Callable[[str, dict], None] = None,
+                render_options: RenderOptions = None) -> Tuple[Dict[str, dict], Dict[str, BaseException]]:
+    """
+    Extract the data of multiple PDFs concurrently.
+
+    Every extraction call (one per datasheet page, or one per info type) is a task of a bounded worker pool sharing
+    one OpenAI client. In text mode, the text layers of all PDFs are parsed up front and only the pages with fields
+    the parser could not extract become tasks, restricted to these fields. All tasks pass a global rate limiter for
+    requests and tokens per minute and are retried with exponential backoff on 429 and 5xx errors. The pages of a PDF
+    are rendered once when its tasks are submitted; the number of submitted but unfinished tasks is bounded to keep the
+    rendered images in memory bounded. Every PDF is passed to on_extracted as soon as all of its tasks succeeded, e.g. to
+    checkpoint it.
+
+    Parameters:
+    pdf_paths (list): The paths of the PDFs.
+    openai_api_key (str): The OpenAI API key.
+    llm_model_name (str): The vision model used for the extraction.
+    max_workers (int): The maximum number of concurrent extraction calls.
+    rate_limiter (RateLimiter): The rate limiter shared by all workers, defaults to RateLimiter().
+    max_retries (int): The maximum number of retries per extraction call.
+    progress (callable): Called with (completed tasks, total tasks, description) after every task, None to disable.
+    openai_base_url (str): Optional OpenAI-compatible server, e.g. mock_openai.MockOpenAIServer.
+    extraction_mode (str): "text" to parse the text layer and extract only the missing fields with one call per page,
+                           "page" for one call per datasheet page or "info_type" for one call per info type.
+    on_extracted (callable): Called with (PDF path, extracted data) after every extracted PDF, None to disable. An
+                             exception fails the PDF.
+    render_options (RenderOptions): How the pages are rendered, defaults to RenderOptions().
+
+    Returns:
+    tuple: The extracted data per PDF path and the error per PDF path that could not be extracted.
+    """
+    if extraction_mode not in EXTRACTION_MODES:
+        raise ValueError(f"Extraction mode '{extraction_mode}' is not supported.")
+
+    rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+    render_options = render_options if render_options is not None else RenderOptions()
+
+    data = {pdf_path: {} for pdf_path in pdf_paths}
+    errors = {}
+    missing_fields = {}
+    if extraction_mode == "text":
+        for pdf_path in pdf_paths:
+            try:
+                data[pdf_path]["text layer"], missing_fields[pdf_path] = parse_text_layer(pdf_path)
+            except Exception as error:
+                # the PDF could not be opened
+                errors[pdf_path] = error
+
+    # the task names of a PDF in the order their results are merged
+    page_task_names = [f"page {page + 1}" for page in PAGE_SCHEMAS]
+    task_names = {"text": ["text layer"] + page_task_names, "page": page_task_names,
+                  "info_type": INFO_TYPES}[extraction_mode]
+
+    def tasks(pdf_path: str):
+        if extraction_mode == "text":
+            images = render_pages(pdf_path=pdf_path, pages=list(missing_fields[pdf_path]),
+                                  info_types=missing_info_types(missing_fields[pdf_path]),
+                                  render_options=render_options)
+            for page, field_names in missing_fields[pdf_path].items():
+                yield f"page {page + 1}", functools.partial(extract_structured_info_from_image,
+                                                            base64_image=images[page],
+                                                            response_model=fallback_schema(page, field_names),
+                                                            image_format=render_options.image_format,
+                                                            **extraction_kwargs)
+        elif extraction_mode == "page":
+            images = render_pages(pdf_path=pdf_path, pages=list(PAGE_SCHEMAS), render_options=render_options)
+            for task_name, (page, response_model) in zip(task_names, PAGE_SCHEMAS.items()):
+                yield task_name, functools.partial(extract_structured_info_from_image, base64_image=images[page],
+                                                   response_model=response_model,
+                                                   image_format=render_options.image_format, **extraction_kwargs)
+        else:
+            for info_type in INFO_TYPES:
+                yield info_type, functools.partial(extract_structured_info_from_pdf, pdf_path=pdf_path,
+                                                   data_type=info_type, render_options=render_options,
+                                                   **extraction_kwargs)
+
+    pdf_paths_to_extract = [pdf_path for pdf_path in pdf_paths if pdf_path not in errors]
+    # the number of unfinished tasks per PDF
+    remaining = {pdf_path: len(missing_fields[pdf_path]) if extraction_mode == "text" else len(task_names)
+                 for pdf_path in pdf_paths_to_extract}
+    total = sum(remaining.values())
+    completed = 0
+
+    # the client is only needed if there are calls, so text layers can be ingested without an API key
+    if total:
+        # retries are handled by call_with_retries, so they respect the rate limiter
+        llm_client = instructor.from_openai(OpenAI(api_key=openai_api_key, base_url=openai_base_url, max_retries=0))
+        extraction_kwargs = dict(openai_api_key=openai_api_key, llm_model_name=llm_model_name, llm_client=llm_client)
+    lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(2 * max_workers)
+
+    def run(extract: Callable):
+        try:
+            def call():
+                rate_limiter.acquire()
+                return extract()
+
+            return call_with_retries(call, max_retries=max_retries)
+        finally:
+            in_flight.release()
+
+    # merge the tasks in a fixed order and keep the order of the schema fields, so the keys of the records do not
+    # depend on the completion order or the fields extracted by the vision model
+    def merge(pdf_data: dict) -> dict:
+        merged = {key: value for task_name in task_names for key, value in pdf_data.get(task_name, {}).items()}
+        return {field_name: merged[field_name] for field_name in FIELD_NAMES}
+
+    def finish(pdf_path: str):
+        # called with the lock held, so on_extracted is never called concurrently
+        if on_extracted is not None and pdf_path not in errors:
+            try:
+                on_extracted(pdf_path, merge(data[pdf_path]))
+            except Exception as error:
+                errors.setdefault(pdf_path, error)
+
+    def record(pdf_path: str, task_name: str, result: Union[BaseModel, None], error: Union[BaseException, None]):
+        nonlocal completed
+        with lock:
+            completed += 1
+            remaining[pdf_path] -= 1
+            if error is None:
+                data[pdf_path][task_name] = result.dict()
+                description = f"{os.path.basename(pdf_path)}: {task_name}"
+            else:
+                errors.setdefault(pdf_path, error)
+                description = f"{os.path.basename(pdf_path)}: {task_name} failed ({error})"
+            if remaining[pdf_path] == 0:
+                finish(pdf_path)
+            if progress is not None:
+                progress(completed, total, description)
+
+    def on_done(pdf_path: str, task_name: str):
+        return lambda future: record(pdf_path, task_name, None if future.exception() else future.result(),
+                                     future.exception())
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for pdf_path in pdf_paths_to_extract:
+            if remaining[pdf_path] == 0:
+                # the text layer contained all fields
+                with lock:
+                    finish(pdf_path)
+                continue
+            try:
+                for task_name, extract in tasks(pdf_path):
+                    in_flight.acquire()
+                    executor.submit(run, extract).add_done_callback(on_done(pdf_path, task_name))
+            except Exception as error:
+                # the PDF could not be opened or rendered
+                with lock:
+                    errors.setdefault(pdf_path, error)
+
+    return {pdf_path: merge(pdf_data) for pdf_path, pdf_data in data.items() if pdf_path not in errors}, errors
+
+
+def file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def write_atomically(path: str, content: str) -> None:
+    """Replace a file by writing to a temporary file in the same directory and renaming it."""
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, suffix='.tmp', delete=False) as file:
+        try:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        except BaseException:
+            os.remove(file.name)
+            raise
+    os.replace(file.name, path)
+
+
+class IngestionStore:
+    """
+    The records of a JSONL catalog keyed by the file name of their PDF, together with a manifest of the content hash
+    and the extractor each record was extracted with.
+
+    New records are appended and flushed to disk one by one. Changed records are kept in memory and, like the
+    manifest, written at checkpoints at most every checkpoint_interval seconds and by checkpoint(), so re-extracting
+    all PDFs rewrites the whole file only a few times. Removed records atomically replace the whole file at once. The
+    manifest is atomically replaced after the records, so a record without a manifest entry (e.g. after a crash between
+    two checkpoints) is extracted again, and a line torn by a crash during an append is dropped.
+    """
+
+    def __init__(self, jsonl_path: str, manifest_path: str = None, checkpoint_interval: float = CHECKPOINT_INTERVAL):
+        self.jsonl_path = jsonl_path
+        self.manifest_path = manifest_path or os.path.splitext(jsonl_path)[0] + ".manifest.json"
+        self.checkpoint_interval = checkpoint_interval
+        self.records = {}
+        self._lock = threading.Lock()
+        # whether records were replaced in memory or the manifest changed since the last checkpoint
+        self._records_changed = False
+        self._manifest_changed = False
+        self._checkpointed_at = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+
+        content = ""
+        if os.path.exists(jsonl_path):
+            with open(jsonl_path, encoding='utf-8') as file:
+                content = file.read()
+        torn = bool(content) and not content.endswith("\n")
+        for line in content.splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                torn = True
+                continue
+            self.records[record['file_name']] = record
+        if torn:
+            self._write_records()
+
+        manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding='utf-8') as file:
+                manifest = json.load(file)
+        self.manifest = {file_name: entry for file_name, entry in manifest.items() if file_name in self.records}
+
+    def is_current(self, file_name: str, sha256: str, extractor: str) -> bool:
+        """Check whether the record of a PDF was extracted from the same content with the same extractor."""
+        return self.manifest.get(file_name) == {"sha256": sha256, "extractor": extractor}
+
+    def save(self, file_name: str, record: dict, sha256: str, extractor: str) -> None:
+        """Append or replace the record of a PDF and enter it in the manifest at the next checkpoint."""
+        with self._lock:
+            replace = file_name in self.records
+            self.records[file_name] = record
+            if replace:
+                self._records_changed = True
+            else:
+                with open(self.jsonl_path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(record, default=custom_json_encoder) + "\n")
+                    file.flush()
+                    os.fsync(file.fileno())
+            self.manifest[file_name] = {"sha256": sha256, "extractor": extractor}
+            self._manifest_changed = True
+            if time.monotonic() - self._checkpointed_at >= self.checkpoint_interval:
+                self._checkpoint()
+
+    def remove(self, file_names: List[str]) -> None:
+        """Remove the records of PDFs, e.g. because they were deleted."""
+        with self._lock:
+            file_names = [file_name for file_name in file_names if file_name in self.records]
+            if not file_names:
+                return
+            for file_name in file_names:
+                del self.records[file_name]
+                self.manifest.pop(file_name, None)
+            self._records_changed = self._manifest_changed = True
+            self._checkpoint()
+
+    def checkpoint(self) -> None:
+        """Write the replaced records and the manifest, e.g. at the end of an ingestion."""
+        with self._lock:
+            self._checkpoint()
+
+    def _checkpoint(self) -> None:
+        if self._records_changed:
+            self._write_records()
+            self._records_changed = False
+        if self._manifest_changed:
+            self._write_manifest()
+            self._manifest_changed = False
+        self._checkpointed_at = time.monotonic()
+
+    def _write_records(self) -> None:
+        write_atomically(self.jsonl_path, "".join(json.dumps(record, default=custom_json_encoder) + "\n"
+                                                  for record in self.records.values()))
+
+    def _write_manifest(self) -> None:
+        write_atomically(self.manifest_path, json.dumps(self.manifest, indent=2, sort_keys=True) + "\n")
+
+
 def pdfs_to_jsonl(pdfs_dir: str, jsonl_dir: str, jsonl_filename: str, openai_api_key: str,
-                  llm_model_name: str = "gpt-4o"):
-    data_dict_list = []
-    for file in os.listdir(pdfs_dir):
-        if file.lower().endswith('.pdf'):
-            pdf_path = os.path.join(pdfs_dir, file)
-            file_name = pdf_path.split("/")[-1]
-            data_dict = pdf_to_dict(pdf_path=pdf_path, openai_api_key=openai_api_key, llm_model_name=llm_model_name)
-            data_dict['file_name'] = file_name
-            data_dict_list.append(data_dict)
-
-    dicts_to_jsonl(data_list=data_dict_list, dir_path=jsonl_dir, filename=jsonl_filename)
-
-
-# extract information from multiple PDFs to a single JSONL file
-pdfs_to_jsonl(pdfs_dir=os.getcwd() + "/data", jsonl_dir=os.getcwd() + "/data", jsonl_filename="illuminants.jsonl",
-              openai_api_key=st.secrets["OPENAI_API_KEY"], llm_model_name="gpt-4o")
+                  llm_model_name: str = "gpt-4o", max_workers: int = 8, rate_limiter: RateLimiter = None,
+                  openai_base_url: str = None, extraction_mode: str = "text", force: bool = False,
+                  progress: Callable[[int, int, str], None] = print_progress,
+                  render_options: RenderOptions = None) -> dict:
+    """
+    Incrementally extract the PDFs of a directory into a JSONL file.
+
+    Only PDFs whose content hash or extractor differs from the manifest next to the JSONL file are extracted, and
+    the extracted PDFs are checkpointed every few seconds, so a rerun processes only new or changed PDFs and resumes
+    after a crash or failure. Records of deleted PDFs are removed.
+
+    Parameters:
+    pdfs_dir (str): The directory of the PDFs.
+    jsonl_dir (str): The directory of the JSONL file.
+    jsonl_filename (str): The name of the JSONL file.
+    openai_api_key (str): The OpenAI API key, only needed if fields have to be extracted with the vision model.
+    llm_model_name (str): The vision model used for the extraction.
+    max_workers (int): The maximum number of concurrent extraction calls.
+    rate_limiter (RateLimiter): The rate limiter shared by all workers, defaults to RateLimiter().
+    openai_base_url (str): Optional OpenAI-compatible server, e.g. mock_openai.MockOpenAIServer.
+    extraction_mode (str): One of EXTRACTION_MODES.
+    force (bool): Whether to extract all PDFs, even if they are up to date.
+    progress (callable): Called with (completed tasks, total tasks, description) after every task, None to disable.
+    render_options (RenderOptions): How the pages are rendered, defaults to RenderOptions().
+
+    Returns:
+    dict: The number of PDFs that were up to date, extracted and removed.
+    """
+    if not jsonl_filename.endswith('.jsonl'):
+        jsonl_filename += '.jsonl'
+    store = IngestionStore(os.path.join(jsonl_dir, jsonl_filename))
+    extractor = f"{EXTRACTOR_VERSION}/{extraction_mode}/{llm_model_name}"
+
+    pdf_paths = [os.path.join(pdfs_dir, file) for file in sorted(os.listdir(pdfs_dir)) if file.lower().endswith('.pdf')]
+    hashes = {pdf_path: file_sha256(pdf_path) for pdf_path in pdf_paths}
+    file_names = {os.path.basename(pdf_path) for pdf_path in pdf_paths}
+    removed = [file_name for file_name in store.records if file_name not in file_names]
+    store.remove(removed)
+
+    pending = [pdf_path for pdf_path in pdf_paths
+               if force or not store.is_current(os.path.basename(pdf_path), hashes[pdf_path], extractor)]
+
+    def checkpoint(pdf_path: str, data: dict):
+        file_name = os.path.basename(pdf_path)
+        store.save(file_name, {**data, 'file_name': file_name}, hashes[pdf_path], extractor)
+
+    try:
+        _, errors = ingest_pdfs(pdf_paths=pending, openai_api_key=openai_api_key, llm_model_name=llm_model_name,
+                                max_workers=max_workers, rate_limiter=rate_limiter, progress=progress,
+                                openai_base_url=openai_base_url, extraction_mode=extraction_mode,
+                                on_extracted=checkpoint, render_options=render_options)
+    finally:
+        store.checkpoint()
+
+    if errors:
+        raise RuntimeError(f"Extraction failed for {len(errors)} PDF(s): "
+                           + ", ".join(os.path.basename(pdf_path) for pdf_path in errors))
+
+    return {"up_to_date": len(pdf_paths) - len(pending), "extracted": len(pending), "removed": len(removed)}
+
+
+def default_openai_api_key() -> Union[str, None]:
+    """The OpenAI API key from the environment or the Streamlit secrets, None if there is none."""
+    if os.environ.get("OPENAI_API_KEY"):
+        return os.environ["OPENAI_API_KEY"]
+    try:
+        return st.secrets.get("OPENAI_API_KEY")
+    except FileNotFoundError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the datasheet PDFs into the JSONL catalog. Only new or "
+                                                 "changed PDFs are extracted.")
+    parser.add_argument("--pdfs-dir", default="data")
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_PATH, help="The JSONL file of the catalog.")
+    parser.add_argument("--extraction-mode", default="text", choices=EXTRACTION_MODES)
+    parser.add_argument("--model", default="gpt-4o", help="The vision model used for the extraction.")
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--openai-base-url", default=None)
+    parser.add_argument("--force", action="store_true", help="Extract all PDFs, even if they are up to date.")
+    parser.add_argument("--dpi", type=int, default=RenderOptions().dpi)
+    parser.add_argument("--image-format", default=RenderOptions().image_format, choices=["png", "jpeg"])
+    parser.add_argument("--jpeg-quality", type=int, default=RenderOptions().jpeg_quality)
+    parser.add_argument("--no-clip", action="store_true", help="Send whole pages instead of the relevant regions.")
+    args = parser.parse_args()
+
+    jsonl_dir, jsonl_filename = os.path.split(os.path.abspath(args.catalog))
+    result = pdfs_to_jsonl(pdfs_dir=args.pdfs_dir, jsonl_dir=jsonl_dir, jsonl_filename=jsonl_filename,
+                           openai_api_key=default_openai_api_key(), llm_model_name=args.model,
+                           max_workers=args.max_workers, openai_base_url=args.openai_base_url,
+                           extraction_mode=args.extraction_mode, force=args.force,
+                           render_options=RenderOptions(clip=not args.no_clip, dpi=args.dpi,
+                                                        image_format=args.image_format,
+                                                        jpeg_quality=args.jpeg_quality))
+    print(f"{result['extracted']} PDF(s) extracted, {result['up_to_date']} up to date, {result['removed']} removed.")
+
+    # compile the catalog and build its full-text index offline, so the app starts without building them
+    catalog = Catalog(args.catalog)
+    index = build_fulltext_index(catalog.table, args.pdfs_dir, version=catalog.version)
+    index.save(fulltext_index_path(args.catalog))
+    print(f"Full-text index with {len(index.chunks)} chunks written to {fulltext_index_path(args.catalog)}.")
+
+
+if __name__ == "__main__":
+    main()
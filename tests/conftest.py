@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the app are imported from the repository root, independent of the working directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
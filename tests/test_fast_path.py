@@ -0,0 +1,52 @@
+import pytest
+
+from fast_path import extract_filters
+
+
+@pytest.mark.parametrize("query", [
+    # counts, superlatives and averages need the order_by, limit and aggregations of the LLM extractor
+    "Wie viele Leuchtmittel haben mindestens 1500W?",
+    "Anzahl der Leuchtmittel mit mindestens 1500W",
+    "Welches Leuchtmittel mit mindestens 1500W ist das leichteste?",
+    "Welche drei Leuchtmittel mit mindestens 1500W sind am hellsten?",
+    "Welches Leuchtmittel mit mehr als 3000 Stunden hat die meisten Watt?",
+    "Wie viel wiegen Leuchtmittel mit mindestens 1500W im Schnitt?",
+    "Was ist die durchschnittliche Lebensdauer der Leuchtmittel mit mindestens 1500W?",
+    "Sortiere die Leuchtmittel mit mindestens 1500W nach Gewicht",
+])
+def test_query_option_queries_are_declined(query):
+    assert extract_filters(query) is None
+
+
+def test_list_is_not_a_superlative():
+    assert extract_filters("Liste alle Leuchtmittel mit mindestens 1500W") == {
+        'nennleistung': {"operator": '>=', "value": 1500.0}}
+
+
+@pytest.mark.parametrize("query, filters", [
+    ("Wie viel wiegt XBO 4000 W/HS XL OFR?", {'name': "XBO 4000 W/HS XL OFR"}),
+    ("Welche Leuchte hat SCIP Nummer dd2ddf15-037b-4473-8156-97498e721fb3?",
+     {'scip_deklarationsnummer': "dd2ddf15-037b-4473-8156-97498e721fb3"}),
+    ("Welche Leuchte hat die Erzeugnissnummer 4008321299963?", {'erzeugnisnummer': 4008321299963}),
+    ("Gebe mir alle Leuchtmittel mit mindestens 1500W und einer Lebensdauer von mehr als 3000 Stunden?",
+     {'nennleistung': {"operator": '>=', "value": 1500.0}, 'lifetime': {"operator": '>', "value": 3000.0}}),
+    ("Leuchtmittel mit höchstens 1,5 A", {'nennstrom': {"operator": '<=', "value": 1.5}}),
+    ("Leuchtmittel mit weniger als 22.5 V", {'nennspannung': {"operator": '<', "value": 22.5}}),
+    # dots are German thousands separators
+    ("Alle Leuchtmittel mit mindestens 1.500 W", {'nennleistung': {"operator": '>=', "value": 1500.0}}),
+    ("Leuchtmittel mit mehr als 3.000 Stunden Lebensdauer", {'lifetime': {"operator": '>', "value": 3000.0}}),
+    ("Leuchtmittel mit über 1.000.000,5 Stunden", {'lifetime': {"operator": '>', "value": 1000000.5}}),
+])
+def test_unambiguous_queries(query, filters):
+    assert extract_filters(query) == filters
+
+
+@pytest.mark.parametrize("query", [
+    "Welche Leuchtmittel haben nicht mindestens 1500W?",
+    "Gebe mir 5 Leuchtmittel mit mindestens 1500W",
+    "Leuchtmittel mit mindestens 1500W und höchstens 2000W",
+    "Leuchtmittel mit 1.500",
+    "Hallo, wie geht es dir?",
+])
+def test_ambiguous_queries_are_declined(query):
+    assert extract_filters(query) is None
@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from filtering import FilterEngine, NameIndex
+
+CATALOG_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "data", "illuminants.jsonl")
+
+NAMES = ["XBO 1000 W/HS OFR", "XBO 1000 W/HSC OFR", "XBO 1000 W/HTP OFR", "XBO 2000 W/H XL OFR", "XBO 2000 W/HS OFR",
+         "XBO 2000 W/HTP XL OFR", "XBO 2000 W/SHSC OFR", "XBO 3000 W/H XL OFR", "XBO 3000 W/HS XL OFR",
+         "XBO 3000 W/HTP XL OFR", "XBO 4000 W/HS XL OFR", "XBO 4000 W/HSA OFR", "XBO 4000 W/HTP XL OFR",
+         "XBO 4500 W/HS XL OFR"]
+
+
+@pytest.fixture(scope="module")
+def name_index():
+    return NameIndex(np.array(NAMES, dtype=object))
+
+
+def names(rows):
+    return sorted(NAMES[row] for row in rows)
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("XBO 4000 W/HS XL OFR", ["XBO 4000 W/HS XL OFR"]),
+    ("xbo 4000w hs xl ofr", ["XBO 4000 W/HS XL OFR"]),
+    # a misspelled suffix still resolves to a single name
+    ("XBO 4000 W/HS XL OFF", ["XBO 4000 W/HS XL OFR"]),
+    ("XBO 4000 W/HTP XL", ["XBO 4000 W/HTP XL OFR"]),
+])
+def test_name_lookup_resolves_unique_names(name_index, query, expected):
+    assert names(name_index.lookup(query)) == expected
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("XBO 4000 W", ["XBO 4000 W/HS XL OFR", "XBO 4000 W/HSA OFR", "XBO 4000 W/HTP XL OFR"]),
+    ("XBO 1000 W", ["XBO 1000 W/HS OFR", "XBO 1000 W/HSC OFR", "XBO 1000 W/HTP OFR"]),
+    ("XBO 2000", ["XBO 2000 W/H XL OFR", "XBO 2000 W/HS OFR", "XBO 2000 W/HTP XL OFR", "XBO 2000 W/SHSC OFR"]),
+])
+def test_name_lookup_returns_all_variants_of_partial_names(name_index, query, expected):
+    assert names(name_index.lookup(query)) == expected
+
+
+def test_name_lookup_requires_the_numbers_of_the_query(name_index):
+    assert name_index.lookup("XBO 5000 W/HS XL OFR") == []
+
+
+def test_filter_by_partial_name_returns_all_variants():
+    engine = FilterEngine(pd.DataFrame({"name": NAMES, "nennleistung": np.arange(len(NAMES), dtype=float)}))
+    assert sorted(row["name"] for row in engine.filter({"name": "XBO 4000 W"})) == [
+        "XBO 4000 W/HS XL OFR", "XBO 4000 W/HSA OFR", "XBO 4000 W/HTP XL OFR"]
+
+
+@pytest.fixture(scope="module", params=[None, 1_000], ids=["catalog", "scaled 1000"])
+def catalog_df(request):
+    from benchmark import scale_catalog
+
+    df = pd.read_json(CATALOG_PATH, lines=True)
+    return df if request.param is None else scale_catalog(df, request.param)
+
+
+def same_records(left, right) -> bool:
+    if left is None or right is None:
+        return left is None and right is None
+    return pd.DataFrame(left).equals(pd.DataFrame(right))
+
+
+@pytest.mark.parametrize("filters", [
+    {"name": "XBO 4000 W/HS XL OFR"},
+    {"erzeugnisnummer": 4008321299963},
+    {"scip_deklarationsnummer": "dd2ddf15-037b-4473-8156-97498e721fb3"},
+    {"nennleistung": {"operator": ">=", "value": 1500.0}},
+    {"nennleistung": {"operator": ">=", "value": 1500.0}, "lifetime": {"operator": ">", "value": 3000.0}},
+    {"nennleistung": {"operator": "==", "value": 2000.0}},
+    {"nennleistung": {"operator": "!=", "value": 2000.0}},
+    {"produktgewicht": {"operator": "<", "value": 800.0}, "max_temp": {"operator": "<=", "value": 230.0}},
+    {"kuehlung": "Forciert", "nennstrom": {"operator": ">", "value": 20.0}},
+    {"brennstellung": "s20/p20"},
+    {"kuehlung": "Forciert", "nennleistung": None},
+    {"nennleistung": {"operator": ">", "value": 1e9}},
+    {},
+], ids=repr)
+def test_engine_matches_legacy_filter(catalog_df, filters):
+    from benchmark import legacy_filter_dataframe
+
+    assert same_records(FilterEngine(catalog_df).filter(filters), legacy_filter_dataframe(catalog_df, filters))
+
+
+def test_filter_dataframe_reuses_the_engine_of_a_dataframe(catalog_df):
+    from filtering import dataframe_engine, filter_dataframe
+
+    filters = {"nennleistung": {"operator": ">=", "value": 1500.0}}
+    assert dataframe_engine(catalog_df) is dataframe_engine(catalog_df)
+    assert same_records(filter_dataframe(catalog_df, filters), FilterEngine(catalog_df).filter(filters))
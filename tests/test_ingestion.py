@@ -0,0 +1,68 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from mock_openai import MockOpenAIServer
+from preprocessing import PAGE_SCHEMAS, RateLimiter, pdfs_to_jsonl
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "data")
+
+PDF_FILE_NAMES = ["ZMP_1007177_XBO_1600_W_HSC_XL_OFR.pdf", "ZMP_1007179_XBO_1600_W_XL_OFR.pdf"]
+
+
+@pytest.fixture
+def pdfs_dir(tmp_path):
+    directory = tmp_path / "pdfs"
+    directory.mkdir()
+    for file_name in PDF_FILE_NAMES:
+        shutil.copy(os.path.join(DATA_DIR, file_name), directory)
+    return str(directory)
+
+
+def ingest(pdfs_dir: str, jsonl_dir: str, server: MockOpenAIServer) -> dict:
+    # one worker, so the pages are extracted in order and the injected errors hit known requests
+    return pdfs_to_jsonl(pdfs_dir, jsonl_dir, "illuminants", openai_api_key="mock", max_workers=1,
+                         rate_limiter=RateLimiter(None, None), openai_base_url=server.base_url,
+                         extraction_mode="page", progress=None)
+
+
+def read_jsonl(path: str) -> list:
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def test_ingestion_retries_rate_limits_and_server_errors(pdfs_dir, tmp_path):
+    with MockOpenAIServer(error_statuses=[429, 500]) as server:
+        stats = ingest(pdfs_dir, str(tmp_path), server)
+
+        # the first page call failed twice and succeeded on its second retry
+        assert server.errors == 2
+        assert len(server.requests) == len(PDF_FILE_NAMES) * len(PAGE_SCHEMAS) + 2
+    assert stats == {"up_to_date": 0, "extracted": 2, "removed": 0}
+
+    records = read_jsonl(tmp_path / "illuminants.jsonl")
+    assert sorted(record['file_name'] for record in records) == PDF_FILE_NAMES
+    with open(tmp_path / "illuminants.manifest.json", encoding='utf-8') as file:
+        assert sorted(json.load(file)) == PDF_FILE_NAMES
+
+
+def test_failed_ingestion_resumes_from_the_checkpoint(pdfs_dir, tmp_path):
+    # a 400 is not retried, so the last page of the second PDF fails and the PDF is not checkpointed
+    error_statuses = [None] * (2 * len(PAGE_SCHEMAS) - 1) + [400]
+    with MockOpenAIServer(error_statuses=error_statuses) as server:
+        with pytest.raises(RuntimeError, match=PDF_FILE_NAMES[1]):
+            ingest(pdfs_dir, str(tmp_path), server)
+    assert [record['file_name'] for record in read_jsonl(tmp_path / "illuminants.jsonl")] == PDF_FILE_NAMES[:1]
+
+    # the rerun only extracts the failed PDF
+    with MockOpenAIServer() as server:
+        stats = ingest(pdfs_dir, str(tmp_path), server)
+        assert len(server.requests) == len(PAGE_SCHEMAS)
+    assert stats == {"up_to_date": 1, "extracted": 1, "removed": 0}
+    assert sorted(record['file_name'] for record in read_jsonl(tmp_path / "illuminants.jsonl")) == PDF_FILE_NAMES
+
+    with MockOpenAIServer() as server:
+        assert ingest(pdfs_dir, str(tmp_path), server) == {"up_to_date": 2, "extracted": 0, "removed": 0}
+        assert server.requests == []
@@ -0,0 +1,65 @@
+import glob
+import json
+import os
+from datetime import date
+
+import pytest
+
+from preprocessing import FIELD_NAMES, custom_json_encoder, parse_text_layer
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "data")
+
+CATALOG_PATH = os.path.join(DATA_DIR, "illuminants.jsonl")
+
+PDF_PATHS = sorted(glob.glob(os.path.join(DATA_DIR, "*.pdf")))
+
+
+def pdf_path(file_name: str) -> str:
+    return os.path.join(DATA_DIR, file_name)
+
+
+@pytest.mark.parametrize("file_name, expected", [
+    ("ZMP_1007177_XBO_1600_W_HSC_XL_OFR.pdf", {
+        "name": "XBO 1600 W/HSC XL OFR", "nennstrom": 65.0, "min_stromsteuerbereich": 50,
+        "max_stromsteuerbereich": 70, "nennspannung": 23.0, "kabel_laenge": 265.0, "lifetime": 2500,
+        # the datasheet has no service warranty lifetime and no product note
+        "warranty": 0, "anmerkung_produkt": "", "sockel_anode": "SK27/50", "sockel_kathode": "SFcX27-8",
+        "brennstellung": "s20/p20", "datum_deklaration": date(2022, 12, 16),
+        "erzeugnisnummer": [4008321299932, 4062172031721],
+        "scip_deklarationsnummer": ["49877f08-b6d6-461c-b64a-018655e8a602", "7a9913f5-169b-4ced-8b20-4a10b8b6fd73"],
+    }),
+    ("ZMP_1007187_XBO_2000_W_HTP_XL_OFR.pdf", {
+        "nennstrom": 70.0, "min_stromsteuerbereich": 50, "max_stromsteuerbereich": 85, "nennleistung": 2000.0,
+        "sockel_anode": "SFa25-14", "sockel_kathode": "SFc25-14",
+        "scip_deklarationsnummer": ["6289c378-8cb7-40d8-bd67-f74e947878c5"],
+    }),
+    ("ZMP_1007201_XBO_4500_W_HS_XL_OFR.pdf", {"nennstrom": 135.0, "min_stromsteuerbereich": 80}),
+    ("ZMP_1007184_XBO_2000_W_H_XL_OFR.pdf", {"sockel_anode": "SFaX27-10", "erzeugnisnummer": [4008321211781]}),
+    # the product note continues on the next page
+    ("ZMP_55851_XBO_10000_W_HS_OFR.pdf", {
+        "lifetime": 300, "warranty": 400,
+        "anmerkung_produkt": "OFR = Ozon-freie Version/H = horizontale Brennlage/S = kurze Bauform (short)",
+    }),
+    ("ZMP_55853_XBO_1000_W_HSC_OFR.pdf", {
+        "nennstrom": 50.0, "nennspannung": 19.0, "lifetime": 2000, "warranty": 3000,
+        "anmerkung_produkt": "OFR = Ozon-freie Version/H = horizontale Brennlage/S = kurze Bauform (short)/C= "
+                             "Sockel mit Kabel (cable)",
+    }),
+])
+def test_parse_text_layer(file_name, expected):
+    data, missing_fields = parse_text_layer(pdf_path(file_name))
+    assert missing_fields == {}
+    assert {field_name: data[field_name] for field_name in expected} == expected
+
+
+@pytest.mark.parametrize("path", PDF_PATHS, ids=os.path.basename)
+def test_catalog_matches_text_layer(path):
+    with open(CATALOG_PATH, encoding='utf-8') as file:
+        catalog = {record['file_name']: record for record in map(json.loads, file)}
+    data, missing_fields = parse_text_layer(path)
+
+    assert missing_fields == {}
+    assert list(data) == FIELD_NAMES
+    # compare the JSON representation, as stored in the catalog
+    record = {**json.loads(json.dumps(data, default=custom_json_encoder)), 'file_name': os.path.basename(path)}
+    assert catalog[os.path.basename(path)] == record
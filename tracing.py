@@ -0,0 +1,176 @@
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Union
+
+import numpy as np
+
+# Upper bounds in milliseconds of the latency histogram buckets, the last bucket is unbounded
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# Counters of a span that are summed up per turn and per span name
+COUNTERS = ("prompt_tokens", "completion_tokens", "cache_hits", "cache_misses")
+
+
+class Trace:
+    """
+    The trace of a single conversation turn: a list of timed spans, e.g. one per graph node and LLM call, with their
+    counters (tokens, cache hits and misses) and attributes (route, rows).
+    """
+
+    def __init__(self, **attributes):
+        self.turn_id = uuid.uuid4().hex
+        self.attributes = attributes
+        self.spans: List[dict] = []
+        self.wall_ms = None
+        self._start = time.perf_counter()
+        self._start_time = time.time()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[dict]:
+        """Time a block as a span of this trace, the yielded dict takes counters and attributes of the span."""
+        record = {"name": name, **attributes}
+        token = _current_span.set(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            _current_span.reset(token)
+            self.add_span(record, start)
+
+    def add_span(self, record: dict, start: float) -> None:
+        record["start_ms"] = (start - self._start) * 1000
+        record["wall_ms"] = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.spans.append(record)
+
+    def to_dict(self) -> dict:
+        totals = {counter: sum(span.get(counter, 0) for span in self.spans) for counter in COUNTERS}
+        return {"turn_id": self.turn_id, "start": self._start_time, "wall_ms": self.wall_ms, **self.attributes,
+                **totals, "spans": sorted(self.spans, key=lambda span: span["start_ms"])}
+
+
+_current_trace: ContextVar[Union[Trace, None]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Union[dict, None]] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def activate(trace: Union[Trace, None]) -> Iterator[None]:
+    """Make a trace the current trace of the block, so span and record add to it. A None trace disables tracing."""
+    token = _current_trace.set(trace)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+
+
+def current_trace() -> Union[Trace, None]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Union[dict, None]]:
+    """Time a block as a span of the current trace, a no-op yielding None without a current trace."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    with trace.span(name, **attributes) as record:
+        yield record
+
+
+def record(**values) -> None:
+    """Add counters (e.g. cache_hits=1) and set attributes (e.g. rows=3) of the current span, if there is one."""
+    current_span = _current_span.get()
+    if current_span is None:
+        return
+    for key, value in values.items():
+        if key in COUNTERS:
+            current_span[key] = current_span.get(key, 0) + value
+        else:
+            current_span[key] = value
+
+
+def record_usage(usage) -> None:
+    """Record the token usage of an OpenAI completion on the current span."""
+    if usage is not None:
+        record(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+
+class Tracer:
+    """
+    Collects the traces of conversation turns and aggregates the latencies and counters per span name.
+
+    The latest max_traces traces and max_samples latencies per span name are kept, so memory is bounded in long
+    running processes. Without a tracer nothing is timed or recorded, the instrumentation points only check that no
+    trace is active.
+
+    Usage:
+        tracer = Tracer()
+        agent = LLMAgent(openai_api_key, tracer=tracer)
+        agent.chat(messages)
+        tracer.export_json("traces.json")
+    """
+
+    def __init__(self, max_traces: int = 1000, max_samples: int = 10000):
+        self.traces = deque(maxlen=max_traces)
+        self.max_samples = max_samples
+        self._latencies: Dict[str, deque] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def start(self, **attributes) -> Trace:
+        return Trace(**attributes)
+
+    def finish(self, trace: Trace, **attributes) -> None:
+        """Complete a trace with its final attributes and add it to the traces and aggregates."""
+        trace.wall_ms = (time.perf_counter() - trace._start) * 1000
+        trace.attributes.update(attributes)
+        with self._lock:
+            self.traces.append(trace)
+            for name, wall_ms, counters in [("turn", trace.wall_ms, trace.spans)] + [
+                    (span["name"], span["wall_ms"], [span]) for span in trace.spans]:
+                self._latencies.setdefault(name, deque(maxlen=self.max_samples)).append(wall_ms)
+                totals = self._counters.setdefault(name, dict.fromkeys(COUNTERS, 0))
+                for counter in COUNTERS:
+                    totals[counter] += sum(span.get(counter, 0) for span in counters)
+
+    def histograms(self) -> Dict[str, dict]:
+        """Return per span name (and 'turn' for whole turns) the latency percentiles, histogram and counter totals."""
+        with self._lock:
+            latencies = {name: np.array(samples) for name, samples in self._latencies.items()}
+            counters = {name: dict(totals) for name, totals in self._counters.items()}
+
+        histograms = {}
+        for name, samples in latencies.items():
+            buckets = np.bincount(np.searchsorted(HISTOGRAM_BUCKETS_MS, samples),
+                                  minlength=len(HISTOGRAM_BUCKETS_MS) + 1)
+            histograms[name] = {
+                "count": int(samples.size),
+                "p50_ms": float(np.percentile(samples, 50)),
+                "p95_ms": float(np.percentile(samples, 95)),
+                "mean_ms": float(samples.mean()),
+                "max_ms": float(samples.max()),
+                "buckets": {f"<={bound}ms" if bound is not None else f">{HISTOGRAM_BUCKETS_MS[-1]}ms": int(count)
+                            for bound, count in zip(HISTOGRAM_BUCKETS_MS + (None,), buckets)},
+                **counters[name],
+            }
+        return histograms
+
+    def export(self) -> dict:
+        with self._lock:
+            traces = [trace.to_dict() for trace in self.traces]
+        return {"traces": traces, "histograms": self.histograms()}
+
+    def export_json(self, path: str = None) -> str:
+        """Export the traces and histograms as JSON, written to path if one is given."""
+        exported = json.dumps(self.export(), ensure_ascii=False, indent=2, default=str)
+        if path is not None:
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(exported)
+        return exported
@@ -1,6 +1,8 @@
+import itertools
+
 import streamlit as st
 
-from llm_agent import LLMAgent
+from llm_agent import get_agent
 
 # Custom CSS to style the logo, title, and custom agent icon with responsive design
 st.markdown(
@@ -74,8 +76,17 @@ st.markdown("""
     """, unsafe_allow_html=True
             )
 
-# Initialize LLMAgent
-agent = LLMAgent(openai_api_key=st.secrets["OPENAI_API_KEY"])
+# Get the LLMAgent shared by all sessions, the catalog and workflow are only loaded once per process and changes to
+# the catalog are reloaded in the background
+agent = get_agent(openai_api_key=st.secrets["OPENAI_API_KEY"],
+                  workflow_mode=st.secrets.get("WORKFLOW_MODE", "sequential"),
+                  cache_path=st.secrets.get("CACHE_PATH"),
+                  tracing_enabled=st.secrets.get("TRACING", False))
+
+# Export the per-turn traces and per-node latency histograms of all sessions
+if agent.tracer is not None:
+    st.sidebar.download_button("Traces exportieren", agent.tracer.export_json(), file_name="traces.json",
+                               mime="application/json")
 
 # Initialize chat history
 if "messages" not in st.session_state:
@@ -102,9 +113,10 @@ if prompt := st.chat_input("Frage nach Informationen über Leuchtmittel"):
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        message_placeholder = st.empty()
+        response_stream = agent.chat_stream(st.session_state.messages)
+        # show the spinner until the first token arrives, then render the tokens as they are streamed
         with st.spinner("💡 Erleuchtung in Arbeit..."):
-            response = agent.chat(st.session_state.messages)
-        message_placeholder.markdown(response)
+            first_token = next(response_stream, "")
+        response = st.write_stream(itertools.chain([first_token], response_stream))
     st.session_state.messages.append({"role": "assistant", "content": response})
     st.button('Chat neu starten', on_click=reset_conversation)